@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import uvicorn
+
+BASE_DIR = Path(__file__).resolve().parent
+
+TOPICS = {
+    "colors": "red yellow blue green orange purple primary secondary warm cool complementary hue shade tint palette",
+    "planets": "mercury venus earth mars jupiter saturn uranus neptune orbit moon ring gas giant rocky atmosphere",
+    "animals": "dog cat horse eagle salmon whale lion tiger mammal bird fish reptile habitat predator prey",
+    "sports": "football basketball tennis cricket swimming marathon goal team league coach referee score match",
+    "cooking": "flour butter sugar oven simmer roast bake knife recipe spice garlic onion sauce broth dough",
+}
+FILLER = "the a of and to in is with for on that by as from at this which are into over".split()
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[Dict], errors: int, duration: float) -> Dict:
+    latencies = [sample["latency"] * 1000 for sample in samples]
+    first_bytes = [sample["ttfb"] * 1000 for sample in samples if sample.get("ttfb") is not None]
+    summary = {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 2) if duration else 0.0,
+    }
+    for name, values in (("latency_ms", latencies), ("ttfb_ms", first_bytes)):
+        if values:
+            summary[name] = {
+                "p50": round(percentile(values, 50), 2),
+                "p95": round(percentile(values, 95), 2),
+                "p99": round(percentile(values, 99), 2),
+                "max": round(max(values), 2),
+            }
+    return summary
+
+
+def peak_rss() -> int:
+    # ru_maxrss is reported in KiB on Linux and bytes on macOS.
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size right now, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """
+    Samples the current RSS in a background thread while a scenario runs.
+
+    ``ru_maxrss`` only ever grows and counts everything the process loaded
+    before the scenario (Chroma, the embedding model, earlier scenarios), so
+    each scenario instead reports its peak over the RSS it started with.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> "RssSampler":
+        self.baseline = self.peak = current_rss()
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._record(current_rss())
+
+    def summary(self) -> Dict:
+        if self.baseline is None:
+            return {}
+        return {
+            "rss_baseline_bytes": self.baseline,
+            "rss_peak_bytes": self.peak,
+            "rss_growth_bytes": self.peak - self.baseline,
+        }
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record(current_rss())
+
+    def _record(self, rss: Optional[int]):
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+
+
+def synthetic_document(rng: random.Random, words: int) -> Tuple[str, str]:
+    topic = rng.choice(sorted(TOPICS))
+    vocabulary = TOPICS[topic].split()
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        length = rng.randint(8, 16)
+        tokens = [rng.choice(vocabulary) if rng.random() < 0.6 else rng.choice(FILLER) for _ in range(length)]
+        sentences.append(" ".join(tokens).capitalize() + ".")
+    return topic, " ".join(sentences)
+
+
+def write_corpus(directory: Path, documents: int, words: int, seed: int, prefix: str = "doc") -> List[Path]:
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(documents):
+        topic, text = synthetic_document(rng, words)
+        path = directory / f"{prefix}_{index:04d}_{topic}.txt"
+        path.write_text(text, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    asked = []
+    for index in range(count):
+        topic = rng.choice(sorted(TOPICS))
+        terms = rng.sample(TOPICS[topic].split(), 2)
+        asked.append(f"What does the document say about {terms[0]} and {terms[1]}? ({index})")
+    return asked
+
+
+def configure_environment(args: argparse.Namespace, workdir: Path):
+    """Point every path at a scratch directory and swap in the fake LLM before ``main`` is imported."""
+    os.environ.update({
+        "RAG_PROFILE": args.profile,
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_TOKENS": str(args.tokens),
+        "FAKE_LLM_TTFT_MS": str(args.ttft_ms),
+        "FAKE_LLM_TOKEN_MS": str(args.token_ms),
+        "DOCUMENTS_DIR": str(workdir / "documents"),
+        "VECTORSTORE_PATH": str(workdir / "vectorstore"),
+        "EMBEDDING_CACHE_DIR": str(workdir / "embedding_cache"),
+        "STATE_DB_PATH": str(workdir / "state" / "state.sqlite3"),
+        "AUTO_PREPARE_DOCUMENTS": "true",
+        "SESSION_GC_INTERVAL_SECONDS": "0",
+        "DOTENV_PATH": str(workdir / ".env"),
+    })
+    if not args.keep_rate_limits:
+        os.environ.update({
+            "LLM_REQUESTS_PER_MINUTE": "1000000",
+            "LLM_TOKENS_PER_MINUTE": "1000000000",
+            "LLM_MAX_CONCURRENCY": str(max(args.concurrency, 1) * 2),
+            "LLM_MAX_QUEUE": str(max(args.requests, 1)),
+        })
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def ask(client, question: str, use_cache: bool, session_id: Optional[str]) -> Dict:
+    started = time.perf_counter()
+    first_byte = None
+    body = []
+    async with client.stream(
+        "POST", "/ask", json={"question": question, "use_cache": use_cache, "session_id": session_id}
+    ) as response:
+        async for chunk in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            body.append(chunk)
+    text = b"".join(body).decode("utf-8", "replace")
+    if response.status_code != 200 or '"error"' in text or "[DONE]" not in text:
+        raise RuntimeError(f"HTTP {response.status_code}: {text[:200]}")
+    return {"latency": time.perf_counter() - started, "ttfb": first_byte}
+
+
+async def upload(client, path: Path, session_id: str, poll_interval: float = 0.05) -> Dict:
+    """Time from sending the file until its upload job reports completion."""
+    started = time.perf_counter()
+    with path.open("rb") as handle:
+        response = await client.post(
+            "/upload",
+            files={"file": (path.name, handle, "text/plain")},
+            data={"session_id": session_id},
+        )
+    if response.status_code != 202:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    accepted = time.perf_counter() - started
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/upload-status/{job_id}")).json()
+        if job.get("status") == "completed":
+            return {"latency": time.perf_counter() - started, "ttfb": accepted}
+        if job.get("status") == "failed":
+            raise RuntimeError(job.get("message"))
+        await asyncio.sleep(poll_interval)
+
+
+async def run_load(work: Callable[[int], Awaitable[Dict]], count: int, concurrency: int) -> Dict:
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    samples: List[Dict] = []
+    failures: List[str] = []
+
+    async def one(index: int):
+        async with semaphore:
+            try:
+                samples.append(await work(index))
+            except Exception as exc:
+                failures.append(str(exc))
+
+    with RssSampler() as memory:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(count)))
+        duration = time.perf_counter() - started
+    summary = summarize(samples, len(failures), duration)
+    summary.update(memory.summary())
+    if failures:
+        summary["first_error"] = failures[0]
+    return summary
+
+
+async def run_profile(args: argparse.Namespace) -> Dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"rag-bench-{args.profile}-"))
+    configure_environment(args, workdir)
+    write_corpus(workdir / "documents", args.documents, args.words, args.seed)
+    upload_files = write_corpus(workdir / "uploads", args.uploads, args.words, args.seed + 1, prefix="upload")
+
+    # main reads its configuration at import time, so import it only now.
+    sys.path.insert(0, str(BASE_DIR))
+    with RssSampler() as memory:
+        started = time.perf_counter()
+        import main
+
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            if serving.done():
+                serving.result()
+                raise RuntimeError("Server exited during startup")
+            await asyncio.sleep(0.05)
+        startup = time.perf_counter() - started
+
+    session_id = "default" if args.profile == "render" else None
+    results: Dict[str, Dict] = {"startup": {"duration_s": round(startup, 3), **memory.summary()}}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency * 2 + 4)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+            uncached = questions(args.requests, args.seed)
+            results["ask_uncached"] = await run_load(
+                lambda index: ask(client, uncached[index], False, session_id), args.requests, args.concurrency
+            )
+
+            popular = questions(args.cached_questions, args.seed + 2)
+            for question in popular:
+                await ask(client, question, True, session_id)
+            results["ask_cached"] = await run_load(
+                lambda index: ask(client, popular[index % len(popular)], True, session_id),
+                args.requests,
+                args.concurrency,
+            )
+
+            if upload_files:
+                results["upload"] = await run_load(
+                    lambda index: upload(client, upload_files[index], f"bench-{index}"),
+                    len(upload_files),
+                    args.upload_concurrency,
+                )
+    finally:
+        server.should_exit = True
+        await serving
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "profile": args.profile,
+        "peak_rss_bytes": peak_rss(),
+        "scenarios": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_profiles_in_subprocesses(args: argparse.Namespace, argv: List[str]) -> Dict:
+    """Run each profile in a fresh interpreter so imports and peak RSS do not mix."""
+    results = {}
+    for profile in ("render", "full"):
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as handle:
+            output = Path(handle.name)
+        command = [sys.executable, str(Path(__file__).resolve()), *argv, "--profile", profile, "--output", str(output)]
+        completed = subprocess.run(command)
+        if completed.returncode == 0:
+            results[profile] = json.loads(output.read_text(encoding="utf-8"))["profiles"][profile]
+        else:
+            results[profile] = {"profile": profile, "error": f"benchmark exited with status {completed.returncode}"}
+        output.unlink(missing_ok=True)
+    return results
+
+
+def strip_profile_arguments(argv: List[str]) -> List[str]:
+    cleaned = []
+    skip = False
+    for argument in argv:
+        if skip:
+            skip = False
+            continue
+        if argument in {"--profile", "--output"}:
+            skip = True
+            continue
+        if argument.startswith(("--profile=", "--output=")):
+            continue
+        cleaned.append(argument)
+    return cleaned
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark /ask and /upload end to end against the fake LLM backend and a synthetic corpus."
+    )
+    parser.add_argument("--profile", choices=["render", "full", "both"], default="render")
+    parser.add_argument("--documents", type=int, default=50, help="Synthetic documents indexed at startup")
+    parser.add_argument("--words", type=int, default=400, help="Words per synthetic document")
+    parser.add_argument("--requests", type=int, default=200, help="Questions per /ask scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--cached-questions", type=int, default=8, help="Distinct questions in the cached scenario")
+    parser.add_argument("--uploads", type=int, default=10)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens streamed by the fake LLM per answer")
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Use the configured LLM rate limits")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", type=Path, help="JSON results file (default: benchmark_results/<time>_<commit>.json)")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    if args.profile == "both":
+        profiles = run_profiles_in_subprocesses(args, strip_profile_arguments(sys.argv[1:]))
+    else:
+        profiles = {args.profile: asyncio.run(run_profile(args))}
+
+    report = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in {"output", "profile"}},
+        "profiles": profiles,
+    }
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = BASE_DIR / "benchmark_results" / f"{stamp}_{commit or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+
+    for name, result in profiles.items():
+        print(f"[{name}]")
+        for scenario, summary in result.get("scenarios", {}).items():
+            growth = summary.get("rss_growth_bytes")
+            rss = f" rss+={growth / 2**20:.1f} MiB" if growth is not None else ""
+            if scenario == "startup":
+                print(f"  startup       {summary['duration_s']} s{rss}")
+                continue
+            latency = summary.get("latency_ms", {})
+            ttfb = summary.get("ttfb_ms", {})
+            print(
+                f"  {scenario:<13} n={summary.get('requests', '-'):<5} err={summary.get('errors', 0):<3} "
+                f"p50={latency.get('p50', '-')} p95={latency.get('p95', '-')} p99={latency.get('p99', '-')} ms "
+                f"ttfb_p50={ttfb.get('p50', '-')} ms rps={summary.get('throughput_rps', '-')}{rss}"
+            )
+        if "error" in result:
+            print(f"  {result['error']}")
+        print(f"  peak RSS of the whole process {result.get('peak_rss_bytes', 0) / 2**20:.1f} MiB")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
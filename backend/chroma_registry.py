@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import chromadb
+from chromadb.api import ServerAPI
+from chromadb.api.rust import RustBindingsAPI
+from chromadb.api.shared_system_client import SharedSystemClient
+from chromadb.config import Settings, System
+from chromadb.telemetry.product import ProductTelemetryClient
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+HandleKey = Tuple[str, str]
+
+
+class ChromaRegistry:
+    """
+    Process-wide cache of Chroma clients and collection handles.
+
+    There is one ``PersistentClient`` per vector store path. Collection handles
+    are kept in LRU order, capped at ``capacity``, and dropped after
+    ``idle_seconds`` without use, so every anonymous session that ever asked a
+    question does not stay open forever. Dropping a handle does not free the
+    index Chroma loaded for it, so the clients run with an LRU segment cache
+    limited to ``memory_limit_bytes`` and Chroma's HNSW index cache is capped
+    at ``capacity`` indexes. Listeners registered with
+    ``on_evict`` are told which collection was dropped or discarded so callers
+    can release their own per-collection state.
+    """
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        memory_limit_bytes: Optional[int] = None,
+    ):
+        self.capacity = capacity if capacity is not None else int(os.getenv("CHROMA_MAX_OPEN_COLLECTIONS", "256"))
+        self.idle_seconds = (
+            idle_seconds if idle_seconds is not None else float(os.getenv("CHROMA_COLLECTION_IDLE_SECONDS", "900"))
+        )
+        self.memory_limit_bytes = (
+            memory_limit_bytes if memory_limit_bytes is not None
+            else int(os.getenv("CHROMA_MEMORY_LIMIT_BYTES", str(128 * 1024 * 1024)))
+        )
+        self.clients: Dict[str, chromadb.ClientAPI] = {}
+        self.handles: "OrderedDict[HandleKey, Tuple[object, float]]" = OrderedDict()
+        self.listeners: List[Callable[[str, str], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.idle_evictions = 0
+        self._lock = threading.RLock()
+
+    def client(self, path: Union[str, Path]):
+        key = str(Path(path).resolve())
+        with self._lock:
+            client = self.clients.get(key)
+            if client is None:
+                settings = self._settings(key)
+                self._start_system(key, settings)
+                client = chromadb.PersistentClient(path=key, settings=settings)
+                self.clients[key] = client
+            return client
+
+    def collection(self, path: Union[str, Path], name: str):
+        key = (str(Path(path).resolve()), name)
+        now = time.monotonic()
+        evicted: List[HandleKey] = []
+        with self._lock:
+            entry = self.handles.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.handles[key] = (entry[0], now)
+                self.handles.move_to_end(key)
+                collection = entry[0]
+            else:
+                self.misses += 1
+                collection = self.client(path).get_or_create_collection(name=name)
+                self.handles[key] = (collection, now)
+            evicted.extend(self._evict(now, keep=key))
+
+        self._notify(evicted)
+        return collection
+
+    def discard(self, path: Union[str, Path], name: Optional[str] = None):
+        """Forget one collection handle, or every handle under ``path``, and tell the listeners."""
+        root = str(Path(path).resolve())
+        with self._lock:
+            keys = [key for key in self.handles if key[0] == root and (name is None or key[1] == name)]
+            for key in keys:
+                del self.handles[key]
+        self._notify(keys, reason="Discarded")
+
+    def has_open_collections(self, path: Union[str, Path]) -> bool:
+        root = str(Path(path).resolve())
+        with self._lock:
+            return any(key[0] == root for key in self.handles)
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        self._notify(evicted)
+        return len(evicted)
+
+    def on_evict(self, listener: Callable[[str, str], None]):
+        self.listeners.append(listener)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "open_clients": len(self.clients),
+                "open_collections": len(self.handles),
+                "capacity": self.capacity,
+                "idle_seconds": self.idle_seconds,
+                "memory_limit_bytes": self.memory_limit_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle_evictions": self.idle_evictions,
+            }
+
+    def _settings(self, path: str) -> Settings:
+        settings = Settings(is_persistent=True, persist_directory=path)
+        if self.memory_limit_bytes > 0:
+            settings.chroma_segment_cache_policy = "LRU"
+            settings.chroma_memory_limit_bytes = self.memory_limit_bytes
+        return settings
+
+    def _start_system(self, path: str, settings: Settings):
+        """
+        Start Chroma's shared system for ``path`` before ``PersistentClient`` does.
+
+        Chroma's Rust API ignores the segment cache settings and sizes its HNSW
+        cache from the open-file limit (``RLIMIT_NOFILE // 5`` indexes), so it
+        is capped at ``capacity`` between construction and ``start()``.
+        """
+        if path in SharedSystemClient._identifier_to_system:
+            return
+        system = System(settings)
+        system.instance(ProductTelemetryClient)
+        api = system.instance(ServerAPI)
+        if isinstance(api, RustBindingsAPI):
+            api.hnsw_cache_size = max(min(api.hnsw_cache_size, self.capacity), 1)
+        system.start()
+        SharedSystemClient._identifier_to_system[path] = system
+
+    def _evict(self, now: float, keep: Optional[HandleKey] = None) -> List[HandleKey]:
+        evicted = []
+        # Oldest handles come first, so stop at the first one still in use.
+        while self.handles:
+            key, (_, last_used) = next(iter(self.handles.items()))
+            if key == keep:
+                break
+            if now - last_used > self.idle_seconds:
+                self.idle_evictions += 1
+            elif len(self.handles) > self.capacity:
+                self.evictions += 1
+            else:
+                break
+            del self.handles[key]
+            evicted.append(key)
+        return evicted
+
+    def _notify(self, evicted: List[HandleKey], reason: str = "Closed idle"):
+        for path, name in evicted:
+            logger.info("%s Chroma collection handle '%s'", reason, name)
+            for listener in self.listeners:
+                try:
+                    listener(path, name)
+                except Exception:
+                    logger.exception("Chroma eviction listener failed for '%s'", name)
+
+
+_shared_registry: Optional[ChromaRegistry] = None
+_shared_registry_lock = threading.Lock()
+
+
+def shared_chroma_registry() -> ChromaRegistry:
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = ChromaRegistry()
+        return _shared_registry
@@ -0,0 +1,320 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from settings import resolve_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+SCHEMA_VERSION = 2
+
+
+def chunk_store_path() -> Path:
+    return resolve_path("EMBEDDING_CACHE_DIR", "embedding_cache") / "chunks.sqlite3"
+
+
+class DocumentBusy(Exception):
+    """The document is being deleted from the shared collection; ingest it again shortly."""
+
+
+class ChunkStore:
+    """
+    Catalogue of the documents in the shared Chroma collection.
+
+    A document is keyed by the SHA-256 of the file plus the chunking settings.
+    Its chunks are stored once, in the shared collection, and each session
+    sees only the documents linked to its view (its collection name), so a
+    file already uploaded by any session costs a hash lookup and a link
+    instead of extraction, chunking and embedding. The chunk text itself
+    lives only in Chroma.
+
+    A document moves from ``staging`` (being ingested) to ``ready``
+    (published). ``collect`` marks documents for deletion as ``evicting``:
+    ready ones no session links to, least recently used first, once their
+    text passes ``max_bytes``, and staged ones whose ingest added no batch for
+    ``staging_ttl`` seconds. The caller deletes their chunks from Chroma and
+    then calls ``forget``.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        max_bytes: Optional[int] = None,
+        staging_ttl: float = 3600,
+    ):
+        self.path = Path(path) if path else chunk_store_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv("CHUNK_STORE_MAX_BYTES", str(128 * 1024 * 1024))
+        )
+        self.staging_ttl = staging_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._transaction(self._create_schema)
+
+    @staticmethod
+    def key(sha256: str, chunker: str) -> str:
+        return f"{sha256}:{chunker}"
+
+    def begin(self, sha256: str, chunker: str) -> Optional[Dict]:
+        """
+        Look a document up before ingesting it.
+
+        Returns the published document (``pages``, ``chunks``) to link, or
+        None after recording it as staging: the caller then ingests it into the
+        shared collection, calling ``stage`` per batch and ``publish`` at the
+        end. Two sessions ingesting the same file at once write identical rows.
+        """
+        key = self.key(sha256, chunker)
+
+        def lookup(conn: sqlite3.Connection) -> Optional[Dict]:
+            now = time.time()
+            row = conn.execute("SELECT state, pages, chunks FROM documents WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] == "evicting":
+                raise DocumentBusy(f"Document {sha256[:12]} is being removed from the shared collection")
+            if row is not None and row[0] == "ready":
+                conn.execute("UPDATE documents SET last_used = ? WHERE key = ?", (now, key))
+                return {"key": key, "pages": row[1], "chunks": row[2]}
+            conn.execute(
+                "INSERT INTO documents (key, sha256, state, pages, chunks, bytes, updated_at, last_used) "
+                "VALUES (?, ?, 'staging', 0, 0, 0, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET updated_at = excluded.updated_at",
+                (key, sha256, now, now),
+            )
+            return None
+
+        with self._lock:
+            document = self._transaction(lookup)
+            if document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return document
+
+    def stage(self, sha256: str, chunker: str):
+        """Note that a batch of a staging document was written, so ``collect`` leaves it alone."""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE documents SET updated_at = ? WHERE key = ? AND state = 'staging'",
+                (time.time(), self.key(sha256, chunker)),
+            )
+
+    def publish(self, sha256: str, chunker: str, pages: int, chunks: int, size: int):
+        """Mark a staging document whose ``chunks`` rows are all in the shared collection as ready."""
+        key = self.key(sha256, chunker)
+
+        def ready(conn: sqlite3.Connection):
+            updated = conn.execute(
+                "UPDATE documents SET state = 'ready', pages = ?, chunks = ?, bytes = ?, updated_at = ?, last_used = ? "
+                "WHERE key = ? AND state = 'staging'",
+                (pages, chunks, size, time.time(), time.time(), key),
+            ).rowcount
+            if not updated and conn.execute(
+                "SELECT 1 FROM documents WHERE key = ? AND state = 'ready'", (key,)
+            ).fetchone() is None:
+                # Collected as abandoned mid-ingest; never publish a partial document.
+                raise DocumentBusy(f"Document {sha256[:12]} was collected before it finished ingesting")
+
+        with self._lock:
+            self._transaction(ready)
+
+    def link(self, view: str, filename: str, sha256: str, chunker: str) -> Optional[str]:
+        """
+        Make a ready document visible in ``view`` under ``filename``.
+
+        Returns the key of the document ``filename`` pointed to before, if it
+        was a different one.
+        """
+        key = self.key(sha256, chunker)
+
+        def attach(conn: sqlite3.Connection) -> Optional[str]:
+            if conn.execute("SELECT 1 FROM documents WHERE key = ? AND state = 'ready'", (key,)).fetchone() is None:
+                raise DocumentBusy(f"Document {sha256[:12]} is not in the shared collection")
+            previous = conn.execute(
+                "SELECT document FROM links WHERE view = ? AND filename = ?", (view, filename)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO links (view, filename, document, linked_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (view, filename) DO UPDATE SET document = excluded.document, linked_at = excluded.linked_at",
+                (view, filename, key, time.time()),
+            )
+            return previous[0] if previous is not None and previous[0] != key else None
+
+        with self._lock:
+            return self._transaction(attach)
+
+    def linked(self, view: str, document: str) -> bool:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM links WHERE view = ? AND document = ? LIMIT 1", (view, document)
+            ).fetchone() is not None
+
+    def view(self, view: str) -> Dict[str, Tuple[str, int]]:
+        """Documents visible in ``view``: ``{key: (filenames, chunk count)}``."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT links.document, links.filename, documents.chunks FROM links "
+                "JOIN documents ON documents.key = links.document AND documents.state = 'ready' "
+                "WHERE links.view = ? ORDER BY links.filename",
+                (view,),
+            ).fetchall()
+        documents: Dict[str, Tuple[str, int]] = {}
+        for key, filename, chunks in rows:
+            names = documents[key][0] + ", " + filename if key in documents else filename
+            documents[key] = (names, chunks)
+        return documents
+
+    def unlink(self, view: str, filename: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM links WHERE view = ? AND filename = ?", (view, filename))
+
+    def drop_view(self, view: str) -> int:
+        """Unlink every document from a view that is being deleted."""
+        with self._lock:
+            return self.conn.execute("DELETE FROM links WHERE view = ?", (view,)).rowcount
+
+    def collect(self) -> List[str]:
+        """Mark documents to delete from the shared collection and return their keys."""
+        def mark(conn: sqlite3.Connection) -> List[str]:
+            now = time.time()
+            cutoff = now - self.staging_ttl
+            # Abandoned ingests, and deletions a crashed caller never finished.
+            victims = [key for (key,) in conn.execute(
+                "SELECT key FROM documents WHERE state IN ('staging', 'evicting') AND updated_at < ?", (cutoff,)
+            )]
+            total = conn.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM documents WHERE state = 'ready' "
+                "AND NOT EXISTS (SELECT 1 FROM links WHERE links.document = documents.key)"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in conn.execute(
+                    "SELECT key, bytes FROM documents WHERE state = 'ready' "
+                    "AND NOT EXISTS (SELECT 1 FROM links WHERE links.document = documents.key) "
+                    "ORDER BY last_used"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    victims.append(key)
+                    total -= size
+            conn.executemany(
+                "UPDATE documents SET state = 'evicting', updated_at = ? WHERE key = ?",
+                [(now, key) for key in victims],
+            )
+            return victims
+
+        with self._lock:
+            return self._transaction(mark)
+
+    def forget(self, keys: List[str]):
+        """Drop documents whose chunks have been deleted from the shared collection."""
+        with self._lock:
+            self._transaction(lambda conn: conn.executemany(
+                "DELETE FROM documents WHERE key = ? AND state = 'evicting'", [(key,) for key in keys]
+            ))
+        if keys:
+            logger.info("Removed %s documents from the shared collection", len(keys))
+
+    def sweep(self, collection) -> int:
+        """``collect`` documents and delete their chunks from the shared Chroma ``collection``."""
+        keys = self.collect()
+        for key in keys:
+            collection.delete(where={"document": key})
+        self.forget(keys)
+        return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            documents, chunks, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunks), 0), COALESCE(SUM(bytes), 0) "
+                "FROM documents WHERE state = 'ready'"
+            ).fetchone()
+            unreferenced = self.conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE state = 'ready' "
+                "AND NOT EXISTS (SELECT 1 FROM links WHERE links.document = documents.key)"
+            ).fetchone()[0]
+            staging = self.conn.execute("SELECT COUNT(*) FROM documents WHERE state = 'staging'").fetchone()[0]
+            views, links = self.conn.execute("SELECT COUNT(DISTINCT view), COUNT(*) FROM links").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "documents": documents,
+            "chunks": chunks,
+            "bytes": size,
+            "unreferenced": unreferenced,
+            "staging": staging,
+            "views": views,
+            "links": links,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], T]) -> T:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(self.conn)
+            self.conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # Version 1 kept every chunk's text here; it now lives only in Chroma.
+            for table in ("documents", "chunks", "staging", "links"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                key TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                state TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                chunks INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS links (
+                view TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                document TEXT NOT NULL,
+                linked_at REAL NOT NULL,
+                PRIMARY KEY (view, filename)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_lru ON documents (state, last_used)")
+        conn.execute("CREATE INDEX IF NOT EXISTS links_document ON links (document)")
+
+
+_stores: Dict[str, ChunkStore] = {}
+_stores_lock = threading.Lock()
+
+
+def shared_chunk_store(path: Optional[Union[str, Path]] = None) -> ChunkStore:
+    """Return the process-wide chunk store for ``path`` (next to the embedding cache by default)."""
+    resolved = str(Path(path) if path else chunk_store_path())
+    with _stores_lock:
+        if resolved not in _stores:
+            _stores[resolved] = ChunkStore(resolved)
+        return _stores[resolved]
@@ -0,0 +1,4 @@
+# Backend modules import each other by bare name; pytest puts this directory on sys.path.
+
+# test_query.py is a manual script that posts to a running server on import.
+collect_ignore = ["test_query.py"]
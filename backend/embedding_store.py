@@ -0,0 +1,376 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from metrics import CACHE_LOOKUPS
+from settings import file_lock, resolve_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EmbedFunction = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+def normalize_chunk_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=1)
+def default_embedding_function():
+    """Process-wide instance of Chroma's ONNX MiniLM so the model loads once."""
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+    return DefaultEmbeddingFunction()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed, on-disk cache of chunk embeddings.
+
+    Vectors are appended as raw float32 rows to ``vectors.f32`` and read back
+    through a memory map; ``index.sqlite3`` maps the hash of the normalized
+    chunk text to its row. When the file grows past ``max_bytes`` the least
+    recently used rows are dropped and the file is rewritten.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        model_name: str = "all-MiniLM-L6-v2",
+        max_bytes: Optional[int] = None,
+    ):
+        self.path = Path(path) if path else resolve_path("EMBEDDING_CACHE_DIR", "embedding_cache")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+        )
+        self.vectors_path = self.path / "vectors.f32"
+        self.lock_path = self.path / "store.lock"
+        self._lock = threading.Lock()
+        self._map: Optional[np.memmap] = None
+        self._map_generation = -1
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(str(self.path / "index.sqlite3"), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS vectors_lru ON vectors (last_used)")
+        self.vectors_path.touch(exist_ok=True)
+
+    def key(self, text: str) -> str:
+        normalized = normalize_chunk_text(text)
+        return hashlib.sha256(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def embed(self, texts: List[str], embed_function: EmbedFunction, batch_size: int = 64) -> np.ndarray:
+        """Return one float32 row per text, embedding only the texts not already stored."""
+        keys = [self.key(text) for text in texts]
+        found = self.get_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            missing_keys = list(missing)
+            computed = []
+            for start in range(0, len(missing_keys), batch_size):
+                batch = [missing[key] for key in missing_keys[start:start + batch_size]]
+                computed.append(np.asarray(embed_function(batch), dtype=np.float32))
+            vectors = np.vstack(computed)
+            self.put_many(missing_keys, vectors)
+            found.update(zip(missing_keys, vectors))
+
+        return np.vstack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+
+        with file_lock(self.lock_path, shared=True), self._lock:
+            rows = {}
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" for _ in part)
+                rows.update(self.conn.execute(
+                    f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", part
+                ).fetchall())
+            if not rows:
+                return {}
+
+            vectors = self._vectors()
+            if vectors is None:
+                return {}
+            result = {key: np.array(vectors[row]) for key, row in rows.items() if row < len(vectors)}
+            self._touch(list(result))
+            return result
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with file_lock(self.lock_path), self._lock:
+            dim = self._dimension(vectors.shape[1])
+            if dim != vectors.shape[1]:
+                logger.warning("Embedding dimension changed (%s -> %s); resetting store", dim, vectors.shape[1])
+                self._reset(vectors.shape[1])
+
+            existing = {
+                row[0] for row in self.conn.execute(
+                    f"SELECT key FROM vectors WHERE key IN ({','.join('?' for _ in keys)})", keys
+                ).fetchall()
+            } if keys else set()
+            fresh = [(key, vector) for key, vector in zip(keys, vectors) if key not in existing]
+            if not fresh:
+                return
+
+            first_row = self._whole_rows(vectors.shape[1])
+            with self.vectors_path.open("ab") as handle:
+                handle.write(np.vstack([vector for _, vector in fresh]).tobytes())
+
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, row, last_used) VALUES (?, ?, ?)",
+                [(key, first_row + offset, now) for offset, (key, _) in enumerate(fresh)],
+            )
+            self.conn.execute("COMMIT")
+
+            if self.vectors_path.stat().st_size > self.max_bytes:
+                self._compact(vectors.shape[1])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            size = self.vectors_path.stat().st_size
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _vectors(self) -> Optional[np.memmap]:
+        dim = self._meta("dim")
+        if dim is None or self.vectors_path.stat().st_size == 0:
+            return None
+
+        dim = int(dim)
+        generation = int(self._meta("generation") or 0)
+        rows = self.vectors_path.stat().st_size // (4 * dim)
+        if self._map is None or self._map_generation != generation or len(self._map) != rows:
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            self._map_generation = generation
+        return self._map
+
+    def _touch(self, keys: List[str]):
+        if not keys:
+            return
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("UPDATE vectors SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _whole_rows(self, dim: int) -> int:
+        """Row count of ``vectors.f32``, first cutting off a partial row left by a torn append."""
+        size = self.vectors_path.stat().st_size
+        torn = size % (4 * dim)
+        if torn:
+            logger.warning("Truncating %s bytes of a partial row from %s", torn, self.vectors_path)
+            os.truncate(self.vectors_path, size - torn)
+        return size // (4 * dim)
+
+    def _compact(self, dim: int):
+        """Keep the most recently used rows that fit in 80% of the byte budget."""
+        keep_rows = max(int(self.max_bytes * 0.8) // (4 * dim), 0)
+        survivors = self.conn.execute(
+            "SELECT key, row FROM vectors ORDER BY last_used DESC LIMIT ?", (keep_rows,)
+        ).fetchall()
+        old = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.vectors_path.stat().st_size // (4 * dim), dim))
+        temp_path = self.vectors_path.with_suffix(".tmp")
+        with temp_path.open("wb") as handle:
+            for _, row in survivors:
+                handle.write(np.asarray(old[row]).tobytes())
+        del old
+        self._map = None
+        os.replace(temp_path, self.vectors_path)
+
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("DELETE FROM vectors")
+        self.conn.executemany(
+            "INSERT INTO vectors (key, row, last_used) VALUES (?, ?, ?)",
+            [(key, new_row, now) for new_row, (key, _) in enumerate(survivors)],
+        )
+        self._set_meta("generation", str(int(self._meta("generation") or 0) + 1))
+        self.conn.execute("COMMIT")
+        logger.info("Compacted embedding store to %s vectors", len(survivors))
+
+    def _reset(self, dim: int):
+        self.conn.execute("DELETE FROM vectors")
+        self.vectors_path.write_bytes(b"")
+        self._map = None
+        self._set_meta("dim", str(dim))
+        self._set_meta("generation", str(int(self._meta("generation") or 0) + 1))
+
+    def _dimension(self, dim: int) -> int:
+        stored = self._meta("dim")
+        if stored is None:
+            self._set_meta("dim", str(dim))
+            return dim
+        return int(stored)
+
+    def _meta(self, name: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+
+class CachedEmbeddings:
+    """
+    Bounded in-memory cache in front of a LangChain embeddings model.
+
+    Vectors live in one preallocated float32 matrix; an LRU dict maps the
+    SHA-256 of each text to its row. ``embed_documents`` sends every miss in a
+    batch to the model in a single call.
+    """
+
+    def __init__(self, embeddings, cache_size: int = 1000, batch_size: int = 32):
+        self.embeddings = embeddings
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.rows: "OrderedDict[bytes, int]" = OrderedDict()
+        self.matrix: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, text: str) -> Optional[np.ndarray]:
+        """Return the cached vector for ``text`` without computing anything."""
+        with self._lock:
+            row = self.rows.get(self._key(text))
+            return None if row is None else self.matrix[row].copy()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, calling the model once per batch for all cache misses."""
+        vectors: Dict[int, np.ndarray] = {}
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            keys = [self._key(text) for text in batch]
+
+            missing: Dict[bytes, str] = {}
+            with self._lock:
+                for offset, key in enumerate(keys):
+                    row = self.rows.get(key)
+                    if row is not None:
+                        self.rows.move_to_end(key)
+                        vectors[start + offset] = self.matrix[row].copy()
+                    elif key not in missing:
+                        missing[key] = batch[offset]
+                self.hits += len(batch) - len(missing)
+                self.misses += len(missing)
+            CACHE_LOOKUPS.inc(len(batch) - len(missing), cache="embedding", result="hit")
+            CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+
+            if missing:
+                computed = np.asarray(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+                fresh = dict(zip(missing, computed))
+                with self._lock:
+                    for key, vector in fresh.items():
+                        self._store(key, vector)
+                for offset, key in enumerate(keys):
+                    if start + offset not in vectors:
+                        vectors[start + offset] = fresh[key]
+
+        if not texts:
+            return []
+        return np.vstack([vectors[index] for index in range(len(texts))]).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query vectors are cached separately; some models embed queries differently.
+        key = self._key(f"query\0{text}")
+        cached = None
+        with self._lock:
+            row = self.rows.get(key)
+            if row is not None:
+                self.rows.move_to_end(key)
+                self.hits += 1
+                cached = self.matrix[row].tolist()
+            else:
+                self.misses += 1
+        CACHE_LOOKUPS.inc(cache="embedding", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self._store(key, vector)
+        return vector.tolist()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.rows),
+            "capacity": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _store(self, key: bytes, vector: np.ndarray):
+        if self.cache_size <= 0:
+            return
+        if self.matrix is None or self.matrix.shape[1] != vector.shape[0]:
+            self.matrix = np.zeros((self.cache_size, vector.shape[0]), dtype=np.float32)
+            self.rows.clear()
+
+        row = self.rows.get(key)
+        if row is None:
+            if len(self.rows) >= self.cache_size:
+                _, row = self.rows.popitem(last=False)
+            else:
+                row = len(self.rows)
+            self.rows[key] = row
+        self.rows.move_to_end(key)
+        self.matrix[row] = vector
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def shared_embedding_store(path: Optional[Union[str, Path]] = None) -> EmbeddingStore:
+    """Return the process-wide store for ``path`` (EMBEDDING_CACHE_DIR by default)."""
+    resolved = str(Path(path) if path else resolve_path("EMBEDDING_CACHE_DIR", "embedding_cache"))
+    with _stores_lock:
+        if resolved not in _stores:
+            _stores[resolved] = EmbeddingStore(resolved)
+        return _stores[resolved]
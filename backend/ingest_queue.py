@@ -0,0 +1,385 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import UPLOAD_JOBS, UPLOAD_SECONDS
+from state_store import SQLiteStore, shared_store
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+JOB_FIELDS = (
+    "job_id", "session_id", "filename", "file_path", "status", "message", "chunks", "pages",
+    "attempts", "max_attempts", "enqueued_at", "started_at", "finished_at", "worker", "sha256", "size",
+)
+
+Progress = Callable[[Dict], None]
+
+
+class PermanentIngestError(Exception):
+    """The file can never be indexed (e.g. it has no readable text); do not retry it."""
+
+
+class IngestQueue:
+    """
+    Durable upload queue in SQLite, shared by every worker process on the host.
+
+    A worker claims a job with a lease and keeps extending it while the job
+    runs. If the process dies, the lease expires and the job is queued again,
+    so uploads accepted before a restart are not lost. Failed jobs are retried
+    with exponential backoff up to ``max_attempts`` times.
+
+    Claims are fair across sessions: the next job comes from the session with
+    the fewest jobs in progress, then the one served least recently, so one
+    session uploading many files does not hold up everyone else.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SQLiteStore] = None,
+        max_attempts: int = 3,
+        lease_seconds: float = 60,
+        retry_base: float = 5,
+        retention: Optional[int] = None,
+    ):
+        self.store = store or SQLiteStore()
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_base = retry_base
+        self.retention = retention if retention is not None else int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+        self.store.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                job_id TEXT PRIMARY KEY,
+                session_key TEXT NOT NULL,
+                session_id TEXT,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                message TEXT NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                pages INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_expires_at REAL,
+                worker TEXT,
+                sha256 TEXT,
+                size INTEGER
+            )
+            """
+        )
+        columns = {row[1] for row in self.store.execute("PRAGMA table_info(ingest_jobs)")}
+        for column, kind in (("sha256", "TEXT"), ("size", "INTEGER")):
+            if column not in columns:
+                # Queues created before uploads were hashed.
+                self.store.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} {kind}")
+        self.store.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_ready ON ingest_jobs (status, available_at)")
+        self.store.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_session ON ingest_jobs (session_key, status)")
+        self.store.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_finished ON ingest_jobs (finished_at)")
+        self.store.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_content ON ingest_jobs (session_key, sha256)")
+
+    @classmethod
+    def from_env(cls) -> "IngestQueue":
+        return cls(
+            shared_store(),
+            max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "3")),
+            lease_seconds=float(os.getenv("INGEST_LEASE_SECONDS", "60")),
+            retry_base=float(os.getenv("INGEST_RETRY_BASE_SECONDS", "5")),
+        )
+
+    def enqueue(
+        self,
+        job_id: str,
+        file_path: str,
+        filename: str,
+        session_id: Optional[str],
+        sha256: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> Dict:
+        now = time.time()
+        self.store.executemany([
+            (
+                "INSERT INTO ingest_jobs (job_id, session_key, session_id, filename, file_path, status, message, "
+                "max_attempts, enqueued_at, available_at, sha256, size) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', 'Upload received', ?, ?, ?, ?, ?)",
+                (job_id, session_id or "", session_id, filename, file_path, self.max_attempts, now, now, sha256, size),
+            ),
+            (
+                "DELETE FROM ingest_jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+                (now - self.retention,),
+            ),
+        ])
+        return self.get(job_id)
+
+    def find_duplicate(self, session_id: Optional[str], sha256: str, filename: str) -> Optional[Dict]:
+        """
+        The latest live job in this session for a file with the same name and
+        content, provided its file has not been overwritten by a later upload since.
+        """
+        rows = self.store.execute(
+            """
+            SELECT job_id FROM ingest_jobs AS job
+            WHERE session_key = ? AND sha256 = ? AND filename = ? AND status IN ('queued', 'processing', 'completed')
+              AND NOT EXISTS (
+                  SELECT 1 FROM ingest_jobs AS newer
+                  WHERE newer.file_path = job.file_path AND newer.enqueued_at > job.enqueued_at
+              )
+            ORDER BY enqueued_at DESC
+            LIMIT 1
+            """,
+            (session_id or "", sha256, filename),
+        )
+        return self.get(rows[0][0]) if rows else None
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Lease the next job for ``worker``, or return None when nothing is ready."""
+        def take(conn):
+            now = time.time()
+            self._recover(conn, now)
+            row = conn.execute(
+                """
+                SELECT job_id FROM ingest_jobs AS job
+                WHERE status = 'queued' AND available_at <= ?
+                ORDER BY
+                    (SELECT COUNT(*) FROM ingest_jobs AS running
+                     WHERE running.session_key = job.session_key AND running.status = 'processing'),
+                    (SELECT COALESCE(MAX(started_at), 0) FROM ingest_jobs AS served
+                     WHERE served.session_key = job.session_key),
+                    enqueued_at
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE ingest_jobs SET status = 'processing', message = 'Processing document', "
+                "attempts = attempts + 1, started_at = ?, lease_expires_at = ?, worker = ? WHERE job_id = ?",
+                (now, now + self.lease_seconds, worker, row[0]),
+            )
+            return row[0]
+
+        job_id = self.store.transaction(take)
+        return self.get(job_id) if job_id else None
+
+    def heartbeat(self, job_id: str, fields: Optional[Dict] = None):
+        """Extend the lease on a running job, optionally recording progress."""
+        fields = {key: value for key, value in (fields or {}).items() if key in ("message", "chunks", "pages")}
+        assignments = "".join(f", {key} = ?" for key in fields)
+        self.store.execute(
+            f"UPDATE ingest_jobs SET lease_expires_at = ?{assignments} WHERE job_id = ? AND status = 'processing'",
+            (time.time() + self.lease_seconds, *fields.values(), job_id),
+        )
+
+    def complete(self, job_id: str, chunks: int):
+        self.store.execute(
+            "UPDATE ingest_jobs SET status = 'completed', message = 'File uploaded and processed successfully', "
+            "chunks = ?, finished_at = ?, lease_expires_at = NULL WHERE job_id = ?",
+            (chunks, time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, message: str, retry: bool = True) -> str:
+        """Record a failed attempt; returns the job's new status (``queued`` or ``failed``)."""
+        def record(conn):
+            now = time.time()
+            row = conn.execute("SELECT attempts, max_attempts FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return "failed"
+            attempts, max_attempts = row
+            if retry and attempts < max_attempts:
+                delay = self.retry_base * 2 ** (attempts - 1)
+                conn.execute(
+                    "UPDATE ingest_jobs SET status = 'queued', message = ?, available_at = ?, "
+                    "lease_expires_at = NULL WHERE job_id = ?",
+                    (f"{message}; retrying in {delay:.0f}s", now + delay, job_id),
+                )
+                return "queued"
+            conn.execute(
+                "UPDATE ingest_jobs SET status = 'failed', message = ?, finished_at = ?, "
+                "lease_expires_at = NULL WHERE job_id = ?",
+                (message, now, job_id),
+            )
+            return "failed"
+
+        return self.store.transaction(record)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        rows = self.store.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM ingest_jobs WHERE job_id = ?", (job_id,))
+        return dict(zip(JOB_FIELDS, rows[0])) if rows else None
+
+    def finished_since(self, cursor: float) -> Tuple[List[Dict], float]:
+        """Jobs completed after ``cursor``, and the cursor to pass next time."""
+        rows = self.store.execute(
+            "SELECT job_id, session_id, worker, finished_at FROM ingest_jobs "
+            "WHERE status = 'completed' AND finished_at > ? ORDER BY finished_at",
+            (cursor,),
+        )
+        jobs = [{"job_id": job_id, "session_id": session_id, "worker": worker} for job_id, session_id, worker, _ in rows]
+        return jobs, rows[-1][3] if rows else cursor
+
+    def stats(self) -> Dict:
+        counts = dict(self.store.execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status"))
+        oldest = self.store.execute("SELECT MIN(enqueued_at) FROM ingest_jobs WHERE status = 'queued'")[0][0]
+        return {
+            "queued": counts.get("queued", 0),
+            "processing": counts.get("processing", 0),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+            "max_attempts": self.max_attempts,
+            "lease_seconds": self.lease_seconds,
+        }
+
+    def _recover(self, conn, now: float):
+        # Leases left behind by a crashed or restarted worker.
+        expired = conn.execute(
+            "SELECT job_id, attempts, max_attempts FROM ingest_jobs "
+            "WHERE status = 'processing' AND lease_expires_at < ?",
+            (now,),
+        ).fetchall()
+        for job_id, attempts, max_attempts in expired:
+            logger.warning("Lease on ingest job %s expired after attempt %s", job_id, attempts)
+            if attempts < max_attempts:
+                conn.execute(
+                    "UPDATE ingest_jobs SET status = 'queued', message = 'Requeued after worker restart', "
+                    "available_at = ?, lease_expires_at = NULL WHERE job_id = ?",
+                    (now, job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE ingest_jobs SET status = 'failed', message = 'Worker stopped while processing', "
+                    "finished_at = ?, lease_expires_at = NULL WHERE job_id = ?",
+                    (now, job_id),
+                )
+
+
+class IngestWorkerPool:
+    """
+    ``workers`` coroutines that claim jobs from an ``IngestQueue`` and run
+    ``handler(job, progress)`` on a dedicated thread pool of the same size.
+
+    Extraction and upserts therefore never occupy the threadpool that serves
+    /ask, and at most ``workers`` documents are processed at once however many
+    are uploaded. ``on_complete(job)`` runs on the event loop after a job has
+    been indexed and before it is reported as completed.
+    """
+
+    def __init__(
+        self,
+        queue: IngestQueue,
+        handler: Callable[[Dict, Progress], int],
+        workers: int = 1,
+        poll_interval: float = 1.0,
+        on_complete: Optional[Callable[[Dict], Awaitable[None]]] = None,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.on_complete = on_complete
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="ingest")
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        self._wake = asyncio.Event()
+        for index in range(self.workers):
+            self._tasks.add(asyncio.create_task(self._work(), name=f"ingest-worker-{index}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # Jobs still running keep their lease and are picked up again after it expires.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def wake(self):
+        """Tell idle workers a job was just enqueued."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    async def _work(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+            except Exception:
+                logger.exception("Could not claim an ingest job")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception:
+                # The lease expires and the job is retried; keep this worker alive.
+                logger.exception("Could not record the outcome of ingest job %s", job["job_id"])
+
+    async def _run(self, job: Dict):
+        job_id = job["job_id"]
+        loop = asyncio.get_running_loop()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        status = "failed"
+        try:
+            chunks = await loop.run_in_executor(
+                self.executor, self.handler, job, lambda fields: self.queue.heartbeat(job_id, fields)
+            )
+            if self.on_complete is not None:
+                await self.on_complete(job)
+            await asyncio.to_thread(self.queue.complete, job_id, chunks)
+            status = "completed"
+        except asyncio.CancelledError:
+            status = "interrupted"
+            raise
+        except (PermanentIngestError, FileNotFoundError) as exc:
+            logger.warning("Ingest job %s failed: %s", job_id, exc)
+            await asyncio.to_thread(self.queue.fail, job_id, str(exc), False)
+        except Exception as exc:
+            logger.exception("Error processing ingest job %s", job_id)
+            status = await asyncio.to_thread(self.queue.fail, job_id, f"Error processing file: {exc}")
+            if status == "queued":
+                self.retried += 1
+                status = "retried"
+        finally:
+            heartbeat.cancel()
+            if status == "completed":
+                self.processed += 1
+            elif status == "failed":
+                self.failed += 1
+            UPLOAD_JOBS.inc(status=status)
+            if status in ("completed", "failed"):
+                UPLOAD_SECONDS.observe(time.time() - job["enqueued_at"], status=status)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.queue.heartbeat, job_id)
+            except Exception:
+                logger.exception("Could not extend the lease on ingest job %s", job_id)
@@ -0,0 +1,169 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from heapq import nlargest
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from settings import file_lock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has",
+    "he", "in", "is", "it", "its", "of", "on", "or", "that", "the", "to",
+    "was", "were", "what", "when", "where", "which", "who", "why", "with",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+def lexical_index_path(vectorstore_path: Path, collection_name: str) -> Path:
+    return Path(vectorstore_path) / "lexical" / f"{collection_name}.json"
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring for one collection.
+
+    ``postings`` maps each term to ``{chunk_id: term_frequency}``; per-chunk
+    term counts are kept as well so re-indexed chunks can be removed.
+    Writers hold ``locked()`` from ``load`` to ``save``; readers need no lock
+    because ``save`` replaces the file atomically.
+    """
+
+    _locks: Dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, path: Optional[Path] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.mtime: Optional[float] = None
+        with self._locks_guard:
+            self.lock = self._locks.setdefault(str(self.path), threading.Lock())
+
+    @contextmanager
+    def locked(self):
+        """Exclude writers in this process and, through an flock sidecar, in other worker processes."""
+        with self.lock:
+            if self.path is None:
+                yield
+                return
+            with file_lock(self.path.with_suffix(".lock")):
+                yield
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id in self.doc_lengths:
+            self.remove(chunk_id)
+
+        counts = Counter(tokenize(text))
+        self.doc_terms[chunk_id] = dict(counts)
+        length = sum(counts.values())
+        self.doc_lengths[chunk_id] = length
+        self.total_length += length
+        for term, frequency in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = frequency
+
+    def remove(self, chunk_id: str):
+        terms = self.doc_terms.pop(chunk_id, None)
+        if terms is None:
+            return
+
+        self.total_length -= self.doc_lengths.pop(chunk_id, 0)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query: str, n: int) -> List[Tuple[str, float]]:
+        """Return up to ``n`` ``(chunk_id, score)`` pairs, best first."""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return []
+
+        average_length = self.total_length / doc_count or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for chunk_id, frequency in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return nlargest(n, scores.items(), key=lambda item: item[1])
+
+    def add_many(self, chunks: Iterable[Tuple[str, str]]):
+        for chunk_id, text in chunks:
+            self.add(chunk_id, text)
+
+    def load(self) -> "BM25Index":
+        self.postings, self.doc_terms, self.doc_lengths, self.total_length = {}, {}, {}, 0
+        if self.path is None or not self.path.exists():
+            self.mtime = None
+            return self
+
+        try:
+            self.mtime = self.path.stat().st_mtime
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable lexical index at %s", self.path)
+            return self
+
+        for chunk_id, terms in data.get("docs", {}).items():
+            self.doc_terms[chunk_id] = terms
+            length = sum(terms.values())
+            self.doc_lengths[chunk_id] = length
+            self.total_length += length
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+        return self
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps({"docs": self.doc_terms}, separators=(",", ":")), encoding="utf-8")
+        os.replace(temp_path, self.path)
+        self.mtime = self.path.stat().st_mtime
+
+    def is_stale(self) -> bool:
+        """True when another process has rewritten the file since it was loaded."""
+        if self.path is None:
+            return False
+        try:
+            return self.path.stat().st_mtime != self.mtime
+        except FileNotFoundError:
+            return self.mtime is not None
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> Dict[str, float]:
+    """Fuse several best-first ID rankings into one score per ID."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return fused
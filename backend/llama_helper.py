@@ -1,8 +1,20 @@
+import asyncio
+import json
 import os
 import logging
+import random
+import time
+from contextlib import aclosing
+from email.utils import parsedate_to_datetime
 from typing import Optional, AsyncGenerator
 import httpx
 from dotenv import load_dotenv
+from settings import env_bool
+
+try:
+    import h2  # noqa: F401 - httpx only needs it importable for HTTP/2
+except ImportError:
+    h2 = None
 
 # Load environment variables
 load_dotenv()
@@ -10,78 +22,385 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class LlamaHelper:
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """A failed Groq attempt that is safe to repeat because nothing was yielded yet."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Read a ``Retry-After`` header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMBackend:
+    """
+    Interface for answer generation backends.
+
+    ``generate_response`` yields text deltas for a context and question and,
+    when ``usage`` is given, fills it with OpenAI-style token counts.
+    """
+
+    retries = 0
+
+    async def generate_response(
+        self,
+        context: str,
+        question: str,
+        stream: Optional[bool] = None,
+        usage: Optional[dict] = None,
+    ) -> AsyncGenerator[str, None]:
+        raise NotImplementedError
+        yield  # pragma: no cover - makes this an async generator
+
+    def _create_prompt(self, context: str, question: str) -> str:
+        """Create a prompt for the model."""
+        return f"""Use the following context to answer the question. If you cannot find the answer in the context, say "I cannot find information about that in the provided context."
+
+Context:
+{context}
+
+Question:
+{question}
+
+Answer:"""
+
+    async def aclose(self):
+        pass
+
+
+class LlamaHelper(LLMBackend):
     """
     Helper class for text generation using Groq API.
+
+    Any other OpenAI-compatible ``/chat/completions`` server (vLLM, Ollama,
+    llama.cpp, OpenAI itself) can be used by passing its base URL, model and
+    key; ``require_key=False`` allows local servers that need no key. Only an
+    ``api_key`` of None falls back to GROQ_API_KEY; an empty one sends no
+    Authorization header.
     """
-    def __init__(self):
-        self.api_key = os.getenv("GROQ_API_KEY")
-        if not self.api_key:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        model: Optional[str] = None,
+        require_key: bool = True,
+    ):
+        self.api_key = api_key if api_key is not None else os.getenv("GROQ_API_KEY")
+        if not self.api_key and require_key:
             raise ValueError(
                 "GROQ_API_KEY environment variable is required. "
                 "Please create a .env file in the backend directory with your Groq API key:\n"
                 "GROQ_API_KEY=your_api_key_here"
             )
-        
-        logger.info("Groq API key configured")
-        
-        self.api_base = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1")
-        self.model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-        timeout = float(os.getenv("GROQ_TIMEOUT", "60"))
+
+        if self.api_key:
+            logger.info("LLM API key configured")
+
+        self.api_base = api_base or os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1")
+        self.model = model or os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+        self.stream = env_bool("GROQ_STREAM", True)
+
+        # One pool per worker process: size it for the answers a worker streams at once.
+        max_connections = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", str(max_connections))),
+            keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30")),
+        )
+        read_timeout = float(os.getenv("GROQ_READ_TIMEOUT", os.getenv("GROQ_TIMEOUT", "60")))
+        timeout = httpx.Timeout(
+            connect=float(os.getenv("GROQ_CONNECT_TIMEOUT", "5")),
+            read=read_timeout,
+            write=float(os.getenv("GROQ_WRITE_TIMEOUT", "10")),
+            pool=float(os.getenv("GROQ_POOL_TIMEOUT", "10")),
+        )
+        self.first_byte_timeout = float(os.getenv("GROQ_FIRST_BYTE_TIMEOUT", "20"))
+        self.max_retries = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("GROQ_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("GROQ_BACKOFF_MAX", "8"))
+        self.retry_after_max = float(os.getenv("GROQ_RETRY_AFTER_MAX", "30"))
+        self.retries = 0
+
+        http2 = env_bool("GROQ_HTTP2", True)
+        if http2 and h2 is None:
+            logger.warning("GROQ_HTTP2 is on but the 'h2' package is missing; using HTTP/1.1")
+            http2 = False
+
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
         self.client = httpx.AsyncClient(
             base_url=self.api_base,
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            },
-            timeout=timeout
+            headers=headers,
+            timeout=timeout,
+            limits=limits,
+            http2=http2,
         )
 
-    async def generate_response(self, context: str, question: str) -> AsyncGenerator[str, None]:
+    async def generate_response(
+        self,
+        context: str,
+        question: str,
+        stream: Optional[bool] = None,
+        usage: Optional[dict] = None,
+    ) -> AsyncGenerator[str, None]:
         """
-        Generate a response using Groq's API (non-streaming).
+        Generate a response using Groq's API.
+
+        With streaming enabled (the default, see GROQ_STREAM) the
+        OpenAI-compatible event stream is parsed incrementally and each content
+        delta is yielded as soon as it arrives. If ``usage`` is given it is
+        updated with the token usage reported by the final frame.
         """
-        prompt = self._create_prompt(context, question)
-        
+        if stream is None:
+            stream = self.stream
+
+        payload = self._create_payload(context, question, stream)
+        if not stream:
+            async for chunk in self._generate_complete(payload, usage):
+                yield chunk
+            return
+
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                async with aclosing(self._stream_attempt(payload, usage)) as contents:
+                    async for content in contents:
+                        emitted = True
+                        yield content
+                return
+            except RetryableError as e:
+                # Once text has reached the client a retry would repeat it.
+                delay = None if emitted else self._retry_delay(attempt, e.retry_after)
+                if delay is None:
+                    logger.error("Groq request failed after %s attempts: %s", attempt + 1, e)
+                    raise RuntimeError(f"Failed to generate response: {str(e)}")
+                attempt += 1
+                self.retries += 1
+                logger.warning("Retrying Groq request in %.2fs (attempt %s): %s", delay, attempt + 1, e)
+                await asyncio.sleep(delay)
+            except (asyncio.CancelledError, GeneratorExit):
+                # The client went away; closing the attempt closes the upstream
+                # connection so Groq stops generating for us.
+                logger.info("Response stream cancelled")
+                raise
+            except Exception as e:
+                logger.exception("Error generating response")
+                raise RuntimeError(f"Failed to generate response: {str(e)}")
+
+    async def _stream_attempt(self, payload: dict, usage: Optional[dict]) -> AsyncGenerator[str, None]:
+        """One streaming request; failures before the first frame raise ``RetryableError``."""
         try:
-            response = await self.client.post(
-                "/chat/completions",
-                json={
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful AI assistant that answers questions based on the provided context. Keep your answers concise and relevant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "model": self.model,
-                    "temperature": 0.7,
-                    "max_tokens": 1024,
-                    "stream": False  # Disable streaming for more reliable responses
-                }
+            async with asyncio.timeout(self.first_byte_timeout) as first_byte:
+                async with self.client.stream("POST", "/chat/completions", json=payload) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        self._raise_for_status(response)
+
+                    async for line in response.aiter_lines():
+                        if first_byte is not None:
+                            first_byte.reschedule(None)
+                            first_byte = None
+
+                        data = self._parse_event_line(line)
+                        if data is None:
+                            continue
+                        if data == "[DONE]":
+                            break
+
+                        if "error" in data:
+                            raise RuntimeError(data["error"].get("message") or str(data["error"]))
+
+                        frame_usage = data.get("usage") or (data.get("x_groq") or {}).get("usage")
+                        if frame_usage and usage is not None:
+                            usage.update(frame_usage)
+
+                        for choice in data.get("choices") or []:
+                            content = (choice.get("delta") or {}).get("content")
+                            if content:
+                                yield content
+        except TimeoutError:
+            raise RetryableError(f"No response from Groq within {self.first_byte_timeout}s")
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+
+    async def _generate_complete(self, payload: dict, usage: Optional[dict]) -> AsyncGenerator[str, None]:
+        attempt = 0
+        while True:
+            try:
+                try:
+                    response = await self.client.post("/chat/completions", json=payload)
+                except httpx.TransportError as e:
+                    raise RetryableError(f"{type(e).__name__}: {e}")
+                self._raise_for_status(response)
+                data = response.json()
+                break
+            except RetryableError as e:
+                delay = self._retry_delay(attempt, e.retry_after)
+                if delay is None:
+                    logger.error("Groq request failed after %s attempts: %s", attempt + 1, e)
+                    raise RuntimeError(f"Failed to generate response: {str(e)}")
+                attempt += 1
+                self.retries += 1
+                logger.warning("Retrying Groq request in %.2fs (attempt %s): %s", delay, attempt + 1, e)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.exception("Error generating response")
+                raise RuntimeError(f"Failed to generate response: {str(e)}")
+
+        if usage is not None and data.get("usage"):
+            usage.update(data["usage"])
+
+        # Yield the complete response in one go
+        yield data["choices"][0]["message"]["content"]
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableError(
+                f"Groq returned HTTP {response.status_code}",
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
             )
-            response.raise_for_status()
-            data = response.json()
-            
-            # Get the complete response
-            full_response = data["choices"][0]["message"]["content"]
-            
-            # Yield the response in one go
-            yield full_response
-            
-        except Exception as e:
-            logger.exception("Error generating response")
-            raise RuntimeError(f"Failed to generate response: {str(e)}")
+        response.raise_for_status()
 
-    def _create_prompt(self, context: str, question: str) -> str:
-        """Create a prompt for the model."""
-        return f"""Use the following context to answer the question. If you cannot find the answer in the context, say "I cannot find information about that in the provided context."
+    def _retry_delay(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """Full-jitter exponential backoff, never shorter than Groq's ``Retry-After``."""
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None and retry_after > self.retry_after_max:
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
 
-Context:
-{context}
+    def _create_payload(self, context: str, question: str, stream: bool) -> dict:
+        prompt = self._create_prompt(context, question)
+        payload = {
+            "messages": [
+                {"role": "system", "content": "You are a helpful AI assistant that answers questions based on the provided context. Keep your answers concise and relevant."},
+                {"role": "user", "content": prompt}
+            ],
+            "model": self.model,
+            "temperature": 0.7,
+            "max_tokens": 1024,
+            "stream": stream,
+        }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
 
-Question:
-{question}
+    @staticmethod
+    def _parse_event_line(line: str):
+        """Decode one ``text/event-stream`` line into a JSON frame or ``[DONE]``."""
+        line = line.strip()
+        if not line.startswith("data:"):
+            return None
 
-Answer:"""
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return data
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning("Skipping malformed stream frame: %s", data[:200])
+            return None
 
     async def aclose(self):
         """Close the async client."""
         await self.client.aclose()
+
+
+class FakeLLM(LLMBackend):
+    """
+    Offline stand-in that streams deterministic text with configurable timing.
+
+    The reply is ``tokens`` words drawn from the context, seeded by the
+    question, so identical requests get identical answers. The first word
+    arrives after ``ttft`` seconds and each later one ``token_latency``
+    seconds apart, which is enough to load-test retrieval, caching and SSE
+    framing without spending API quota.
+    """
+
+    def __init__(
+        self,
+        tokens: Optional[int] = None,
+        ttft: Optional[float] = None,
+        token_latency: Optional[float] = None,
+    ):
+        self.tokens = tokens if tokens is not None else int(os.getenv("FAKE_LLM_TOKENS", "64"))
+        self.ttft = ttft if ttft is not None else float(os.getenv("FAKE_LLM_TTFT_MS", "200")) / 1000
+        self.token_latency = (
+            token_latency if token_latency is not None else float(os.getenv("FAKE_LLM_TOKEN_MS", "20")) / 1000
+        )
+        self.stream = env_bool("GROQ_STREAM", True)
+        logger.info(
+            "Using fake LLM backend (%s tokens, %.0f ms TTFT, %.0f ms/token)",
+            self.tokens, self.ttft * 1000, self.token_latency * 1000,
+        )
+
+    async def generate_response(
+        self,
+        context: str,
+        question: str,
+        stream: Optional[bool] = None,
+        usage: Optional[dict] = None,
+    ) -> AsyncGenerator[str, None]:
+        if stream is None:
+            stream = self.stream
+
+        words = self._create_prompt(context, question).split() or ["lorem"]
+        rng = random.Random(question)
+        reply = [rng.choice(words) for _ in range(self.tokens)]
+        if usage is not None:
+            prompt_tokens = len(words)
+            usage.update(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=len(reply),
+                total_tokens=prompt_tokens + len(reply),
+            )
+
+        if not stream:
+            await asyncio.sleep(self.ttft + self.token_latency * max(len(reply) - 1, 0))
+            yield " ".join(reply)
+            return
+
+        await asyncio.sleep(self.ttft)
+        for index, word in enumerate(reply):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield word if index == 0 else f" {word}"
+
+
+def create_llm_backend() -> LLMBackend:
+    """Build the generation backend named by LLM_BACKEND: ``groq``, ``openai`` or ``fake``."""
+    backend = os.getenv("LLM_BACKEND", "groq").strip().lower()
+    if backend == "fake":
+        return FakeLLM()
+    if backend == "openai":
+        # Never fall back to GROQ_API_KEY: that secret must not reach another provider.
+        return LlamaHelper(
+            api_key=os.getenv("LLM_API_KEY", "").strip(),
+            api_base=os.getenv("LLM_API_BASE", "https://api.openai.com/v1"),
+            model=os.getenv("LLM_MODEL", "gpt-4o-mini"),
+            require_key=False,
+        )
+    if backend != "groq":
+        raise ValueError(f"Unknown LLM_BACKEND '{backend}'; expected groq, openai or fake")
+    return LlamaHelper()
@@ -1,19 +1,37 @@
 import os
+import hmac
 import logging
-from fastapi import BackgroundTasks, FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 import uvicorn
 from dotenv import load_dotenv
 import json
 import asyncio
-import shutil
+import math
+import time
+from contextlib import aclosing
 from pathlib import Path
 from typing import List, Dict, Optional
 from uuid import uuid4
-from settings import csv_env, documents_dir_for_session, env_bool, resolve_path
+from settings import bundled_files, csv_env, documents_dir_for_session, env_bool, resolve_path
+from chunk_store import shared_chunk_store
+from embedding_store import shared_embedding_store
+from ingest_queue import IngestQueue, IngestWorkerPool, PermanentIngestError
+from metrics import REGISTRY, monitor_event_loop_lag
+from rate_limiter import RateLimitExceeded
+from tracing import RequestTrace, SlowQueryMonitor, trace_requested, tracing_enabled
+from upload_stream import (
+    StreamingUpload,
+    UploadError,
+    check_content_length,
+    max_upload_bytes,
+    sweep_incoming,
+    upload_chunk_bytes,
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -57,7 +75,14 @@ class AskRequest(BaseModel):
 # Initialize RAG pipeline placeholder
 rag_pipeline = None
 document_processor = None
-upload_jobs = {}
+ingest_queue = IngestQueue.from_env()
+ingest_pool: Optional[IngestWorkerPool] = None
+ingest_watch_task: Optional[asyncio.Task] = None
+slow_queries = SlowQueryMonitor.from_env()
+TRACE_ENABLED = tracing_enabled()
+session_gc_task: Optional[asyncio.Task] = None
+loop_lag_task: Optional[asyncio.Task] = None
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
 
 ALLOWED_EXTENSIONS = {'.txt', '.pdf', '.md', '.docx'}
 
@@ -82,14 +107,17 @@ async def prepare_default_documents_if_needed(documents_dir: Path, vectorstore_p
         logger.info("AUTO_PREPARE_DOCUMENTS is disabled")
         return
 
-    if vectorstore_has_data(vectorstore_path):
+    if RAG_PROFILE == "full" and vectorstore_has_data(vectorstore_path):
         logger.info("Vector store already exists at %s", vectorstore_path)
         return
 
-    if not documents_dir.exists() or not any(documents_dir.glob("**/*")):
+    if not documents_dir.exists() or not any(bundled_files(documents_dir)):
         logger.warning("No bundled documents found in %s", documents_dir)
         return
 
+    # The render profile keeps a content-hash manifest, so this only embeds
+    # bundled files that are new or changed since the last run. Session
+    # uploads under documents/sessions are left to their own collections.
     logger.info("Preparing bundled documents from %s", documents_dir)
     if RAG_PROFILE == "full":
         processor = DocumentProcessor(
@@ -102,11 +130,11 @@ async def prepare_default_documents_if_needed(documents_dir: Path, vectorstore_p
             vectorstore_path=vectorstore_path,
             session_id="default",
         )
-    documents = await run_in_threadpool(processor.process_documents)
-    if documents:
-        await run_in_threadpool(processor.create_vectorstore_from_documents, documents)
-    else:
+    report = await run_in_threadpool(processor.index_documents)
+    if not report["chunks"]:
         logger.warning("Bundled documents did not produce any chunks")
+    for failure in report["failed"]:
+        logger.warning("Could not index bundled document %s: %s", failure["path"], failure["error"])
 
 
 def build_document_processor(documents_dir: Path, vectorstore_path: Path, session_id: Optional[str] = None):
@@ -123,101 +151,132 @@ def build_document_processor(documents_dir: Path, vectorstore_path: Path, sessio
     )
 
 
-def save_upload_to_disk(file: UploadFile, file_path: Path):
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+def ingest_upload(job: Dict, progress) -> int:
+    """Index one queued upload; runs on the ingest worker pool's threads."""
+    documents_dir = resolve_path("DOCUMENTS_DIR", "documents")
+    vectorstore_path = resolve_path("VECTORSTORE_PATH", "vectorstore")
+    processor = build_document_processor(
+        documents_dir=documents_dir,
+        vectorstore_path=vectorstore_path,
+        session_id=job["session_id"],
+    )
 
+    file_path = Path(job["file_path"])
+    if RAG_PROFILE == "full":
+        documents = processor.process_document(file_path)
+        if documents:
+            processor.update_vectorstore(documents)
+        chunk_count = len(documents)
+    else:
+        def report_progress(state: dict):
+            progress({
+                "message": f"Indexed {state['chunks']} chunks from {state['pages']} pages",
+                "pages": state["pages"],
+                "chunks": state["chunks"],
+            })
 
-async def process_upload_job(job_id: str, file_path: str, session_id: Optional[str], filename: str):
-    upload_jobs[job_id].update({"status": "processing", "message": "Processing document"})
-    try:
-        documents_dir = resolve_path("DOCUMENTS_DIR", "documents")
-        vectorstore_path = resolve_path("VECTORSTORE_PATH", "vectorstore")
-        processor = build_document_processor(
-            documents_dir=documents_dir,
-            vectorstore_path=vectorstore_path,
-            session_id=session_id,
-        )
+        chunk_count = processor.index_document(file_path, progress=report_progress)
+
+    if not chunk_count:
+        raise PermanentIngestError("No readable text could be extracted from this file")
+    return chunk_count
 
-        documents = await run_in_threadpool(processor.process_document, Path(file_path))
-        if not documents:
-            upload_jobs[job_id].update({
-                "status": "failed",
-                "message": "No readable text could be extracted from this file",
-            })
-            return
-
-        await run_in_threadpool(processor.update_vectorstore, documents)
-        if rag_pipeline is not None:
-            if RAG_PROFILE == "full":
-                await run_in_threadpool(rag_pipeline.reload_vectorstore)
-            else:
-                await run_in_threadpool(rag_pipeline.reload_vectorstore, session_id)
-
-        upload_jobs[job_id].update({
-            "status": "completed",
-            "message": "File uploaded and processed successfully",
-            "chunks": len(documents),
-        })
-    except Exception as exc:
-        logger.exception("Error processing upload job %s", job_id)
-        upload_jobs[job_id].update({
-            "status": "failed",
-            "message": f"Error processing file: {str(exc)}",
-        })
+
+async def reload_session(job: Dict):
+    """Make a finished upload visible to this worker's pipeline."""
+    if rag_pipeline is None:
+        return
+    if RAG_PROFILE == "full":
+        await run_in_threadpool(rag_pipeline.reload_vectorstore)
+    else:
+        await rag_pipeline.areload_vectorstore(job["session_id"])
+
+
+async def ingest_watch_loop(queue: IngestQueue, worker_id: Optional[str], interval: float):
+    """Reload sessions whose uploads another worker process finished."""
+    cursor = time.time()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            jobs, cursor = await run_in_threadpool(queue.finished_since, cursor)
+            sessions = {job["session_id"]: job for job in jobs if job["worker"] != worker_id}
+            for job in sessions.values():
+                await reload_session(job)
+        except Exception:
+            logger.exception("Could not reload sessions after ingestion")
 
 
 @app.post("/upload")
-async def upload_file(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    session_id: Optional[str] = Form(default=None),
-):
-    """Handle document uploads and process them for the RAG pipeline."""
+async def upload_file(request: Request):
+    """
+    Handle document uploads and queue them for the RAG pipeline.
+
+    Expects multipart/form-data with a ``file`` part and an optional
+    ``session_id`` field. The body is streamed to disk as it arrives rather
+    than spooled first; re-uploading a file under the same name and with the
+    same content to the same session is not processed again. Identical bytes
+    under a new name are indexed under that name, reusing the stored chunks.
+    """
     try:
-        filename = Path(file.filename or "").name
-        if not filename:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Uploaded file must have a filename"}
-            )
+        max_bytes = max_upload_bytes()
+        check_content_length(request.headers, max_bytes)
+
+        documents_dir = resolve_path("DOCUMENTS_DIR", "documents")
+        incoming_dir = documents_dir / ".incoming"
+        incoming_dir.mkdir(parents=True, exist_ok=True)
+        upload = await StreamingUpload(
+            request.headers.get("content-type", ""),
+            incoming_dir / f"{uuid4().hex}.part",
+            max_bytes,
+            ALLOWED_EXTENSIONS,
+            upload_chunk_bytes(),
+        ).receive(request.stream())
+    except UploadError as exc:
+        return JSONResponse(status_code=exc.status_code, content={"error": str(exc)})
+    except ClientDisconnect:
+        logger.info("Client disconnected during upload")
+        return JSONResponse(status_code=400, content={"error": "Upload was interrupted"})
 
-        # Check file extension
-        file_ext = Path(filename).suffix.lower()
-        if file_ext not in ALLOWED_EXTENSIONS:
+    try:
+        filename = upload.filename
+        session_id = upload.fields.get("session_id") or None
+        duplicate = await run_in_threadpool(ingest_queue.find_duplicate, session_id, upload.sha256, filename)
+        if duplicate is not None and Path(duplicate["file_path"]).exists():
+            upload.path.unlink(missing_ok=True)
+            logger.info("Skipping duplicate upload %s (same content as job %s)", filename, duplicate["job_id"])
             return JSONResponse(
-                status_code=400,
-                content={"error": f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}
+                status_code=200,
+                content={
+                    "message": "This file was already uploaded to this session; reusing it.",
+                    "filename": filename,
+                    "job_id": duplicate["job_id"],
+                    "status": duplicate["status"],
+                    "session_id": session_id,
+                    "duplicate": True,
+                }
             )
 
-        global document_processor, rag_pipeline
-        documents_dir = resolve_path("DOCUMENTS_DIR", "documents")
-        vectorstore_path = resolve_path("VECTORSTORE_PATH", "vectorstore")
         processor = build_document_processor(
             documents_dir=documents_dir,
-            vectorstore_path=vectorstore_path,
+            vectorstore_path=resolve_path("VECTORSTORE_PATH", "vectorstore"),
             session_id=session_id,
         )
 
-        # Save the file
+        # Same filesystem, so moving the finished file into place is a rename, not a copy.
         processor.data_dir.mkdir(parents=True, exist_ok=True)
         file_path = processor.data_dir / filename
-        await run_in_threadpool(save_upload_to_disk, file, file_path)
+        os.replace(upload.path, file_path)
         job_id = uuid4().hex
-        upload_jobs[job_id] = {
-            "job_id": job_id,
-            "status": "queued",
-            "message": "Upload received",
-            "filename": filename,
-            "session_id": session_id,
-            "chunks": 0,
-        }
-        background_tasks.add_task(process_upload_job, job_id, str(file_path), session_id, filename)
+        await run_in_threadpool(
+            ingest_queue.enqueue, job_id, str(file_path), filename, session_id, upload.sha256, upload.size
+        )
+        if ingest_pool is not None:
+            ingest_pool.wake()
 
         return JSONResponse(
             status_code=202,
             content={
-                "message": "Upload received. Document processing has started.",
+                "message": "Upload received. Document is queued for processing.",
                 "filename": filename,
                 "job_id": job_id,
                 "status": "queued",
@@ -225,6 +284,7 @@ async def upload_file(
             }
         )
     except Exception as e:
+        upload.path.unlink(missing_ok=True)
         logger.exception("Error processing uploaded file")
         return JSONResponse(
             status_code=500,
@@ -234,10 +294,22 @@ async def upload_file(
 
 @app.get("/upload-status/{job_id}")
 async def upload_status(job_id: str):
-    job = upload_jobs.get(job_id)
+    job = await run_in_threadpool(ingest_queue.get, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Upload job not found")
-    return job
+    return {
+        key: job[key]
+        for key in ("job_id", "status", "message", "filename", "session_id", "chunks", "pages", "attempts")
+    }
+
+@app.get("/ingest/stats")
+async def ingest_stats():
+    """Durable upload queue depth, this worker's ingestion pool and the shared chunk store."""
+    stats = await run_in_threadpool(ingest_queue.stats)
+    stats["pool"] = ingest_pool.stats() if ingest_pool is not None else None
+    if RAG_PROFILE != "full":
+        stats["chunk_store"] = await run_in_threadpool(shared_chunk_store().stats)
+    return stats
 
 
 @app.get("/health")
@@ -250,9 +322,143 @@ async def health_check():
         "rag_profile": RAG_PROFILE,
     }
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report response cache sizes and semantic and embedding cache hit statistics."""
+    if rag_pipeline is None:
+        raise HTTPException(status_code=503, detail="RAG pipeline is not initialized")
+
+    semantic_cache = getattr(rag_pipeline, "semantic_cache", None)
+    if RAG_PROFILE == "full":
+        embeddings = rag_pipeline.embedding_function.stats()
+    else:
+        embeddings = await run_in_threadpool(shared_embedding_store().stats)
+    return {
+        "response_cache": await run_in_threadpool(rag_pipeline.response_cache.stats),
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "embeddings": embeddings,
+    }
+
+@app.get("/collections/stats")
+async def collections_stats(session_id: Optional[str] = None):
+    """Report cached chunk counts per collection and open Chroma handle metrics."""
+    if rag_pipeline is None:
+        raise HTTPException(status_code=503, detail="RAG pipeline is not initialized")
+    if not hasattr(rag_pipeline, "collection_info"):
+        raise HTTPException(status_code=404, detail="Collection stats are not available for this profile")
+    return {
+        "collections": await rag_pipeline.collection_info(session_id),
+        "handles": rag_pipeline.registry.stats(),
+    }
+
+@app.get("/retrieval/stats")
+async def retrieval_stats():
+    """Report micro-batching queue depth and batch sizes for Chroma queries."""
+    batcher = getattr(rag_pipeline, "query_batcher", None)
+    if batcher is None:
+        raise HTTPException(status_code=404, detail="Batched retrieval is not enabled for this profile")
+    return batcher.stats()
+
+def register_pipeline_gauges(pipeline):
+    """Expose the pipeline's own counters as gauges read at scrape time."""
+    # Several gauges read the same stats() (some run a SQLite query); take one
+    # snapshot per source per scrape. Keys a backend does not report read as 0.
+    snapshots: Dict[int, tuple] = {}
+
+    def stat(source, key):
+        def read():
+            taken, values = snapshots.get(id(source), (0.0, None))
+            if values is None or time.monotonic() - taken > 1.0:
+                values = source.stats()
+                snapshots[id(source)] = (time.monotonic(), values)
+            return values.get(key) or 0
+        return read
+
+    REGISTRY.gauge("rag_response_cache_entries", "Answers held in the response cache.",
+                   function=stat(pipeline.response_cache, "entries"))
+    REGISTRY.gauge("rag_response_cache_bytes", "Estimated size of cached answers.",
+                   function=stat(pipeline.response_cache, "bytes"))
+    REGISTRY.gauge("llm_rate_limiter_active", "LLM calls currently admitted.",
+                   function=lambda: pipeline.rate_limiter.active)
+    REGISTRY.gauge("llm_rate_limiter_queue_depth", "LLM calls waiting for admission.",
+                   function=lambda: pipeline.rate_limiter.queue_depth)
+    REGISTRY.gauge("llm_rate_limiter_rejected", "LLM calls rejected with 503 since start.",
+                   function=lambda: pipeline.rate_limiter.rejected)
+    REGISTRY.gauge("llm_retries", "Groq requests retried since start.",
+                   function=lambda: pipeline.llama_helper.retries)
+    if getattr(pipeline, "semantic_cache", None) is not None:
+        REGISTRY.gauge("rag_semantic_cache_entries", "Questions held in the semantic cache.",
+                       function=stat(pipeline.semantic_cache, "entries"))
+    if getattr(pipeline, "query_batcher", None) is not None:
+        REGISTRY.gauge("rag_retrieval_queue_depth", "Vector queries waiting to be batched.",
+                       function=lambda: pipeline.query_batcher.queue_depth)
+    REGISTRY.gauge("rag_ingest_queue_depth", "Uploads waiting in the ingest queue.",
+                   function=stat(ingest_queue, "queued"))
+    REGISTRY.gauge("rag_upload_jobs_in_progress", "Uploads being indexed by any worker.",
+                   function=stat(ingest_queue, "processing"))
+    if getattr(pipeline, "registry", None) is not None:
+        REGISTRY.gauge("rag_open_collections", "Open Chroma collection handles.",
+                       function=lambda: len(pipeline.registry.handles))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of pipeline, cache, upload and LLM metrics."""
+    # Some gauges read SQLite-backed stats, so render off the event loop.
+    body = await run_in_threadpool(REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Report LLM rate limiter queue depth, wait times and Groq retries."""
+    if rag_pipeline is None:
+        raise HTTPException(status_code=503, detail="RAG pipeline is not initialized")
+    return {
+        "rate_limiter": rag_pipeline.rate_limiter.stats(),
+        "retries": rag_pipeline.llama_helper.retries,
+    }
+
+def require_admin(token: Optional[str]):
+    """Admin endpoints need ``X-Admin-Token: $ADMIN_TOKEN``; without ADMIN_TOKEN they are disabled."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/slow-queries")
+async def slow_query_report(x_admin_token: Optional[str] = Header(default=None)):
+    """Recent slow /ask requests with their stage timings and any sampled profile."""
+    require_admin(x_admin_token)
+    return slow_queries.stats()
+
+@app.get("/admin/sessions/gc")
+async def session_gc_report(x_admin_token: Optional[str] = Header(default=None)):
+    """Report the last session garbage collection run."""
+    require_admin(x_admin_token)
+    reaper = getattr(rag_pipeline, "session_reaper", None)
+    if reaper is None:
+        raise HTTPException(status_code=404, detail="Session collection is not enabled for this profile")
+    return {"ttl_seconds": reaper.ttl, "last_run": reaper.last_report}
+
+@app.post("/admin/sessions/gc")
+async def run_session_gc(x_admin_token: Optional[str] = Header(default=None)):
+    """Reap expired sessions now and report how many bytes were reclaimed."""
+    require_admin(x_admin_token)
+    reaper = getattr(rag_pipeline, "session_reaper", None)
+    if reaper is None:
+        raise HTTPException(status_code=404, detail="Session collection is not enabled for this profile")
+    return await run_in_threadpool(reaper.collect)
+
+async def session_gc_loop(reaper, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(reaper.collect)
+        except Exception:
+            logger.exception("Session garbage collection failed")
+
 @app.on_event("startup")
 async def startup_event():
-    global rag_pipeline, document_processor
+    global rag_pipeline, document_processor, session_gc_task, loop_lag_task, ingest_pool, ingest_watch_task
     try:
         if RAG_PROFILE == "full":
             from rag_pipeline_full import RAGPipeline
@@ -264,6 +470,7 @@ async def startup_event():
         vectorstore_path = resolve_path("VECTORSTORE_PATH", "vectorstore")
         documents_dir.mkdir(parents=True, exist_ok=True)
         vectorstore_path.mkdir(parents=True, exist_ok=True)
+        await run_in_threadpool(sweep_incoming, documents_dir / ".incoming")
 
         await prepare_default_documents_if_needed(documents_dir, vectorstore_path)
 
@@ -274,6 +481,30 @@ async def startup_event():
         )
         rag_pipeline = RAGPipeline(chroma_path=str(vectorstore_path))
         logger.info("RAG pipeline initialized successfully")
+        register_pipeline_gauges(rag_pipeline)
+        loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+
+        gc_interval = float(os.getenv("SESSION_GC_INTERVAL_SECONDS", "3600"))
+        reaper = getattr(rag_pipeline, "session_reaper", None)
+        if reaper is not None and gc_interval > 0 and reaper.ttl > 0:
+            session_gc_task = asyncio.create_task(session_gc_loop(reaper, gc_interval))
+
+        # Uploads are indexed from the durable queue by a small pool of its own;
+        # with INGEST_QUEUE_WORKERS=0 this process only enqueues and another one indexes.
+        ingest_workers = int(os.getenv("INGEST_QUEUE_WORKERS", "1"))
+        poll_interval = float(os.getenv("INGEST_POLL_INTERVAL_SECONDS", "1"))
+        if ingest_workers > 0:
+            ingest_pool = IngestWorkerPool(
+                ingest_queue,
+                ingest_upload,
+                workers=ingest_workers,
+                poll_interval=poll_interval,
+                on_complete=reload_session,
+            )
+            ingest_pool.start()
+        ingest_watch_task = asyncio.create_task(
+            ingest_watch_loop(ingest_queue, ingest_pool.worker_id if ingest_pool else None, poll_interval)
+        )
     except Exception as e:
         logger.exception("Failed to initialize RAG pipeline")
         raise
@@ -281,67 +512,146 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if session_gc_task is not None:
+        session_gc_task.cancel()
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+    if ingest_watch_task is not None:
+        ingest_watch_task.cancel()
+    if ingest_pool is not None:
+        await ingest_pool.stop()
+    if rag_pipeline and hasattr(rag_pipeline.response_cache, "close"):
+        rag_pipeline.response_cache.close()
     if rag_pipeline and getattr(rag_pipeline, "llama_helper", None):
         await rag_pipeline.llama_helper.aclose()
 
+def sse_event(data) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
 async def stream_response(
+    chunks,
+    first=None,
+    error: Optional[Exception] = None,
+    trace: Optional[RequestTrace] = None,
+    send_trace: bool = False,
+):
+    """Stream response chunks as Server-Sent Events."""
+    outcome = "cancelled"
+    try:
+        # aclosing() propagates a client disconnect into the pipeline so the
+        # upstream Groq stream is torn down instead of running to completion.
+        async with aclosing(chunks):
+            if error is not None:
+                raise error
+            if first is not None:
+                chunk, metadata, scores = first
+                yield sse_event({"chunk": chunk, "metadata": metadata, "scores": scores})
+                async for chunk, metadata, scores in chunks:
+                    yield sse_event({"chunk": chunk, "metadata": metadata, "scores": scores})
+        outcome = "ok"
+    except Exception as e:
+        outcome = "error"
+        logger.exception("Error in stream_response")
+        yield sse_event({"error": str(e)})
+    finally:
+        if trace is not None:
+            slow_queries.finish(trace, outcome)
+
+    if send_trace and trace is not None:
+        yield sse_event({"trace": trace.as_dict()})
+    # Send end marker
+    yield "data: [DONE]\n\n"
+
+async def answer_response(
     question: str,
     use_cache: bool = True,
     history: Optional[List[Dict[str, str]]] = None,
     session_id: Optional[str] = None,
+    send_trace: bool = False,
 ):
-    """Stream response chunks as Server-Sent Events."""
+    """
+    Start the answer before committing to a stream, so a request the LLM
+    rate limiter turns away gets a real 503 with Retry-After.
+
+    Every request is timed for the slow-query log; with ``send_trace`` the
+    stage timings are also sent as a final ``trace`` event before [DONE].
+    """
+    trace = slow_queries.begin(question)
+    stream_kwargs = {
+        "use_cache": use_cache,
+        "history": history,
+    }
+    if RAG_PROFILE != "full":
+        stream_kwargs["session_id"] = session_id
+
+    chunks = rag_pipeline.answer_question_stream(question, **stream_kwargs)
+    first = None
+    error = None
     try:
-        stream_kwargs = {
-            "use_cache": use_cache,
-            "history": history,
-        }
-        if RAG_PROFILE != "full":
-            stream_kwargs["session_id"] = session_id
-
-        async for chunk, metadata, scores in rag_pipeline.answer_question_stream(question, **stream_kwargs):
-            # Prepare SSE message
-            data = {
-                "chunk": chunk,
-                "metadata": metadata,
-                "scores": scores
-            }
-            yield f"data: {json.dumps(data)}\n\n"
-        
-        # Send end marker
-        yield "data: [DONE]\n\n"
-    except Exception as e:
-        logger.exception("Error in stream_response")
-        error_data = {"error": str(e)}
-        yield f"data: {json.dumps(error_data)}\n\n"
-        yield "data: [DONE]\n\n"
+        first = await anext(chunks)
+        trace.mark_first_chunk()
+    except StopAsyncIteration:
+        pass
+    except RateLimitExceeded as exc:
+        logger.warning("Rejecting question, %s", exc)
+        slow_queries.finish(trace, "rejected")
+        await chunks.aclose()
+        return JSONResponse(
+            status_code=503,
+            content={"error": str(exc)},
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+    except Exception as exc:
+        error = exc
+    except BaseException:
+        # Cancelled before the stream started, so stream_response will never
+        # finish the trace; an unfinished trace would keep its profiler armed.
+        slow_queries.finish(trace, "cancelled")
+        await chunks.aclose()
+        raise
+
+    return StreamingResponse(
+        stream_response(chunks, first, error, trace, send_trace and TRACE_ENABLED),
+        media_type="text/event-stream",
+    )
 
 @app.get("/ask")
-async def ask_question_get(question: str, use_cache: bool = True, session_id: Optional[str] = None):
+async def ask_question_get(
+    question: str,
+    use_cache: bool = True,
+    session_id: Optional[str] = None,
+    trace: bool = False,
+    x_trace: Optional[str] = Header(default=None),
+):
     """GET endpoint for SSE streaming."""
     if not question.strip():
         raise HTTPException(status_code=400, detail="`question` field is required")
 
-    return StreamingResponse(
-        stream_response(question.strip(), use_cache=use_cache, history=None, session_id=session_id),
-        media_type="text/event-stream"
+    return await answer_response(
+        question.strip(),
+        use_cache=use_cache,
+        history=None,
+        session_id=session_id,
+        send_trace=trace_requested(x_trace, trace),
     )
 
 @app.post("/ask")
-async def ask_question_post(payload: AskRequest):
+async def ask_question_post(
+    payload: AskRequest,
+    trace: bool = False,
+    x_trace: Optional[str] = Header(default=None),
+):
     """POST endpoint for regular requests."""
     question = payload.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="`question` field is required")
 
-    return StreamingResponse(
-        stream_response(
-            question,
-            use_cache=payload.use_cache,
-            history=payload.history,
-            session_id=payload.session_id,
-        ),
-        media_type="text/event-stream"
+    return await answer_response(
+        question,
+        use_cache=payload.use_cache,
+        history=payload.history,
+        session_id=payload.session_id,
+        send_trace=trace_requested(x_trace, trace),
     )
 
 if __name__ == "__main__":
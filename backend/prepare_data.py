@@ -1,18 +1,54 @@
+import argparse
 import hashlib
+import json
 import logging
 import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Iterable, Iterator, Optional, Union
+from xml.etree import ElementTree
 
-import chromadb
 import docx2txt
 from PyPDF2 import PdfReader
-from settings import collection_name_for_session, normalize_session_id, resolve_path
+from chroma_registry import shared_chroma_registry
+from chunk_store import ChunkStore, shared_chunk_store
+from embedding_store import default_embedding_function, shared_embedding_store
+from ingest_queue import PermanentIngestError
+from lexical_index import BM25Index, lexical_index_path
+from metrics import CACHE_LOOKUPS, INGEST_CHUNKS, INGEST_SECONDS
+from settings import (
+    bundled_files,
+    collection_name_for_session,
+    env_bool,
+    file_lock,
+    normalize_session_id,
+    resolve_path,
+    shared_collection_name,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SUPPORTED_EXTENSIONS = {".txt", ".md", ".pdf", ".docx"}
+TEXT_BLOCK_SIZE = 256 * 1024
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_BODY_PART = "word/document.xml"
+# Run-level elements that stand for whitespace between w:t text nodes.
+DOCX_WHITESPACE = {
+    f"{WORD_NAMESPACE}tab": "\t",
+    f"{WORD_NAMESPACE}br": "\n",
+    f"{WORD_NAMESPACE}cr": "\n",
+}
+
+
+class UnreadableDocumentError(PermanentIngestError):
+    """The file is not the document its extension claims; the ingest queue does not retry it."""
+
 
 @dataclass
 class TextChunk:
@@ -21,6 +57,109 @@ class TextChunk:
     metadata: dict
 
 
+def shared_chunk_id(document: str, index: int) -> str:
+    """ID of a chunk in the shared collection; the same for every session that uploads the document."""
+    return hashlib.sha1(f"{document}:{index}".encode("utf-8")).hexdigest()
+
+
+def file_sha256(file_path: Path, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with file_path.open("rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    Per-collection record of indexed source files.
+
+    Each entry stores the file's content hash, mtime, size and the chunk IDs
+    it produced, so unchanged files can be skipped and the chunks of changed
+    or removed files can be deleted from Chroma. Hold ``locked()`` around a
+    load/modify/save: it excludes other threads and other worker processes.
+    """
+
+    _locks: dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        with self._locks_guard:
+            self.lock = self._locks.setdefault(str(path), threading.Lock())
+        self.entries: dict[str, dict] = {}
+        self.load()
+
+    @contextmanager
+    def locked(self):
+        with self.lock, file_lock(self.path.with_suffix(".lock")):
+            yield
+
+    def load(self):
+        try:
+            self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("files", {})
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable index manifest at %s", self.path)
+            self.entries = {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps({"files": self.entries}), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    def key(self, file_path: Path) -> str:
+        try:
+            return file_path.resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return str(file_path.resolve())
+
+    def check(self, file_path: Path) -> tuple[bool, str]:
+        """Return whether ``file_path`` is already indexed as-is, and its content hash."""
+        entry = self.entries.get(self.key(file_path))
+        stat = file_path.stat()
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return True, entry["sha256"]
+
+        digest = file_sha256(file_path)
+        if entry and entry["sha256"] == digest:
+            # Touched but not modified: refresh the stat fields only.
+            entry.update(mtime=stat.st_mtime, size=stat.st_size)
+            return True, digest
+        return False, digest
+
+    def chunk_ids(self, file_path: Path) -> list[str]:
+        entry = self.entries.get(self.key(file_path))
+        return list(entry["chunk_ids"]) if entry else []
+
+    def document(self, file_path: Path) -> Optional[str]:
+        """Shared-collection document the file is linked to, or None if its chunks are in this collection."""
+        entry = self.entries.get(self.key(file_path))
+        return entry.get("document") if entry else None
+
+    def record(self, file_path: Path, digest: str, chunk_ids: list[str], document: Optional[str] = None):
+        stat = file_path.stat()
+        entry = {
+            "sha256": digest,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "chunk_ids": chunk_ids,
+        }
+        if document is not None:
+            entry["document"] = document
+        self.entries[self.key(file_path)] = entry
+
+    def forget_missing(self, present: set[str]) -> list[str]:
+        """Drop entries whose files no longer exist and return their chunk IDs."""
+        orphaned = []
+        for key in [key for key in self.entries if key not in present]:
+            orphaned.extend(self.entries.pop(key)["chunk_ids"])
+        return orphaned
+
+
 class DocumentProcessor:
     """Render-friendly vector indexing with Chroma's ONNX MiniLM embeddings."""
 
@@ -34,137 +173,575 @@ class DocumentProcessor:
         collection_name: Optional[str] = None,
         chunk_size: int = 500,
         chunk_overlap: int = 50,
+        batch_size: int = 64,
     ):
         self.data_dir = Path(data_dir) if data_dir else resolve_path("DOCUMENTS_DIR", "documents")
         self.vectorstore_path = Path(vectorstore_path) if vectorstore_path else resolve_path("VECTORSTORE_PATH", "vectorstore")
         self.session_key = normalize_session_id(session_id)
         base_collection_name = collection_name or os.getenv("CHROMA_COLLECTION", "doc_chatbot")
         self.collection_name = collection_name_for_session(base_collection_name, session_id)
+        self.shared_collection_name = shared_collection_name(base_collection_name)
         self.chunk_size = int(os.getenv("CHUNK_SIZE", str(chunk_size)))
         self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", str(chunk_overlap)))
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", str(batch_size)))
+        self.workers = int(os.getenv("INGEST_WORKERS", "1"))
+        self.use_embedding_cache = env_bool("EMBEDDING_CACHE", True)
+        self.use_chunk_store = env_bool("CHUNK_STORE", True)
 
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.vectorstore_path.mkdir(parents=True, exist_ok=True)
 
+    def __getstate__(self):
+        # Only plain configuration crosses into ingestion worker processes.
+        return {
+            key: value for key, value in self.__dict__.items()
+            if isinstance(value, (str, int, float, Path))
+        }
+
     def _collection(self):
-        client = chromadb.PersistentClient(path=str(self.vectorstore_path))
-        return client.get_or_create_collection(name=self.collection_name)
+        return shared_chroma_registry().collection(self.vectorstore_path, self.collection_name)
+
+    def _shared_collection(self):
+        return shared_chroma_registry().collection(self.vectorstore_path, self.shared_collection_name)
+
+    def _manifest(self) -> IndexManifest:
+        return IndexManifest(
+            self.vectorstore_path / "manifests" / f"{self.collection_name}.json",
+            root=self.data_dir,
+        )
+
+    @contextmanager
+    def _lexical_update(self) -> Iterator[BM25Index]:
+        """Load this collection's BM25 index for writing and persist it on success."""
+        index = BM25Index(lexical_index_path(self.vectorstore_path, self.collection_name))
+        with index.locked():
+            index.load()
+            yield index
+            index.save()
+
+    def _delete_chunks(self, collection, chunk_ids: list[str], lexical: Optional[BM25Index] = None):
+        for start in range(0, len(chunk_ids), self.batch_size):
+            collection.delete(ids=chunk_ids[start:start + self.batch_size])
+        if lexical is not None:
+            for chunk_id in chunk_ids:
+                lexical.remove(chunk_id)
+        if chunk_ids:
+            logger.info("Deleted %s stale chunks from %s", len(chunk_ids), self.collection_name)
 
     def process_document(self, file_path: Path) -> list[TextChunk]:
         """Load a document and split it into chunks ready for Chroma."""
+        chunks = list(self.iter_document_chunks(file_path))
+        if chunks:
+            logger.info("Added %s chunks from %s", len(chunks), file_path.name)
+        return chunks
+
+    @property
+    def chunker(self) -> str:
+        """Chunking settings; stored chunks are only reused under the same ones."""
+        return f"{self.chunk_size}:{self.chunk_overlap}"
+
+    def _chunk(self, file_path: Path, index: int, content: str) -> TextChunk:
+        chunk_id = hashlib.sha1(
+            f"{file_path.name}:{index}:{content}".encode("utf-8")
+        ).hexdigest()
+        return TextChunk(
+            id=chunk_id,
+            content=content,
+            metadata={
+                "source": file_path.name,
+                "path": str(file_path),
+                "chunk": index,
+                "session": self.session_key,
+            },
+        )
+
+    def iter_document_chunks(
+        self,
+        file_path: Path,
+        progress: Optional[Callable[[dict], None]] = None,
+    ) -> Iterator[TextChunk]:
+        """Stream a document page by page and yield chunks as they are formed."""
         if not file_path or not file_path.exists():
-            return []
+            return
 
         suffix = file_path.suffix.lower()
-        if suffix not in {".txt", ".md", ".pdf", ".docx"}:
+        if suffix not in SUPPORTED_EXTENSIONS:
             logger.info("Skipping unsupported file type: %s", file_path)
-            return []
+            return
+
+        for index, content in enumerate(self._iter_contents(file_path, progress)):
+            yield self._chunk(file_path, index, content)
 
+    def _iter_contents(self, file_path: Path, progress: Optional[Callable[[dict], None]] = None) -> Iterator[str]:
         logger.info("Processing document: %s", file_path)
-        text = self._extract_text(file_path)
-        if not text.strip():
-            return []
-
-        chunks = []
-        for index, content in enumerate(self._chunk_text(text)):
-            chunk_id = hashlib.sha1(
-                f"{file_path.name}:{index}:{content}".encode("utf-8")
-            ).hexdigest()
-            chunks.append(
-                TextChunk(
-                    id=chunk_id,
-                    content=content,
-                    metadata={
-                        "source": file_path.name,
-                        "path": str(file_path),
-                        "chunk": index,
-                        "session": self.session_key,
-                    },
-                )
-            )
+        pages = self._iter_pages(file_path)
+        if progress is not None:
+            pages = self._report_pages(pages, progress)
+        yield from self._iter_chunks(pages)
 
-        logger.info("Added %s chunks from %s", len(chunks), file_path.name)
-        return chunks
+    def index_document(
+        self,
+        file_path: Path,
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[dict], None]] = None,
+    ) -> int:
+        """
+        Extract, chunk and upsert one document in fixed-size batches.
+
+        Only one batch of chunks is held in memory at a time, so peak memory
+        follows the batch size rather than the document size. With the chunk
+        store on, the chunks go to the shared collection once per distinct
+        file and this session is linked to them; a file another session
+        already uploaded is not extracted or embedded again.
+        """
+        batch_size = batch_size or self.batch_size
+        started = time.perf_counter()
+        state = {"pages": 0, "chunks": 0}
+
+        def report(update: Optional[dict] = None):
+            if update is not None:
+                state["pages"] = update["pages"]
+            if progress is not None:
+                progress(dict(state))
+
+        manifest = self._manifest()
+        with manifest.locked():
+            manifest.load()
+            current, digest = manifest.check(file_path)
+            if current:
+                state["chunks"] = len(manifest.chunk_ids(file_path))
+                logger.info("Skipping unchanged document %s", file_path.name)
+                manifest.save()
+                return state["chunks"]
+            previous_ids = manifest.chunk_ids(file_path)
+            previous_document = manifest.document(file_path)
+
+            store = shared_chunk_store() if self.use_chunk_store else None
+            with self._lexical_update() as lexical:
+                if store is not None:
+                    document, chunk_ids = self._index_shared(file_path, digest, batch_size, lexical, state, report)
+                else:
+                    document, chunk_ids = None, self._index_own(file_path, batch_size, lexical, state, report)
+
+                if document is not None and chunk_ids:
+                    replaced = store.link(self.collection_name, file_path.name, digest, self.chunker)
+                else:
+                    replaced = previous_document
+                    if previous_document is not None:
+                        shared_chunk_store().unlink(self.collection_name, file_path.name)
+
+                if previous_document is None:
+                    stale_ids = sorted(set(previous_ids) - set(chunk_ids))
+                    if stale_ids:
+                        self._delete_chunks(self._collection(), stale_ids, lexical)
+                elif replaced is not None and not shared_chunk_store().linked(self.collection_name, replaced):
+                    # Shared rows stay for other sessions; only this session's lexical entries go.
+                    for chunk_id in previous_ids:
+                        lexical.remove(chunk_id)
+
+            manifest.record(file_path, digest, chunk_ids, document=document if chunk_ids else None)
+            manifest.save()
+
+        if store is not None:
+            store.sweep(self._shared_collection())
+        INGEST_SECONDS.observe(time.perf_counter() - started, stage="document")
+        if state["chunks"]:
+            logger.info("Indexed %s chunks from %s", state["chunks"], file_path.name)
+        return state["chunks"]
+
+    def _index_own(
+        self,
+        file_path: Path,
+        batch_size: int,
+        lexical: BM25Index,
+        state: dict,
+        report: Callable[[Optional[dict]], None],
+    ) -> list[str]:
+        """Upsert the document's chunks into this session's own collection."""
+        collection = None
+        chunk_ids: list[str] = []
+        batch: list[TextChunk] = []
+        for chunk in self.iter_document_chunks(file_path, progress=report):
+            batch.append(chunk)
+            chunk_ids.append(chunk.id)
+            if len(batch) >= batch_size:
+                collection = collection or self._collection()
+                self._upsert(collection, batch, lexical)
+                state["chunks"] += len(batch)
+                report()
+                batch = []
+        if batch:
+            self._upsert(collection or self._collection(), batch, lexical)
+            state["chunks"] += len(batch)
+            report()
+        return chunk_ids
+
+    def _index_shared(
+        self,
+        file_path: Path,
+        digest: str,
+        batch_size: int,
+        lexical: BM25Index,
+        state: dict,
+        report: Callable[[Optional[dict]], None],
+    ) -> tuple[str, list[str]]:
+        """
+        Make the document's chunks available in the shared collection and add
+        them to this session's lexical index, one batch at a time.
+        """
+        store = shared_chunk_store()
+        document = ChunkStore.key(digest, self.chunker)
+        collection = self._shared_collection()
+        stored = store.begin(digest, self.chunker)
+        CACHE_LOOKUPS.inc(cache="chunk_store", result="miss" if stored is None else "hit")
+
+        if stored is not None:
+            logger.info("Reusing %s shared chunks for %s", stored["chunks"], file_path.name)
+            state["pages"] = stored["pages"]
+            chunk_ids = [shared_chunk_id(document, index) for index in range(stored["chunks"])]
+            for start in range(0, len(chunk_ids), batch_size):
+                found = collection.get(ids=chunk_ids[start:start + batch_size], include=["documents"])
+                lexical.add_many(zip(found["ids"], found["documents"]))
+                state["chunks"] += len(found["ids"])
+                report()
+            return document, chunk_ids
+
+        chunk_ids = []
+        size = 0
+        batch: list[TextChunk] = []
+
+        def flush():
+            self._upsert(collection, batch, lexical)
+            store.stage(digest, self.chunker)
+            state["chunks"] += len(batch)
+            report()
+
+        for index, content in enumerate(self._iter_contents(file_path, progress=report)):
+            chunk_id = shared_chunk_id(document, index)
+            # No file name, path or session: the rows are shared, and search
+            # fills in each session's own file name.
+            batch.append(TextChunk(id=chunk_id, content=content, metadata={"document": document, "chunk": index}))
+            chunk_ids.append(chunk_id)
+            size += len(content.encode("utf-8"))
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+        if chunk_ids:
+            # A file without text stays staging and is collected with abandoned ingests.
+            store.publish(digest, self.chunker, state["pages"], len(chunk_ids), size)
+        return document, chunk_ids
 
     def process_documents(self) -> list[TextChunk]:
         documents = []
-        for file_path in self.data_dir.glob("**/*"):
-            if file_path.is_file():
-                documents.extend(self.process_document(file_path))
+        for file_path in bundled_files(self.data_dir):
+            documents.extend(self.process_document(file_path))
         return documents
 
+    def index_documents(
+        self,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """
+        Index every file under ``data_dir`` except session uploads.
+
+        Extraction and chunking run in a process pool of ``workers`` processes;
+        this process is the single writer and upserts chunks in batches. A file
+        that fails is recorded in the report instead of aborting the run.
+        """
+        workers = workers or self.workers
+        batch_size = batch_size or self.batch_size
+        files = sorted(
+            path for path in bundled_files(self.data_dir)
+            if path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+        report = {
+            "files": len(files), "processed": 0, "skipped": 0, "chunks": 0,
+            "deleted": 0, "failed": [], "timings": {},
+        }
+
+        manifest = self._manifest()
+        with manifest.locked():
+            manifest.load()
+            stale_ids = manifest.forget_missing({manifest.key(path) for path in files})
+            digests = {}
+            pending = []
+            for path in files:
+                current, digest = manifest.check(path)
+                if current:
+                    report["skipped"] += 1
+                else:
+                    digests[str(path)] = digest
+                    pending.append(path)
+
+            collection = None
+            batch: list[TextChunk] = []
+            with self._lexical_update() as lexical:
+                for path, chunks, elapsed, error in self._iter_processed_files(pending, workers):
+                    report["processed"] += 1
+                    report["timings"][path] = round(elapsed, 3)
+                    INGEST_SECONDS.observe(elapsed, stage="chunk")
+                    if error:
+                        logger.error("Failed to process %s: %s", path, error)
+                        report["failed"].append({"path": path, "error": error})
+                    else:
+                        logger.info("Chunked %s into %s chunks in %.2fs", path, len(chunks), elapsed)
+                        chunk_ids = [chunk.id for chunk in chunks]
+                        stale_ids.extend(set(manifest.chunk_ids(Path(path))) - set(chunk_ids))
+                        manifest.record(Path(path), digests[path], chunk_ids)
+
+                    batch.extend(chunks)
+                    while len(batch) >= batch_size:
+                        collection = collection or self._collection()
+                        self._upsert(collection, batch[:batch_size], lexical)
+                        report["chunks"] += min(batch_size, len(batch))
+                        batch = batch[batch_size:]
+
+                    if progress is not None:
+                        progress(dict(report, failed=len(report["failed"])))
+
+                if batch:
+                    collection = collection or self._collection()
+                    self._upsert(collection, batch, lexical)
+                    report["chunks"] += len(batch)
+
+                if stale_ids:
+                    self._delete_chunks(collection or self._collection(), stale_ids, lexical)
+                    report["deleted"] = len(stale_ids)
+            manifest.save()
+
+        logger.info(
+            "Indexed %s chunks from %s changed files with %s workers (%s unchanged, %s failed, %s stale chunks deleted)",
+            report["chunks"], report["processed"], workers, report["skipped"],
+            len(report["failed"]), report["deleted"],
+        )
+        return report
+
+    def _iter_processed_files(self, files: list[Path], workers: int) -> Iterator[tuple[str, list[TextChunk], float, Optional[str]]]:
+        if workers <= 1 or len(files) <= 1:
+            for file_path in files:
+                yield _chunk_file(self, file_path)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_chunk_file, self, file_path): file_path for file_path in files}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as exc:
+                    yield str(futures[future]), [], 0.0, str(exc)
+
     def update_vectorstore(self, documents: list[TextChunk]):
         if not documents:
             logger.warning("No documents to index")
             return
 
         collection = self._collection()
-        collection.upsert(
-            ids=[doc.id for doc in documents],
-            documents=[doc.content for doc in documents],
-            metadatas=[doc.metadata for doc in documents],
-        )
+        with self._lexical_update() as lexical:
+            for start in range(0, len(documents), self.batch_size):
+                self._upsert(collection, documents[start:start + self.batch_size], lexical)
         logger.info("Indexed %s chunks in Chroma at %s", len(documents), self.vectorstore_path)
 
     def create_vectorstore_from_documents(self, documents: list[TextChunk]):
         self.update_vectorstore(documents)
 
+    def _upsert(self, collection, documents: list[TextChunk], lexical: Optional[BM25Index] = None):
+        extra = {}
+        if self.use_embedding_cache:
+            # Reuse vectors for text already embedded in any session.
+            with INGEST_SECONDS.time(stage="embed"):
+                extra["embeddings"] = shared_embedding_store().embed(
+                    [doc.content for doc in documents],
+                    default_embedding_function(),
+                    batch_size=self.batch_size,
+                )
+        with INGEST_SECONDS.time(stage="upsert"):
+            collection.upsert(
+                ids=[doc.id for doc in documents],
+                documents=[doc.content for doc in documents],
+                metadatas=[doc.metadata for doc in documents],
+                **extra,
+            )
+        INGEST_CHUNKS.inc(len(documents))
+        if lexical is not None:
+            with INGEST_SECONDS.time(stage="lexical"):
+                lexical.add_many((doc.id, doc.content) for doc in documents)
+
     def _extract_text(self, file_path: Path) -> str:
+        return "\n\n".join(self._iter_pages(file_path))
+
+    def _iter_pages(self, file_path: Path) -> Iterator[str]:
+        """Yield a document's text one page (or block) at a time."""
         suffix = file_path.suffix.lower()
 
         if suffix in {".txt", ".md"}:
-            return file_path.read_text(encoding="utf-8", errors="ignore")
+            with file_path.open("r", encoding="utf-8", errors="ignore") as handle:
+                carry = ""
+                while True:
+                    block = handle.read(TEXT_BLOCK_SIZE)
+                    if not block:
+                        if carry:
+                            yield carry
+                        break
+                    # Finish the trailing partial line, reading at most one more block of it.
+                    tail = handle.readline(TEXT_BLOCK_SIZE)
+                    block = carry + block + tail
+                    carry = ""
+                    if len(tail) == TEXT_BLOCK_SIZE and not tail.endswith("\n"):
+                        # Still no newline: break at the last space and carry the rest over.
+                        cut = max(block.rfind(" "), block.rfind("\t"))
+                        if cut > 0:
+                            block, carry = block[:cut], block[cut + 1:]
+                    yield block
+            return
 
         if suffix == ".pdf":
             reader = PdfReader(str(file_path))
-            return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+            for page in reader.pages:
+                yield page.extract_text() or ""
+            return
 
         if suffix == ".docx":
-            return docx2txt.process(str(file_path)) or ""
+            yield from self._iter_docx_blocks(file_path)
+
+    def _iter_docx_blocks(self, file_path: Path, paragraphs_per_block: int = 50) -> Iterator[str]:
+        """
+        Stream paragraphs from the DOCX XML parts instead of loading the whole text.
+
+        Like docx2txt, headers come first and footers last, around the body
+        in word/document.xml.
+        """
+        try:
+            archive = zipfile.ZipFile(file_path)
+        except zipfile.BadZipFile:
+            logger.warning("Falling back to docx2txt for %s", file_path)
+            yield docx2txt.process(str(file_path)) or ""
+            return
 
-        return ""
+        with archive:
+            names = archive.namelist()
+            if DOCX_BODY_PART not in names:
+                raise UnreadableDocumentError(f"{file_path.name} is not a Word document: {DOCX_BODY_PART} is missing")
+            headers = sorted(name for name in names if name.startswith("word/header") and name.endswith(".xml"))
+            footers = sorted(name for name in names if name.startswith("word/footer") and name.endswith(".xml"))
+            for part in [*headers, DOCX_BODY_PART, *footers]:
+                with archive.open(part) as xml_file:
+                    yield from self._iter_docx_part(xml_file, paragraphs_per_block)
+
+    @staticmethod
+    def _iter_docx_part(xml_file, paragraphs_per_block: int) -> Iterator[str]:
+        block: list[str] = []
+        for _, element in ElementTree.iterparse(xml_file, events=("end",)):
+            if element.tag == f"{WORD_NAMESPACE}p":
+                parts = []
+                # Only run content: w:pPr also holds w:tab elements (tab stop definitions).
+                for run in element.iter(f"{WORD_NAMESPACE}r"):
+                    for node in run:
+                        if node.tag == f"{WORD_NAMESPACE}t":
+                            parts.append(node.text or "")
+                        elif node.tag in DOCX_WHITESPACE:
+                            parts.append(DOCX_WHITESPACE[node.tag])
+                block.append("".join(parts))
+                element.clear()
+                if len(block) >= paragraphs_per_block:
+                    yield "\n".join(block)
+                    block = []
+        if block:
+            yield "\n".join(block)
+
+    @staticmethod
+    def _report_pages(pages: Iterable[str], progress: Callable[[dict], None]) -> Iterator[str]:
+        for count, page in enumerate(pages, start=1):
+            yield page
+            progress({"pages": count})
+
+    def _normalize(self, text: str) -> str:
+        return "\n".join(line.strip() for line in text.splitlines() if line.strip())
 
     def _chunk_text(self, text: str) -> list[str]:
-        normalized = "\n".join(line.strip() for line in text.splitlines())
-        normalized = "\n".join(line for line in normalized.splitlines() if line)
-
-        if len(normalized) <= self.chunk_size:
-            return [normalized]
+        return list(self._iter_chunks([text]))
+
+    def _iter_chunks(self, pages: Iterable[str]) -> Iterator[str]:
+        """
+        Split a stream of pages into overlapping chunks.
+
+        Text is buffered only until a chunk boundary can be decided, so the
+        overlap carries across page boundaries without holding every page.
+        """
+        buffer = ""
+        for page in pages:
+            normalized = self._normalize(page)
+            if not normalized:
+                continue
+            buffer = f"{buffer}\n{normalized}" if buffer else normalized
+            if len(buffer) < 2 * self.chunk_size:
+                continue
+
+            start = 0
+            for chunk, start in self._split(buffer, final=False):
+                if chunk:
+                    yield chunk
+            buffer = buffer[start:]
+
+        for chunk, _ in self._split(buffer, final=True):
+            if chunk:
+                yield chunk
 
-        chunks = []
+    def _split(self, text: str, final: bool) -> Iterator[tuple[str, int]]:
+        """
+        Yield ``(chunk, next_start)`` pairs. Unless ``final`` is set, splitting
+        stops while less than a full chunk of text remains after ``start``.
+        """
         start = 0
-        text_length = len(normalized)
+        text_length = len(text)
 
         while start < text_length:
+            if not final and start + self.chunk_size >= text_length:
+                return
+
             end = min(start + self.chunk_size, text_length)
             if end < text_length:
-                paragraph_break = normalized.rfind("\n", start, end)
-                sentence_break = normalized.rfind(". ", start, end)
+                paragraph_break = text.rfind("\n", start, end)
+                sentence_break = text.rfind(". ", start, end)
                 split_at = max(paragraph_break, sentence_break)
                 if split_at > start + self.chunk_size // 2:
                     end = split_at + 1
 
-            chunk = normalized[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-
+            chunk = text[start:end].strip()
             if end >= text_length:
-                break
+                yield chunk, text_length
+                return
 
             next_start = end - self.chunk_overlap
             start = max(next_start, end) if next_start <= start else next_start
+            yield chunk, start
 
-        return chunks
+
+def _chunk_file(processor: DocumentProcessor, file_path: Path) -> tuple[str, list[TextChunk], float, Optional[str]]:
+    """Process-pool entry point: chunk one file and report timing or the error."""
+    started = time.perf_counter()
+    try:
+        chunks = processor.process_document(file_path)
+        return str(file_path), chunks, time.perf_counter() - started, None
+    except Exception as exc:
+        return str(file_path), [], time.perf_counter() - started, f"{type(exc).__name__}: {exc}"
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Index documents into Chroma.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
     processor = DocumentProcessor()
-    if not list(processor.data_dir.glob("**/*")):
+    if not any(bundled_files(processor.data_dir)):
         logger.warning("No documents found in %s", processor.data_dir)
         return
 
-    documents = processor.process_documents()
-    processor.create_vectorstore_from_documents(documents)
+    processor.index_documents(workers=args.workers, batch_size=args.batch_size)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,12 @@
+import argparse
 import os
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Optional, Union
+from typing import Callable, Iterator, List, Dict, Optional, Set, Tuple, Union
+import spacy
 from langchain_community.document_loaders import (
     Docx2txtLoader,
     PyPDFLoader,
@@ -10,12 +15,86 @@ from langchain_community.document_loaders import (
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
-from settings import resolve_path
+from embedding_store import CachedEmbeddings
+from metrics import INGEST_CHUNKS, INGEST_SECONDS
+from settings import bundled_files, resolve_path
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# File type to loader mapping
+LOADERS = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+    ".md": TextLoader,
+    ".docx": Docx2txtLoader,
+}
+
+
+def build_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        add_start_index=True,
+    )
+
+
+# Metadata key holding each chunk's space-separated keyword lemmas
+KEYWORDS_METADATA_KEY = "keyword_lemmas"
+
+
+@lru_cache(maxsize=1)
+def load_keyword_nlp():
+    """spaCy with only the tagger and lemmatizer; the parser and NER are not needed for keywords."""
+    try:
+        return spacy.load("en_core_web_sm", disable=["parser", "ner"])
+    except OSError:
+        logger.info("Downloading spaCy 'en_core_web_sm' model...")
+        spacy.cli.download("en_core_web_sm")
+        return spacy.load("en_core_web_sm", disable=["parser", "ner"])
+
+
+@lru_cache(maxsize=None)
+def shared_embeddings(model_name: str, device: str) -> CachedEmbeddings:
+    """One cached HuggingFace model per process, shared by the RAG pipeline and every upload's processor."""
+    return CachedEmbeddings(
+        HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": device}
+        ),
+        cache_size=int(os.getenv("EMBEDDING_MEMORY_CACHE_SIZE", "1000")),
+    )
+
+
+def keyword_lemmas(doc) -> Set[str]:
+    return {tok.lemma_.lower() for tok in doc if not (tok.is_stop or tok.is_punct or tok.is_space)}
+
+
+def annotate_keywords(chunks: List, batch_size: int = 64) -> List:
+    """Store each chunk's lemma set in its metadata so queries never re-run spaCy on chunks."""
+    nlp = load_keyword_nlp()
+    docs = nlp.pipe((chunk.page_content.lower() for chunk in chunks), batch_size=batch_size)
+    for chunk, doc in zip(chunks, docs):
+        chunk.metadata[KEYWORDS_METADATA_KEY] = " ".join(sorted(keyword_lemmas(doc)))
+    return chunks
+
+
+def load_and_split(file_path: Path, chunk_size: int, chunk_overlap: int) -> Tuple[str, List, float, Optional[str]]:
+    """Process-pool entry point: load and split one file, reporting timing or the error."""
+    started = time.perf_counter()
+    try:
+        loader = LOADERS.get(file_path.suffix.lower())
+        if loader is None:
+            return str(file_path), [], time.perf_counter() - started, None
+        chunks = build_text_splitter(chunk_size, chunk_overlap).split_documents(loader(str(file_path)).load())
+        annotate_keywords(chunks)
+        return str(file_path), chunks, time.perf_counter() - started, None
+    except Exception as e:
+        return str(file_path), [], time.perf_counter() - started, f"{type(e).__name__}: {e}"
+
+
 class DocumentProcessor:
     def __init__(
         self,
@@ -35,27 +114,20 @@ class DocumentProcessor:
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.vectorstore_path.mkdir(parents=True, exist_ok=True)
         
-        # Initialize embedding function
-        self.embedding_function = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs={"device": device}
-        )
+        # Shared embedding function; repeated chunks skip the model
+        self.embedding_function = shared_embeddings(embedding_model, device)
         
         # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            add_start_index=True,
-        )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = build_text_splitter(chunk_size, chunk_overlap)
         
         # File type to loader mapping
-        self.loaders = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".md": TextLoader,
-            ".docx": Docx2txtLoader,
-        }
+        self.loaders = LOADERS
+
+        # Parallel ingestion settings
+        self.workers = int(os.getenv("INGEST_WORKERS", "1"))
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", "64"))
     
     def process_document(self, file_path: Path) -> List[Dict]:
         """Process a single document."""
@@ -68,7 +140,7 @@ class DocumentProcessor:
                     # Load and split the document
                     loader = self.loaders[file_path.suffix.lower()](str(file_path))
                     doc = loader.load()
-                    chunks = self.text_splitter.split_documents(doc)
+                    chunks = annotate_keywords(self.text_splitter.split_documents(doc))
                     documents.extend(chunks)
                     logger.info(f"Added {len(chunks)} chunks from {file_path.name}")
                 except Exception as e:
@@ -81,12 +153,92 @@ class DocumentProcessor:
         """Process all documents in the data directory."""
         documents = []
         
-        for file_path in self.data_dir.glob("**/*"):
-            if file_path.is_file():
-                documents.extend(self.process_document(file_path))
+        for file_path in bundled_files(self.data_dir):
+            documents.extend(self.process_document(file_path))
         
         return documents
 
+    def index_documents(
+        self,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[Dict], None]] = None,
+    ) -> Dict:
+        """
+        Index every file in the data directory using a process pool.
+
+        Loading and splitting run in worker processes; this process is the
+        single writer and adds chunks to Chroma in batches. Failed files are
+        reported instead of aborting the run.
+        """
+        workers = workers or self.workers
+        batch_size = batch_size or self.batch_size
+        files = sorted(bundled_files(self.data_dir))
+        report = {"files": len(files), "processed": 0, "chunks": 0, "failed": [], "timings": {}}
+
+        vectorstore = None
+        batch = []
+        for path, chunks, elapsed, error in self._iter_split_files(files, workers):
+            report["processed"] += 1
+            report["timings"][path] = round(elapsed, 3)
+            INGEST_SECONDS.observe(elapsed, stage="chunk")
+            if error:
+                logger.error(f"Error processing {path}: {error}")
+                report["failed"].append({"path": path, "error": error})
+            else:
+                logger.info(f"Split {path} into {len(chunks)} chunks in {elapsed:.2f}s")
+
+            batch.extend(chunks)
+            while len(batch) >= batch_size:
+                vectorstore = vectorstore or Chroma(
+                    persist_directory=str(self.vectorstore_path),
+                    embedding_function=self.embedding_function
+                )
+                with INGEST_SECONDS.time(stage="upsert"):
+                    vectorstore.add_documents(batch[:batch_size])
+                INGEST_CHUNKS.inc(min(batch_size, len(batch)))
+                report["chunks"] += min(batch_size, len(batch))
+                batch = batch[batch_size:]
+
+            if progress is not None:
+                progress(dict(report, failed=len(report["failed"])))
+
+        if batch:
+            vectorstore = vectorstore or Chroma(
+                persist_directory=str(self.vectorstore_path),
+                embedding_function=self.embedding_function
+            )
+            with INGEST_SECONDS.time(stage="upsert"):
+                vectorstore.add_documents(batch)
+            INGEST_CHUNKS.inc(len(batch))
+            report["chunks"] += len(batch)
+
+        if vectorstore is not None:
+            vectorstore.persist()
+
+        logger.info(
+            f"Indexed {report['chunks']} chunks from {report['processed']} files "
+            f"with {workers} workers ({len(report['failed'])} failed)"
+        )
+        return report
+
+    def _iter_split_files(self, files: List[Path], workers: int) -> Iterator[Tuple[str, List, float, Optional[str]]]:
+        if workers <= 1 or len(files) <= 1:
+            for file_path in files:
+                yield load_and_split(file_path, self.chunk_size, self.chunk_overlap)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(load_and_split, file_path, self.chunk_size, self.chunk_overlap): file_path
+                for file_path in files
+            }
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield str(futures[future]), [], 0.0, str(e)
+
     def update_vectorstore(self, documents: List[Dict]):
         """Update the existing vector store with new documents."""
         if not documents:
@@ -137,18 +289,22 @@ class DocumentProcessor:
             raise
 
 def main():
+    parser = argparse.ArgumentParser(description="Index documents into Chroma with the full local stack.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
     # Initialize processor
     processor = DocumentProcessor()
     
     # Check if there are any documents
-    if not list(processor.data_dir.glob("**/*")):
+    if not any(bundled_files(processor.data_dir)):
         logger.warning(f"No documents found in {processor.data_dir}. Please add some documents first!")
         logger.info("Supported formats: PDF, TXT, MD")
         return
     
-    # Process documents and create vector store
-    documents = processor.process_documents()
-    processor.create_vectorstore_from_documents(documents)
+    # Process documents in parallel and write them to the vector store
+    processor.index_documents(workers=args.workers, batch_size=args.batch_size)
 
 if __name__ == "__main__":
     main()
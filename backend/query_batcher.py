@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+INCLUDE = ["documents", "metadatas", "distances"]
+
+
+@dataclass
+class PendingQuery:
+    text: str
+    embedding: Optional[np.ndarray]
+    future: asyncio.Future
+
+
+class QueryBatcher:
+    """
+    Micro-batching scheduler for Chroma queries.
+
+    Queries for the same collection and ``where`` filter that arrive within
+    ``window`` seconds (or until ``max_batch`` are waiting) are sent as one
+    ``collection.query`` call with several query embeddings, and each caller
+    gets its own slice of the result back.
+    """
+
+    def __init__(
+        self,
+        embed_function: Callable[[List[str]], Sequence[Sequence[float]]],
+        window: float = 0.01,
+        max_batch: int = 16,
+    ):
+        self.embed_function = embed_function
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: Dict[tuple, List[PendingQuery]] = {}
+        self.timers: Dict[tuple, asyncio.Task] = {}
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes: Counter = Counter()
+        self.max_queue_depth = 0
+        self._flushes: set = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(items) for items in self.pending.values())
+
+    async def query(
+        self,
+        collection_name: str,
+        collection,
+        n_results: int,
+        text: str,
+        embedding: Optional[np.ndarray] = None,
+        where: Optional[Dict] = None,
+    ) -> Dict[str, list]:
+        """Queue one query and return a Chroma-shaped result for it alone."""
+        key = (collection_name, n_results, json.dumps(where, sort_keys=True) if where else None)
+        future = asyncio.get_running_loop().create_future()
+        items = self.pending.setdefault(key, [])
+        items.append(PendingQuery(text=text, embedding=embedding, future=future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        if len(items) >= self.max_batch:
+            timer = self.timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._start(key, collection, n_results, where)
+        elif key not in self.timers:
+            self.timers[key] = asyncio.create_task(self._flush_later(key, collection, n_results, where))
+
+        return await future
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+        }
+
+    async def _flush_later(self, key: tuple, collection, n_results: int, where: Optional[Dict]):
+        await asyncio.sleep(self.window)
+        if self.timers.get(key) is asyncio.current_task():
+            del self.timers[key]
+        self._start(key, collection, n_results, where)
+
+    def _start(self, key: tuple, collection, n_results: int, where: Optional[Dict]):
+        items = [item for item in self.pending.pop(key, []) if not item.future.done()]
+        if items:
+            task = asyncio.create_task(self._flush(items, collection, n_results, where))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, items: List[PendingQuery], collection, n_results: int, where: Optional[Dict]):
+        self.batches += 1
+        self.queries += len(items)
+        self.batch_sizes[len(items)] += 1
+        try:
+            results = await asyncio.to_thread(self._run_batch, items, collection, n_results, where)
+        except Exception as exc:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+
+        for item, result in zip(items, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def _run_batch(
+        self, items: List[PendingQuery], collection, n_results: int, where: Optional[Dict]
+    ) -> List[Dict[str, list]]:
+        missing = [index for index, item in enumerate(items) if item.embedding is None]
+        if missing:
+            computed = self.embed_function([items[index].text for index in missing])
+            for index, vector in zip(missing, computed):
+                items[index].embedding = np.asarray(vector, dtype=np.float32)
+
+        raw = collection.query(
+            query_embeddings=[item.embedding.tolist() for item in items],
+            n_results=n_results,
+            where=where,
+            include=INCLUDE,
+        )
+        return [
+            {field: [raw[field][position]] for field in ["ids", *INCLUDE]}
+            for position in range(len(items))
+        ]
@@ -1,62 +1,364 @@
 import asyncio
 import logging
 import os
-import re
 import time
 from collections import OrderedDict
+from contextlib import aclosing
 from dataclasses import dataclass
 from heapq import nlargest
+from pathlib import Path
 from typing import AsyncGenerator, Dict, List, Optional, Tuple
 
-import chromadb
-from llama_helper import LlamaHelper
-from settings import collection_name_for_session, resolve_path
+import numpy as np
+from chroma_registry import shared_chroma_registry
+from chunk_store import shared_chunk_store
+from embedding_store import default_embedding_function
+from lexical_index import BM25Index, lexical_index_path, reciprocal_rank_fusion
+from llama_helper import create_llm_backend
+from metrics import CACHE_LOOKUPS, LLM_REQUESTS, STAGE_SECONDS, record_usage
+from query_batcher import QueryBatcher
+from rate_limiter import LLMRateLimiter
+from session_gc import SessionReaper
+from settings import collection_name_for_session, env_bool, resolve_path, shared_collection_name
+from state_store import SQLiteResponseCache, shared_store, state_backend
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-STOPWORDS = {
-    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has",
-    "he", "in", "is", "it", "its", "of", "on", "or", "that", "the", "to",
-    "was", "were", "what", "when", "where", "which", "who", "why", "with",
-}
-
-
 @dataclass
 class SearchResult:
     content: str
     metadata: Dict
     vector_score: float
     hybrid_score: float
+    rank_score: float = 0.0
+
+
+@dataclass
+class CollectionStats:
+    name: str
+    count: int
+    version: int
+    refreshed_at: float
+    mean_chunk_tokens: float = 0.0
+    vocabulary: int = 0
+    shared_documents: int = 0
+    shared_chunks: int = 0
+    # Shared-collection document key -> this session's file name(s) for it.
+    sources: Optional[Dict[str, str]] = None
+
+
+class CacheEntry:
+    __slots__ = ("key", "collection", "response", "size", "expires_at")
+
+    def __init__(self, key: str, collection: str, response: Tuple[str, List[Dict], List[float]], size: int, expires_at: float):
+        self.key = key
+        self.collection = collection
+        self.response = response
+        self.size = size
+        self.expires_at = expires_at
 
 
 class ResponseCache:
-    """LRU cache for storing question-response pairs with TTL."""
+    """
+    LRU cache for question-response pairs with TTL, a byte budget and
+    per-collection partitions.
 
-    def __init__(self, capacity: int = 1000, ttl: int = 3600):
+    Keys are ``collection:question``. Entries live in one recency-ordered dict
+    so lookups, inserts and evictions are O(1); each collection also keeps the
+    set of its keys so an upload only invalidates that session's answers. A
+    background task drops expired entries every ``sweep_interval`` seconds.
+    """
+
+    ENTRY_OVERHEAD = 256
+
+    def __init__(
+        self,
+        capacity: int = 1000,
+        ttl: int = 3600,
+        max_bytes: int = 16 * 1024 * 1024,
+        sweep_interval: float = 60,
+    ):
         self.capacity = capacity
         self.ttl = ttl
-        self.cache = OrderedDict()
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.partitions: Dict[str, set] = {}
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._sweeper: Optional[asyncio.Task] = None
 
     async def get(self, question: str) -> Optional[Tuple[str, List[Dict], List[float]]]:
-        if question not in self.cache:
+        entry = self.cache.get(question)
+        if entry is None:
             return None
 
-        timestamp, response = self.cache[question]
-        if time.time() - timestamp > self.ttl:
-            del self.cache[question]
+        if entry.expires_at < time.monotonic():
+            self._remove(entry)
+            self.expirations += 1
             return None
 
         self.cache.move_to_end(question)
-        return response
+        return entry.response
 
     async def put(self, question: str, response: Tuple[str, List[Dict], List[float]]):
-        self.cache[question] = (time.time(), response)
-        self.cache.move_to_end(question)
+        self._ensure_sweeper()
+        size = self._estimate_size(question, response)
+        if size > self.max_bytes:
+            return
+
+        existing = self.cache.get(question)
+        if existing is not None:
+            self._remove(existing)
+
+        collection = question.split(":", 1)[0]
+        entry = CacheEntry(question, collection, response, size, time.monotonic() + self.ttl)
+        self.cache[question] = entry
+        self.partitions.setdefault(collection, set()).add(question)
+        self.bytes += size
+
+        while self.cache and (len(self.cache) > self.capacity or self.bytes > self.max_bytes):
+            _, oldest = self.cache.popitem(last=False)
+            self._forget(oldest)
+            self.evictions += 1
+
+    def clear(self, collection_name: Optional[str] = None):
+        if collection_name is None:
+            self.cache.clear()
+            self.partitions.clear()
+            self.bytes = 0
+            return
+
+        for key in self.partitions.pop(collection_name, ()):
+            entry = self.cache.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+    def sweep(self) -> int:
+        """Drop every expired entry and return how many were removed."""
+        now = time.monotonic()
+        expired = [entry for entry in self.cache.values() if entry.expires_at < now]
+        for entry in expired:
+            self._remove(entry)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "memory",
+            "entries": len(self.cache),
+            "partitions": len(self.partitions),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.info("Swept %s expired cache entries", removed)
+
+    def _remove(self, entry: CacheEntry):
+        del self.cache[entry.key]
+        self._forget(entry)
+
+    def _forget(self, entry: CacheEntry):
+        self.bytes -= entry.size
+        keys = self.partitions.get(entry.collection)
+        if keys is not None:
+            keys.discard(entry.key)
+            if not keys:
+                del self.partitions[entry.collection]
+
+    def _estimate_size(self, key: str, response: Tuple[str, List[Dict], List[float]]) -> int:
+        answer, metadata, scores = response
+        size = self.ENTRY_OVERHEAD + len(key.encode("utf-8")) + len(answer.encode("utf-8")) + 8 * len(scores)
+        for item in metadata:
+            size += sum(len(str(name)) + len(str(value)) for name, value in item.items())
+        return size
+
+
+class SemanticPartition:
+    """Bounded matrix of normalized question vectors for one collection."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.vectors: Optional[np.ndarray] = None
+        self.keys: List[Optional[str]] = [None] * capacity
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+
+    def nearest(self, vector: np.ndarray) -> Optional[Tuple[int, float]]:
+        if self.size == 0 or self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            return None
+        similarities = self.vectors[:self.size] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def add(self, key: str, vector: np.ndarray):
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            self.vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            self.keys = [None] * self.capacity
+            self.size = 0
+
+        if key in self.keys:
+            row = self.keys.index(key)
+        elif self.size < self.capacity:
+            row = self.size
+            self.size += 1
+        else:
+            row = int(np.argmin(self.last_used[:self.size]))
 
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+        self.vectors[row] = vector
+        self.keys[row] = key
+        self.last_used[row] = time.monotonic()
+
+    def remove(self, row: int):
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.keys[row] = self.keys[last]
+            self.last_used[row] = self.last_used[last]
+        self.keys[last] = None
+        self.last_used[last] = 0.0
+        self.size = last
+
+
+class SemanticCache:
+    """
+    Second cache tier that maps a question to a previously answered, similar
+    question in the same collection. Questions are embedded with the same
+    MiniLM model Chroma uses, so the vector can be reused for retrieval.
+    """
+
+    def __init__(self, embedding_function, threshold: float = 0.92, capacity: int = 256):
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.capacity = capacity
+        self.partitions: Dict[str, SemanticPartition] = {}
+        self.hits = 0
+        self.misses = 0
+        self.hit_similarity_total = 0.0
+        self.last_similarity: Optional[float] = None
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def lookup(self, collection_name: str, vector: np.ndarray) -> Optional[Tuple[str, float]]:
+        partition = self.partitions.get(collection_name)
+        match = partition.nearest(vector) if partition else None
+        if match is not None:
+            self.last_similarity = match[1]
+        if match is None or match[1] < self.threshold:
+            self.misses += 1
+            return None
+
+        row, similarity = match
+        partition.last_used[row] = time.monotonic()
+        self.hits += 1
+        self.hit_similarity_total += similarity
+        return partition.keys[row], similarity
+
+    def add(self, collection_name: str, key: str, vector: np.ndarray):
+        partition = self.partitions.get(collection_name)
+        if partition is None:
+            partition = self.partitions[collection_name] = SemanticPartition(self.capacity)
+        partition.add(key, vector)
+
+    def discard(self, collection_name: str, key: str):
+        partition = self.partitions.get(collection_name)
+        if partition is not None and key in partition.keys[:partition.size]:
+            partition.remove(partition.keys.index(key))
+
+    def clear(self, collection_name: Optional[str] = None):
+        if collection_name is None:
+            self.partitions.clear()
+        else:
+            self.partitions.pop(collection_name, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "entries": sum(partition.size for partition in self.partitions.values()),
+            "partitions": len(self.partitions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "mean_hit_similarity": self.hit_similarity_total / self.hits if self.hits else None,
+            "last_similarity": self.last_similarity,
+        }
+
+
+class InFlightResponse:
+    """Fan-out of one in-progress answer to every request asking the same question.
+
+    The answer is produced by a single background task; each request reads the
+    chunks published so far and then waits for more. The producer is cancelled
+    only once the last subscriber has gone away, so a disconnecting leader does
+    not break the followers that attached to it.
+    """
+
+    def __init__(self):
+        self.chunks: List[Tuple[str, List[Dict], List[float]]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.abandoned = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk: Tuple[str, List[Dict], List[float]]):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncGenerator[Tuple[str, List[Dict], List[float]], None]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self.chunks) or self.done)
+                    pending = self.chunks[index:]
+                    done, error = self.done, self.error
+                index += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if done and index >= len(self.chunks):
+                    if error is not None:
+                        # The original exception, so callers can still tell
+                        # e.g. RateLimitExceeded apart from a failed answer.
+                        raise error
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
 
 
 class RAGPipeline:
@@ -76,73 +378,288 @@ class RAGPipeline:
         cache_capacity: int = 1000,
         cache_ttl: int = 3600,
     ):
-        self.response_cache = ResponseCache(capacity=cache_capacity, ttl=cache_ttl)
+        if state_backend() == "sqlite":
+            self.response_cache = SQLiteResponseCache(shared_store(), capacity=cache_capacity, ttl=cache_ttl)
+        else:
+            self.response_cache = ResponseCache(
+                capacity=cache_capacity,
+                ttl=cache_ttl,
+                max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+                sweep_interval=float(os.getenv("CACHE_SWEEP_INTERVAL", "60")),
+            )
         self.chroma_path = chroma_path or str(resolve_path("VECTORSTORE_PATH", "vectorstore"))
         self.base_collection_name = os.getenv("CHROMA_COLLECTION", "doc_chatbot")
-        self.client = chromadb.PersistentClient(path=self.chroma_path)
-        self.collections = {}
+        self.shared_collection_name = shared_collection_name(self.base_collection_name)
+        self.use_chunk_store = env_bool("CHUNK_STORE", True)
+        self.registry = shared_chroma_registry()
+        self.registry.on_evict(self._forget_collection)
+        self.client = self.registry.client(self.chroma_path)
+        self.collection_stats: Dict[str, CollectionStats] = {}
+        self.lexical_indexes: Dict[str, BM25Index] = {}
+        self.in_flight: Dict[str, InFlightResponse] = {}
+        self.semantic_cache = None
+        if env_bool("SEMANTIC_CACHE", True):
+            self.semantic_cache = SemanticCache(
+                default_embedding_function(),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+                capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", "256")),
+            )
+
+        self.query_batcher = QueryBatcher(
+            default_embedding_function(),
+            window=float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "10")) / 1000,
+            max_batch=int(os.getenv("RETRIEVAL_MAX_BATCH", "16")),
+        )
+
+        self.session_reaper = SessionReaper(
+            self.chroma_path,
+            resolve_path("DOCUMENTS_DIR", "documents"),
+            self.base_collection_name,
+            registry=self.registry,
+            on_drop=self.drop_collection_state,
+        )
 
         logger.info("Using Chroma vector store at: %s", self.chroma_path)
         self.reload_vectorstore()
-        self.llama_helper = LlamaHelper()
+        self.llama_helper = create_llm_backend()
+        self.rate_limiter = LLMRateLimiter.from_env()
 
     def _collection(self, session_id: Optional[str] = None):
         collection_name = collection_name_for_session(self.base_collection_name, session_id)
-        if collection_name not in self.collections:
-            self.collections[collection_name] = self.client.get_or_create_collection(name=collection_name)
-            logger.info("Loaded Chroma collection '%s'", collection_name)
-        return self.collections[collection_name]
+        return self.registry.collection(self.chroma_path, collection_name)
 
-    def reload_vectorstore(self, session_id: Optional[str] = None):
-        """Reconnect to Chroma after newly uploaded documents are persisted."""
-        if session_id is None:
-            self.collections.clear()
-        else:
+    def _shared_collection(self):
+        return self.registry.collection(self.chroma_path, self.shared_collection_name)
+
+    def _forget_collection(self, path: str, collection_name: str):
+        """Drop per-collection state once the registry closes an idle handle."""
+        if path != str(Path(self.chroma_path).resolve()):
+            return
+        self.lexical_indexes.pop(collection_name, None)
+        self.collection_stats.pop(collection_name, None)
+        if self.semantic_cache is not None:
+            self.semantic_cache.clear(collection_name)
+
+    def _collection_stats(self, collection_name: str, collection, lexical: BM25Index) -> CollectionStats:
+        """
+        Re-read the chunk count, and the shared documents the session is linked
+        to, whenever the collection's index is (re)loaded, so queries never ask
+        Chroma or the chunk store.
+        """
+        previous = self.collection_stats.get(collection_name)
+        view = shared_chunk_store().view(collection_name) if self.use_chunk_store else {}
+        shared_chunks = sum(chunks for _, chunks in view.values())
+        stats = CollectionStats(
+            name=collection_name,
+            count=collection.count() + shared_chunks,
+            version=previous.version + 1 if previous else 1,
+            refreshed_at=time.time(),
+            shared_documents=len(view),
+            shared_chunks=shared_chunks,
+            sources={key: names for key, (names, _) in view.items()},
+        )
+        if len(lexical):
+            stats.mean_chunk_tokens = lexical.total_length / len(lexical)
+            stats.vocabulary = len(lexical.postings)
+        return stats
+
+    def _remember_lexical(self, collection_name: str, lexical: BM25Index, stats: CollectionStats):
+        """Publish a loaded index and its stats; called on the event loop only."""
+        if self.lexical_indexes.get(collection_name) is not lexical:
+            self.lexical_indexes[collection_name] = lexical
+            self.collection_stats[collection_name] = stats
+
+    async def collection_info(self, session_id: Optional[str] = None) -> List[Dict]:
+        """Cached metadata for one session's collection, or every loaded collection."""
+        if session_id is not None:
             collection_name = collection_name_for_session(self.base_collection_name, session_id)
-            self.collections.pop(collection_name, None)
-        self.response_cache.cache.clear()
-        self._collection(session_id)
+            lexical, stats = await asyncio.to_thread(self._lexical_index, collection_name, self._collection(session_id))
+            self._remember_lexical(collection_name, lexical, stats)
+            return [self._describe(stats)]
+        return [self._describe(stats) for stats in list(self.collection_stats.values())]
+
+    @staticmethod
+    def _describe(stats: CollectionStats) -> Dict:
+        info = vars(stats).copy()
+        info.pop("sources")
+        return info
+
+    def drop_collection_state(self, collection_name: str):
+        """Forget everything cached for a collection that is being deleted."""
+        self._forget_collection(str(Path(self.chroma_path).resolve()), collection_name)
+        self.response_cache.clear(collection_name)
+
+    def _invalidate(self, session_id: Optional[str]) -> Optional[str]:
+        """Drop cached handles and lexical indexes for one session, or for all of them."""
+        if session_id is None:
+            self.registry.discard(self.chroma_path)
+            self.lexical_indexes.clear()
+            return None
+        collection_name = collection_name_for_session(self.base_collection_name, session_id)
+        self.registry.discard(self.chroma_path, collection_name)
+        self.lexical_indexes.pop(collection_name, None)
+        return collection_name
 
-    async def hybrid_search(self, query: str, k: int = 3, session_id: Optional[str] = None) -> List[SearchResult]:
-        """Semantic vector search with a light keyword relevance boost."""
+    def reload_vectorstore(self, session_id: Optional[str] = None):
+        """Reconnect to Chroma after newly uploaded documents are persisted."""
+        collection_name = self._invalidate(session_id)
+        # Only the affected session's answers are stale after its upload.
+        self.response_cache.clear(collection_name)
+        if self.semantic_cache is not None:
+            self.semantic_cache.clear(collection_name)
+        # Refresh the cached count now, off the query path.
+        name = collection_name_for_session(self.base_collection_name, session_id)
+        self._remember_lexical(name, *self._lexical_index(name, self._collection(session_id)))
+
+    async def areload_vectorstore(self, session_id: Optional[str] = None):
+        """``reload_vectorstore`` for the event loop: Chroma and the index files are read in a worker thread."""
+        collection_name = self._invalidate(session_id)
+        if self.semantic_cache is not None:
+            self.semantic_cache.clear(collection_name)
+        await asyncio.to_thread(self.response_cache.clear, collection_name)
+        name = collection_name_for_session(self.base_collection_name, session_id)
+        lexical, stats = await asyncio.to_thread(self._lexical_index, name, self._collection(session_id))
+        self._remember_lexical(name, lexical, stats)
+
+    async def hybrid_search(
+        self,
+        query: str,
+        k: int = 3,
+        session_id: Optional[str] = None,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> List[SearchResult]:
+        """
+        Hybrid retrieval: vector top-N and BM25 top-N over the session's
+        lexical index, fused with reciprocal rank fusion.
+        """
+        collection_name = collection_name_for_session(self.base_collection_name, session_id)
         collection = self._collection(session_id)
-        count = await asyncio.to_thread(collection.count)
+        # Also picks up chunk counts changed by another worker's upload.
+        with STAGE_SECONDS.time(stage="lexical_load"):
+            lexical, stats = await asyncio.to_thread(self._lexical_index, collection_name, collection)
+        self._remember_lexical(collection_name, lexical, stats)
+        count = stats.count
         if count == 0:
             return []
 
         n_results = min(k * 3, count)
-        raw_results = await asyncio.to_thread(
-            collection.query,
-            query_texts=[query],
-            n_results=n_results,
-            include=["documents", "metadatas", "distances"],
-        )
-
-        documents = raw_results.get("documents", [[]])[0]
-        metadatas = raw_results.get("metadatas", [[]])[0]
-        distances = raw_results.get("distances", [[]])[0]
-        query_tokens = self._important_tokens(query)
+        # The session sees its own collection plus the shared documents it is linked to.
+        scopes = []
+        if count > stats.shared_chunks:
+            scopes.append((collection_name, collection, None, min(n_results, count - stats.shared_chunks)))
+        shared, visible = None, None
+        if stats.sources:
+            shared, visible = self._shared_collection(), {"document": {"$in": sorted(stats.sources)}}
+            scopes.append((self.shared_collection_name, shared, visible, min(n_results, stats.shared_chunks)))
+        if len(scopes) > 1 and query_embedding is None:
+            with STAGE_SECONDS.time(stage="embed"):
+                query_embedding = np.asarray(
+                    (await asyncio.to_thread(self.query_batcher.embed_function, [query]))[0], dtype=np.float32
+                )
+        with STAGE_SECONDS.time(stage="vector_query"):
+            raw_results = await asyncio.gather(*(
+                self.query_batcher.query(name, scope, limit, query, embedding=query_embedding, where=where)
+                for name, scope, where, limit in scopes
+            ))
+        with STAGE_SECONDS.time(stage="bm25_search"):
+            lexical_hits = lexical.search(query, n_results)
+
+        vector_hits = []
+        for raw in raw_results:
+            vector_hits.extend(zip(
+                raw.get("ids", [[]])[0],
+                raw.get("documents", [[]])[0],
+                raw.get("metadatas", [[]])[0],
+                raw.get("distances", [[]])[0],
+            ))
+        vector_hits = sorted(vector_hits, key=lambda hit: hit[3])[:n_results]
+
+        hits: Dict[str, Tuple[str, Dict, Optional[float]]] = {}
+        vector_ranking = [chunk_id for chunk_id, _, _, _ in vector_hits]
+        for chunk_id, content, metadata, distance in vector_hits:
+            hits[chunk_id] = (content, self._visible_metadata(metadata, stats), float(distance))
+
+        lexical_only = [chunk_id for chunk_id, _ in lexical_hits if chunk_id not in hits]
+        if lexical_only:
+            with STAGE_SECONDS.time(stage="lexical_fetch"):
+                fetched = await asyncio.to_thread(self._fetch_chunks, collection, lexical_only, shared, visible)
+            for chunk_id, content, metadata in fetched:
+                hits[chunk_id] = (content, self._visible_metadata(metadata, stats), None)
+
+        fusion_started = time.perf_counter()
+        bm25_scores = dict(lexical_hits)
+        best_bm25 = max(bm25_scores.values(), default=0.0) or 1.0
+        fused = reciprocal_rank_fusion([vector_ranking, [chunk_id for chunk_id, _ in lexical_hits]])
 
         source_groups: dict[str, list[SearchResult]] = {}
-        for content, metadata, distance in zip(documents, metadatas, distances):
-            metadata = metadata or {}
-            vector_score = 1 / (1 + float(distance))
-            keyword_score = self._keyword_score(content, query_tokens)
-            hybrid_score = 0.75 * vector_score + 0.25 * keyword_score
+        for chunk_id, rank_score in fused.items():
+            if chunk_id not in hits:
+                continue
+            content, metadata, distance = hits[chunk_id]
+            vector_score = 1 / (1 + distance) if distance is not None else 0.0
+            keyword_score = bm25_scores.get(chunk_id, 0.0) / best_bm25
             result = SearchResult(
                 content=content,
                 metadata=metadata,
                 vector_score=vector_score,
-                hybrid_score=hybrid_score,
+                hybrid_score=0.75 * vector_score + 0.25 * keyword_score,
+                rank_score=rank_score,
             )
             source = metadata.get("source", "unknown")
             source_groups.setdefault(source, []).append(result)
 
-        candidates = [max(items, key=lambda item: item.hybrid_score) for items in source_groups.values()]
-        top = nlargest(k, candidates, key=lambda item: item.hybrid_score)
+        candidates = [max(items, key=lambda item: item.rank_score) for items in source_groups.values()]
+        top = nlargest(k, candidates, key=lambda item: item.rank_score)
+        STAGE_SECONDS.observe(time.perf_counter() - fusion_started, stage="fusion")
         logger.info("Selected top %s docs for query '%s'", len(top), query)
         return top
 
+    @staticmethod
+    def _visible_metadata(metadata: Optional[Dict], stats: CollectionStats) -> Dict:
+        """Shared rows carry no file name; show the one this session uploaded the document as."""
+        metadata = metadata or {}
+        document = metadata.get("document")
+        if document is None or not stats.sources or document not in stats.sources:
+            return metadata
+        return {**metadata, "source": stats.sources[document]}
+
+    @staticmethod
+    def _fetch_chunks(
+        collection, chunk_ids: List[str], shared=None, where: Optional[Dict] = None
+    ) -> List[Tuple[str, str, Dict]]:
+        """Fetch lexical-only hits from the session's collection, then the rest from its shared documents."""
+        fetched = collection.get(ids=chunk_ids, include=["documents", "metadatas"])
+        found = list(zip(fetched["ids"], fetched["documents"], fetched["metadatas"]))
+        missing = sorted(set(chunk_ids) - set(fetched["ids"]))
+        if missing and shared is not None:
+            fetched = shared.get(ids=missing, where=where, include=["documents", "metadatas"])
+            found.extend(zip(fetched["ids"], fetched["documents"], fetched["metadatas"]))
+        return found
+
+    def _lexical_index(self, collection_name: str, collection) -> Tuple[BM25Index, CollectionStats]:
+        """
+        Return the collection's BM25 index and chunk stats, reloading both when
+        the index file changed. Safe in a worker thread: it reads the shared
+        dicts but leaves publishing the result to ``_remember_lexical``.
+        """
+        index = self.lexical_indexes.get(collection_name)
+        stats = self.collection_stats.get(collection_name)
+        if index is not None and stats is not None and not index.is_stale():
+            return index, stats
+
+        index = BM25Index(lexical_index_path(Path(self.chroma_path), collection_name)).load()
+        if index.mtime is None:
+            with index.locked():
+                # Collections indexed before BM25 existed: build the index once from Chroma,
+                # unless another worker did while this one waited for the lock.
+                index.load()
+                if index.mtime is None:
+                    existing = collection.get(include=["documents"])
+                    index.add_many(zip(existing["ids"], existing["documents"]))
+                    index.save()
+                    logger.info("Built lexical index for '%s' from %s chunks", collection_name, len(index))
+        return index, self._collection_stats(collection_name, collection, index)
+
     async def answer_question_stream(
         self,
         query: str,
@@ -151,15 +668,99 @@ class RAGPipeline:
         history: Optional[List[Dict[str, str]]] = None,
         session_id: Optional[str] = None,
     ) -> AsyncGenerator[Tuple[str, List[Dict], List[float]], None]:
-        cache_key = f"{collection_name_for_session(self.base_collection_name, session_id)}:{query}"
+        collection_name = collection_name_for_session(self.base_collection_name, session_id)
+        self.session_reaper.touch(collection_name)
+        cache_key = f"{collection_name}:{query}"
         if use_cache:
-            cached_response = await self.response_cache.get(cache_key)
+            with STAGE_SECONDS.time(stage="cache_lookup"):
+                cached_response = await self.response_cache.get(cache_key)
+            CACHE_LOOKUPS.inc(cache="exact", result="miss" if cached_response is None else "hit")
             if cached_response is not None:
                 logger.info("Cache hit for query: %s", query)
                 yield cached_response
                 return
 
-        results = await self.hybrid_search(query, k, session_id=session_id)
+        query_embedding = None
+        if use_cache and not history and self.semantic_cache is not None:
+            with STAGE_SECONDS.time(stage="query_embedding"):
+                query_embedding = await asyncio.to_thread(self.semantic_cache.embed, query)
+            match = self.semantic_cache.lookup(collection_name, query_embedding)
+            cached_response = None
+            if match is not None:
+                similar_key, similarity = match
+                cached_response = await self.response_cache.get(similar_key)
+                if cached_response is None:
+                    self.semantic_cache.discard(collection_name, similar_key)
+            CACHE_LOOKUPS.inc(cache="semantic", result="miss" if cached_response is None else "hit")
+            if cached_response is not None:
+                logger.info("Semantic cache hit (%.3f) for query: %s", similarity, query)
+                yield cached_response
+                return
+
+        if not use_cache or history:
+            # Uncached and history-dependent answers are specific to this request.
+            async with aclosing(self._generate_answer(query, k, history, session_id, cache_key, use_cache)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+
+        flight = self.in_flight.get(cache_key)
+        if flight is None or flight.abandoned:
+            flight = InFlightResponse()
+            self.in_flight[cache_key] = flight
+            flight.task = asyncio.create_task(
+                self._run_flight(flight, query, k, session_id, cache_key, query_embedding)
+            )
+        else:
+            CACHE_LOOKUPS.inc(cache="in_flight", result="hit")
+            logger.info("Joining in-flight answer for query: %s", query)
+
+        async with aclosing(flight.subscribe()) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def _run_flight(
+        self,
+        flight: InFlightResponse,
+        query: str,
+        k: int,
+        session_id: Optional[str],
+        cache_key: str,
+        query_embedding: Optional[np.ndarray] = None,
+    ):
+        error = None
+        try:
+            async with aclosing(
+                self._generate_answer(query, k, None, session_id, cache_key, True, query_embedding)
+            ) as chunks:
+                async for chunk in chunks:
+                    await flight.publish(chunk)
+            if query_embedding is not None and self.semantic_cache is not None:
+                collection_name = collection_name_for_session(self.base_collection_name, session_id)
+                self.semantic_cache.add(collection_name, cache_key, query_embedding)
+        except asyncio.CancelledError:
+            error = RuntimeError("Answer generation was cancelled")
+        except Exception as exc:
+            error = exc
+        finally:
+            # The cache has been written by now, so late arrivals hit it
+            # instead of finding a finished flight.
+            if self.in_flight.get(cache_key) is flight:
+                del self.in_flight[cache_key]
+            await flight.finish(error)
+
+    async def _generate_answer(
+        self,
+        query: str,
+        k: int,
+        history: Optional[List[Dict[str, str]]],
+        session_id: Optional[str],
+        cache_key: str,
+        use_cache: bool,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> AsyncGenerator[Tuple[str, List[Dict], List[float]], None]:
+        with STAGE_SECONDS.time(stage="retrieval"):
+            results = await self.hybrid_search(query, k, session_id=session_id, query_embedding=query_embedding)
         if not results:
             response = ("No documents are indexed for this browser session yet. Please upload a document first.", [], [])
             if use_cache:
@@ -167,6 +768,7 @@ class RAGPipeline:
             yield response
             return
 
+        assembly_started = time.perf_counter()
         context = "\n\n".join(result.content for result in results)
         full_query = query
         if history:
@@ -183,23 +785,32 @@ class RAGPipeline:
         metadata = list(source_to_metadata.values())
         scores = [result.hybrid_score for result in results]
         full_response = []
-
-        async for chunk in self.llama_helper.generate_response(context, full_query):
-            full_response.append(chunk)
-            yield (chunk, metadata, scores)
+        STAGE_SECONDS.observe(time.perf_counter() - assembly_started, stage="prompt_assembly")
+
+        usage: Dict = {}
+        tokens, priority = self.rate_limiter.budget(context, full_query)
+        queued = time.perf_counter()
+        async with self.rate_limiter.reserve(tokens, priority) as reservation:
+            started = time.perf_counter()
+            STAGE_SECONDS.observe(started - queued, stage="llm_queue")
+            outcome = "error"
+            try:
+                async with aclosing(self.llama_helper.generate_response(context, full_query, usage=usage)) as chunks:
+                    async for chunk in chunks:
+                        if not full_response:
+                            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+                        full_response.append(chunk)
+                        yield (chunk, metadata, scores)
+                outcome = "ok"
+            except (asyncio.CancelledError, GeneratorExit):
+                outcome = "cancelled"
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_generate")
+                LLM_REQUESTS.inc(outcome=outcome)
+                record_usage(usage)
+            self.rate_limiter.settle(reservation, usage.get("total_tokens"))
 
         if use_cache:
             complete_response = ("".join(full_response), metadata, scores)
             await self.response_cache.put(cache_key, complete_response)
-
-    def _important_tokens(self, text: str) -> set[str]:
-        tokens = re.findall(r"[a-zA-Z0-9]+", text.lower())
-        return {token for token in tokens if len(token) > 2 and token not in STOPWORDS}
-
-    def _keyword_score(self, text: str, query_tokens: set[str]) -> float:
-        if not query_tokens:
-            return 0.0
-
-        text_tokens = set(re.findall(r"[a-zA-Z0-9]+", text.lower()))
-        matches = len(query_tokens & text_tokens)
-        return matches / len(query_tokens)
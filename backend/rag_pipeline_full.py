@@ -1,8 +1,7 @@
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from llama_helper import LlamaHelper
-from typing import List, Dict, Tuple, AsyncGenerator, Optional
-import spacy
+from llama_helper import create_llm_backend
+from metrics import CACHE_LOOKUPS, LLM_REQUESTS, STAGE_SECONDS, record_usage
+from typing import List, Dict, FrozenSet, Tuple, AsyncGenerator, Optional
 import logging
 import os
 from dataclasses import dataclass
@@ -11,7 +10,11 @@ from functools import lru_cache
 import asyncio
 import time
 from collections import OrderedDict
+from contextlib import aclosing
+from prepare_data_full import KEYWORDS_METADATA_KEY, keyword_lemmas, load_keyword_nlp, shared_embeddings
+from rate_limiter import LLMRateLimiter
 from settings import resolve_path
+from state_store import SQLiteResponseCache, shared_store, state_backend
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -49,6 +52,12 @@ class ResponseCache:
         if len(self.cache) > self.capacity:
             self.cache.popitem(last=False)
 
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", "entries": len(self.cache)}
+
 class RAGPipeline:
     """
     Retrieval-Augmented Generation pipeline combining semantic search with keyword relevance.
@@ -61,8 +70,11 @@ class RAGPipeline:
         cache_capacity: int = 1000,
         cache_ttl: int = 3600
     ):
-        # Initialize response cache
-        self.response_cache = ResponseCache(capacity=cache_capacity, ttl=cache_ttl)
+        # Initialize response cache (shared between workers with STATE_BACKEND=sqlite)
+        if state_backend() == "sqlite":
+            self.response_cache = SQLiteResponseCache(shared_store(), capacity=cache_capacity, ttl=cache_ttl)
+        else:
+            self.response_cache = ResponseCache(capacity=cache_capacity, ttl=cache_ttl)
         
         # Load environment settings
         if chroma_path is None:
@@ -74,13 +86,8 @@ class RAGPipeline:
 
         logger.info(f"Using vector store at: {chroma_path}")
 
-        # Initialize embedding function with caching
-        self.embedding_function = CachedEmbeddings(
-            HuggingFaceEmbeddings(
-                model_name=embedding_model,
-                model_kwargs={"device": device}
-            )
-        )
+        # Cached embedding function, shared with the upload processors
+        self.embedding_function = shared_embeddings(embedding_model, device)
 
         # Load or create vector store
         try:
@@ -94,55 +101,57 @@ class RAGPipeline:
             raise
 
         # Initialize LLaMA helper
-        self.llama_helper = LlamaHelper()
+        self.llama_helper = create_llm_backend()
+        self.rate_limiter = LLMRateLimiter.from_env()
 
-        # Load spaCy pipeline with caching
-        try:
-            self.nlp = spacy.load("en_core_web_sm")
-        except OSError:
-            logger.info("Downloading spaCy 'en_core_web_sm' model...")
-            spacy.cli.download("en_core_web_sm")
-            self.nlp = spacy.load("en_core_web_sm")
+        # Tagger/lemmatizer-only spaCy pipeline for query keywords
+        self.nlp = load_keyword_nlp()
 
     @lru_cache(maxsize=1000)
-    def preprocess_query(self, query: str) -> Tuple[str, str]:
+    def preprocess_query(self, query: str) -> Tuple[str, FrozenSet[str]]:
         """
         Preprocess the query with spaCy, with caching.
-        Returns tuple of (enhanced query, serialized doc).
+        Returns tuple of (enhanced query, keyword lemmas).
         """
         doc = self.nlp(query)
         important = [tok.text for tok in doc
-                     if tok.ent_type_ or tok.pos_ in {"NOUN", "VERB", "PROPN"}
+                     if tok.pos_ in {"NOUN", "VERB", "PROPN"}
                      or not (tok.is_stop or tok.is_punct)]
         enhanced = " ".join(important) if important else query.strip()
-        return enhanced, doc.to_bytes().hex()
+        keywords = frozenset(tok.lemma_.lower() for tok in doc if tok.pos_ in {"NOUN", "VERB", "PROPN"})
+        return enhanced, keywords
 
     @lru_cache(maxsize=1000)
-    def calculate_keyword_score(self, text: str, doc_hex: str) -> float:
-        """
-        Compute keyword overlap score with caching.
-        """
-        doc = spacy.tokens.Doc(self.nlp.vocab).from_bytes(bytes.fromhex(doc_hex))
-        doc_text = self.nlp(text.lower())
-        query_tokens = {tok.text.lower() for tok in doc
-                        if tok.ent_type_ or tok.pos_ in {"NOUN", "VERB", "PROPN"}}
-        if not query_tokens:
-            return 0.0
-        matches = sum(1 for tok in doc_text if tok.text in query_tokens)
-        return matches / len(query_tokens)
+    def chunk_keywords(self, text: str) -> FrozenSet[str]:
+        """Fallback for chunks indexed before lemma sets were stored in metadata."""
+        return frozenset(keyword_lemmas(self.nlp(text.lower())))
+
+    def keyword_scores(self, chunks: List, query_keywords: FrozenSet[str]) -> List[float]:
+        """Fraction of query keywords present in each chunk's precomputed lemma set."""
+        if not query_keywords:
+            return [0.0] * len(chunks)
+
+        scores = []
+        for chunk in chunks:
+            stored = chunk.metadata.get(KEYWORDS_METADATA_KEY)
+            lemmas = stored.split() if stored is not None else self.chunk_keywords(chunk.page_content)
+            scores.append(len(query_keywords.intersection(lemmas)) / len(query_keywords))
+        return scores
 
     async def hybrid_search(self, query: str, k: int = 3) -> List[SearchResult]:
         """
         Asynchronous hybrid search combining vector similarity with keyword relevance.
         """
-        processed, doc_hex = self.preprocess_query(query)
+        with STAGE_SECONDS.time(stage="query_preprocess"):
+            processed, query_keywords = self.preprocess_query(query)
         
         # Fetch results asynchronously
-        raw_results = await asyncio.to_thread(
-            self.db.similarity_search_with_score,
-            processed,
-            k=k * 3
-        )
+        with STAGE_SECONDS.time(stage="vector_query"):
+            raw_results = await asyncio.to_thread(
+                self.db.similarity_search_with_score,
+                processed,
+                k=k * 3
+            )
         
         # Group documents by source
         source_groups = {}
@@ -153,26 +162,23 @@ class RAGPipeline:
             source_groups[source].append((doc_obj, dist))
         
         # Select best chunk from each source
+        best = [min(docs, key=lambda x: x[1]) for docs in source_groups.values() if docs]
+        chunks = [doc_obj for doc_obj, _ in best]
+        with STAGE_SECONDS.time(stage="keyword_scoring"):
+            if all(KEYWORDS_METADATA_KEY in chunk.metadata for chunk in chunks):
+                keyword_scores = self.keyword_scores(chunks, query_keywords)
+            else:
+                # Chunks indexed before lemmas were stored run spaCy; keep that off the event loop.
+                keyword_scores = await asyncio.to_thread(self.keyword_scores, chunks, query_keywords)
+
         candidates: List[SearchResult] = []
-        for source, docs in source_groups.items():
-            if not docs:
-                continue
-            
-            # Get the best chunk from this source
-            doc_obj, dist = min(docs, key=lambda x: x[1])
-            
-            # Calculate scores asynchronously
-            keyword_score = await asyncio.to_thread(
-                self.calculate_keyword_score,
-                doc_obj.page_content,
-                doc_hex
-            )
+        for (doc_obj, dist), keyword_score in zip(best, keyword_scores):
             similarity = 1 - dist
             hybrid = 0.7 * similarity + 0.3 * keyword_score
             candidates.append(
                 SearchResult(
                     content=doc_obj.page_content,
-                    metadata=doc_obj.metadata,
+                    metadata={key: value for key, value in doc_obj.metadata.items() if key != KEYWORDS_METADATA_KEY},
                     vector_score=similarity,
                     hybrid_score=hybrid
                 )
@@ -189,7 +195,7 @@ class RAGPipeline:
             persist_directory=self.chroma_path,
             embedding_function=self.embedding_function
         )
-        self.response_cache.cache.clear()
+        self.response_cache.clear()
         logger.info("Reloaded Chroma vectorstore from '%s'", self.chroma_path)
 
     async def answer_question_stream(
@@ -204,13 +210,16 @@ class RAGPipeline:
         """
         # Check cache first if enabled
         if use_cache:
-            cached_response = await self.response_cache.get(query)
+            with STAGE_SECONDS.time(stage="cache_lookup"):
+                cached_response = await self.response_cache.get(query)
+            CACHE_LOOKUPS.inc(cache="exact", result="miss" if cached_response is None else "hit")
             if cached_response is not None:
                 logger.info("Cache hit for query: %s", query)
                 yield cached_response
                 return
 
-        results = await self.hybrid_search(query, k)
+        with STAGE_SECONDS.time(stage="retrieval"):
+            results = await self.hybrid_search(query, k)
         if not results:
             response = ("No relevant information found.", [], [])
             if use_cache:
@@ -219,6 +228,7 @@ class RAGPipeline:
             return
 
         # Assemble context
+        assembly_started = time.perf_counter()
         context = "\n\n".join(r.content for r in results)
         
         # Prepare the full query with history if available
@@ -238,61 +248,34 @@ class RAGPipeline:
         metadata = list(source_to_metadata.values())
         scores = [r.hybrid_score for r in results]
         
-        # Stream the response
-        async for chunk in self.llama_helper.generate_response(context, full_query):
-            full_response.append(chunk)
-            yield (chunk, metadata, scores)
+        STAGE_SECONDS.observe(time.perf_counter() - assembly_started, stage="prompt_assembly")
+
+        # Stream the response once the rate limiter admits the call
+        usage: Dict = {}
+        tokens, priority = self.rate_limiter.budget(context, full_query)
+        queued = time.perf_counter()
+        async with self.rate_limiter.reserve(tokens, priority) as reservation:
+            started = time.perf_counter()
+            STAGE_SECONDS.observe(started - queued, stage="llm_queue")
+            outcome = "error"
+            try:
+                async with aclosing(self.llama_helper.generate_response(context, full_query, usage=usage)) as chunks:
+                    async for chunk in chunks:
+                        if not full_response:
+                            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+                        full_response.append(chunk)
+                        yield (chunk, metadata, scores)
+                outcome = "ok"
+            except (asyncio.CancelledError, GeneratorExit):
+                outcome = "cancelled"
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_generate")
+                LLM_REQUESTS.inc(outcome=outcome)
+                record_usage(usage)
+            self.rate_limiter.settle(reservation, usage.get("total_tokens"))
         
         # Cache the complete response if enabled
         if use_cache:
             complete_response = ("".join(full_response), metadata, scores)
             await self.response_cache.put(query, complete_response)
-
-class CachedEmbeddings:
-    """Wrapper for embedding function with caching and batch processing."""
-    def __init__(self, embeddings, cache_size=1000, batch_size=32):
-        self.embeddings = embeddings
-        self.cache = lru_cache(maxsize=cache_size)(self._embed_documents)
-        self.cache_query = lru_cache(maxsize=cache_size)(self._embed_query)
-        self.batch_size = batch_size
-
-    def _embed_documents(self, text: str) -> List[float]:
-        return self.embeddings.embed_documents([text])[0]
-
-    def _embed_query(self, text: str) -> List[float]:
-        return self.embeddings.embed_query(text)
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed documents with batching and caching support."""
-        results = []
-        # Process in batches
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            # Check cache for each text in batch
-            batch_results = []
-            uncached_texts = []
-            uncached_indices = []
-            
-            for j, text in enumerate(batch):
-                try:
-                    # Try to get from cache
-                    embedding = self.cache(text)
-                    batch_results.append((j, embedding))
-                except KeyError:
-                    uncached_texts.append(text)
-                    uncached_indices.append(j)
-            
-            # Process uncached texts in one batch if any
-            if uncached_texts:
-                embeddings = self.embeddings.embed_documents(uncached_texts)
-                for idx, embedding in zip(uncached_indices, embeddings):
-                    batch_results.append((idx, embedding))
-            
-            # Sort results by original index and append
-            batch_results.sort(key=lambda x: x[0])
-            results.extend(embedding for _, embedding in batch_results)
-        
-        return results
-
-    def embed_query(self, text: str) -> List[float]:
-        return self.cache_query(text)
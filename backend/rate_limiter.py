@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_SHORT = 0
+PRIORITY_NORMAL = 1
+
+
+class RateLimitExceeded(Exception):
+    """The LLM queue is full or the wait would be too long; retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting: about four characters per token."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Continuously refilled bucket holding at most ``capacity`` units."""
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` is available, assuming ``refill`` just ran."""
+        missing = min(amount, self.capacity) - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / self.per_second if self.per_second > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    __slots__ = ("tokens", "priority", "enqueued_at")
+
+    def __init__(self, tokens: int, priority: int):
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class LLMRateLimiter:
+    """
+    Admission control for outbound LLM calls.
+
+    Each call takes one unit from a requests-per-minute bucket and its
+    estimated prompt+completion tokens from a tokens-per-minute bucket, and
+    holds one of ``max_concurrency`` slots while it streams. Calls that cannot
+    start at once wait in a bounded priority queue; short prompts go first.
+    When the queue is full, or a call has waited ``max_wait`` seconds,
+    ``RateLimitExceeded`` is raised so the API can answer 503 with Retry-After.
+    Once the real token usage is known the token bucket is corrected.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 30,
+        tokens_per_minute: float = 6000,
+        max_concurrency: int = 8,
+        max_queue: int = 32,
+        max_wait: float = 30,
+        completion_tokens: int = 512,
+        short_prompt_tokens: int = 1000,
+    ):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.completion_tokens = completion_tokens
+        self.short_prompt_tokens = short_prompt_tokens
+        self.active = 0
+        self.waiters: List[tuple] = []
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self._sequence = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "LLMRateLimiter":
+        return cls(
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "6000")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            max_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", "30")),
+            completion_tokens=int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "512")),
+            short_prompt_tokens=int(os.getenv("LLM_SHORT_PROMPT_TOKENS", "1000")),
+        )
+
+    def budget(self, *prompt_parts: str) -> Tuple[int, int]:
+        """Estimated prompt+completion tokens for a call, and its queue priority."""
+        prompt_tokens = sum(estimate_tokens(part) for part in prompt_parts)
+        priority = PRIORITY_SHORT if prompt_tokens <= self.short_prompt_tokens else PRIORITY_NORMAL
+        return prompt_tokens + self.completion_tokens, priority
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, future in self.waiters if not future.done())
+
+    @asynccontextmanager
+    async def reserve(self, tokens: int, priority: int = PRIORITY_NORMAL) -> AsyncIterator[Reservation]:
+        """Hold a slot and budget for one LLM call; call ``settle`` with the actual usage."""
+        reservation = Reservation(tokens, priority)
+        await self._acquire(reservation)
+        try:
+            yield reservation
+        finally:
+            self.active -= 1
+            self._notify()
+
+    def settle(self, reservation: Reservation, actual_tokens: Optional[int]):
+        """Correct the token bucket once the provider has reported real usage."""
+        if not actual_tokens:
+            return
+        self.tokens.refill(time.monotonic())
+        difference = reservation.tokens - actual_tokens
+        if difference > 0:
+            self.tokens.give_back(difference)
+        else:
+            self.tokens.take(-difference)
+        reservation.tokens = actual_tokens
+        self._notify()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        waits = sorted(self.waits)
+        return {
+            "active": self.active,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "requests_available": round(self.requests.level, 2),
+            "tokens_available": round(self.tokens.level, 1),
+            "wait_ms_mean": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    async def _acquire(self, reservation: Reservation):
+        if not self.queue_depth and self._try_admit(reservation):
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise RateLimitExceeded("LLM request queue is full", self._retry_after(reservation))
+        retry_after = self._retry_after(reservation)
+        if retry_after > self.max_wait:
+            # The buckets cannot refill in time; fail fast instead of queueing.
+            self.rejected += 1
+            raise RateLimitExceeded("LLM rate limit reached", retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (reservation.priority, next(self._sequence), reservation, future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._ensure_dispatcher()
+        self._notify()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return
+            future.cancel()
+            self.timed_out += 1
+            self.rejected += 1
+            raise RateLimitExceeded("Timed out waiting for LLM capacity", self._retry_after(reservation))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller went away: hand the slot back.
+                self.active -= 1
+                self._notify()
+            future.cancel()
+            raise
+
+    def _try_admit(self, reservation: Reservation) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if self.requests.wait_time(1) or self.tokens.wait_time(reservation.tokens):
+            return False
+        self.requests.take(1)
+        self.tokens.take(reservation.tokens)
+        self.active += 1
+        self.admitted += 1
+        self.waits.append(now - reservation.enqueued_at)
+        return True
+
+    def _retry_after(self, reservation: Reservation) -> float:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(1.0, self.requests.wait_time(1), self.tokens.wait_time(reservation.tokens))
+
+    def _ensure_dispatcher(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _dispatch(self):
+        while True:
+            while self.waiters and self.waiters[0][3].done():
+                heapq.heappop(self.waiters)
+            if not self.waiters:
+                return
+
+            _, _, reservation, future = self.waiters[0]
+            if self._try_admit(reservation):
+                heapq.heappop(self.waiters)
+                future.set_result(None)
+                continue
+
+            # Sleep until the buckets refill, or until a slot or a waiter changes.
+            delay = None
+            if self.active < self.max_concurrency:
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(reservation.tokens), 0.001)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
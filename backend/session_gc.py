@@ -0,0 +1,229 @@
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from chroma_registry import ChromaRegistry, shared_chroma_registry
+from chunk_store import shared_chunk_store
+from lexical_index import lexical_index_path
+from settings import collection_name_for_session, file_lock, normalize_session_id, resolve_path, shared_collection_name
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class SessionReaper:
+    """
+    Drops session collections nobody has used for ``ttl`` seconds.
+
+    Activity is recorded as the mtime of ``vectorstore/sessions/<collection>``
+    so every worker sees it. An expired session loses its Chroma collection,
+    uploaded files, manifest, lexical index and its links to shared
+    documents; shared documents no session links to any more are deleted
+    once they pass the chunk store's byte budget. The bundled ``default``
+    session and the shared collection are never reaped.
+
+    Chroma reuses the freed pages of ``chroma.sqlite3`` for new chunks; to
+    shrink the file, run ``python session_gc.py --vacuum`` while the API is
+    stopped. VACUUM holds an exclusive lock for as long as it rewrites the
+    database, which would stall or fail the running workers' queries and
+    ingestion.
+    """
+
+    TOUCH_INTERVAL = 60
+
+    def __init__(
+        self,
+        vectorstore_path: Union[str, Path],
+        documents_dir: Union[str, Path],
+        base_collection_name: str,
+        ttl: Optional[float] = None,
+        registry: Optional[ChromaRegistry] = None,
+        on_drop: Optional[Callable[[str], None]] = None,
+    ):
+        self.vectorstore_path = Path(vectorstore_path)
+        self.documents_dir = Path(documents_dir)
+        self.base_collection_name = base_collection_name
+        self.ttl = ttl if ttl is not None else float(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.registry = registry or shared_chroma_registry()
+        self.on_drop = on_drop
+        self.activity_dir = self.vectorstore_path / "sessions"
+        default_name = collection_name_for_session(base_collection_name, "default")
+        self.shared_name = shared_collection_name(base_collection_name)
+        self.protected = {default_name, self.shared_name}
+        self.prefix = default_name[: -len(normalize_session_id("default"))]
+        self.last_report: Optional[Dict] = None
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, collection_name: str):
+        """Mark a session as used; writes at most once per ``TOUCH_INTERVAL`` per worker."""
+        now = time.time()
+        if now - self._touched.get(collection_name, 0.0) < self.TOUCH_INTERVAL:
+            return
+        self._touched[collection_name] = now
+        try:
+            self.activity_dir.mkdir(parents=True, exist_ok=True)
+            (self.activity_dir / collection_name).touch()
+        except OSError:
+            logger.warning("Could not record activity for '%s'", collection_name)
+
+    def last_activity(self, collection_name: str) -> Optional[float]:
+        session_key = collection_name[len(self.prefix):]
+        paths = [
+            self.activity_dir / collection_name,
+            self.vectorstore_path / "manifests" / f"{collection_name}.json",
+            lexical_index_path(self.vectorstore_path, collection_name),
+            self.documents_dir / "sessions" / session_key,
+        ]
+        times = []
+        for path in paths:
+            try:
+                times.append(path.stat().st_mtime)
+            except OSError:
+                continue
+        return max(times, default=None)
+
+    def collect(self, vacuum: bool = False) -> Dict:
+        """Reap expired sessions; safe to call from any worker. ``vacuum`` is for offline runs only."""
+        with self._lock, self._gc_lock() as acquired:
+            if not acquired:
+                return {"skipped": True, "reason": "another worker is collecting"}
+            report = self._collect(vacuum)
+        self.last_report = report
+        return report
+
+    def _collect(self, vacuum: bool) -> Dict:
+        started = time.perf_counter()
+        bytes_before = self._storage_size()
+        now = time.time()
+        client = self.registry.client(self.vectorstore_path)
+
+        candidates = {collection.name for collection in client.list_collections()}
+        sessions_root = self.documents_dir / "sessions"
+        if sessions_root.exists():
+            candidates.update(self.prefix + path.name for path in sessions_root.iterdir() if path.is_dir())
+
+        expired: List[str] = []
+        for collection_name in sorted(candidates):
+            if not collection_name.startswith(self.prefix) or collection_name in self.protected:
+                continue
+            last_used = self.last_activity(collection_name)
+            if last_used is None:
+                # Sessions from before activity was tracked start their clock now.
+                self.touch(collection_name)
+                continue
+            if now - last_used > self.ttl:
+                expired.append(collection_name)
+
+        for collection_name in expired:
+            self._drop(client, collection_name)
+        if expired:
+            shared_chunk_store().sweep(self.registry.collection(self.vectorstore_path, self.shared_name))
+
+        vacuumed = vacuum and self._vacuum()
+        bytes_after = self._storage_size()
+        report = {
+            "expired_sessions": len(expired),
+            "collections": expired,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "reclaimed_bytes": max(bytes_before - bytes_after, 0),
+            "vacuumed": vacuumed,
+            "ttl_seconds": self.ttl,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "finished_at": time.time(),
+        }
+        if expired:
+            logger.info(
+                "Reaped %s idle sessions, reclaimed %s bytes", len(expired), report["reclaimed_bytes"]
+            )
+        return report
+
+    def _drop(self, client, collection_name: str):
+        self.registry.discard(self.vectorstore_path, collection_name)
+        shared_chunk_store().drop_view(collection_name)
+        if self.on_drop is not None:
+            self.on_drop(collection_name)
+        try:
+            client.delete_collection(name=collection_name)
+        except Exception as exc:
+            # Upload directories without a collection end up here too.
+            logger.debug("No Chroma collection to delete for '%s': %s", collection_name, exc)
+
+        session_key = collection_name[len(self.prefix):]
+        shutil.rmtree(self.documents_dir / "sessions" / session_key, ignore_errors=True)
+        manifest_path = self.vectorstore_path / "manifests" / f"{collection_name}.json"
+        for path in (
+            manifest_path,
+            manifest_path.with_suffix(".lock"),
+            lexical_index_path(self.vectorstore_path, collection_name),
+            lexical_index_path(self.vectorstore_path, collection_name).with_suffix(".lock"),
+            self.activity_dir / collection_name,
+        ):
+            path.unlink(missing_ok=True)
+        self._touched.pop(collection_name, None)
+
+    def _vacuum(self) -> bool:
+        database = self.vectorstore_path / "chroma.sqlite3"
+        if not database.exists():
+            return False
+        if self.registry.has_open_collections(self.vectorstore_path):
+            logger.warning("Not vacuuming %s: collections are open in this process", database)
+            return False
+        try:
+            conn = sqlite3.connect(str(database), timeout=30)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+            return True
+        except sqlite3.Error as exc:
+            logger.warning("Could not vacuum %s: %s", database, exc)
+            return False
+
+    def _storage_size(self) -> int:
+        return directory_size(self.vectorstore_path) + directory_size(self.documents_dir / "sessions")
+
+    def _gc_lock(self):
+        return file_lock(self.activity_dir / ".gc.lock", blocking=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reap idle session collections.")
+    parser.add_argument(
+        "--vacuum", action="store_true",
+        help="Also VACUUM chroma.sqlite3 to shrink it. Stop the API workers first.",
+    )
+    args = parser.parse_args()
+
+    reaper = SessionReaper(
+        resolve_path("VECTORSTORE_PATH", "vectorstore"),
+        resolve_path("DOCUMENTS_DIR", "documents"),
+        os.getenv("CHROMA_COLLECTION", "doc_chatbot"),
+    )
+    report = reaper.collect(vacuum=args.vacuum)
+    logger.info(
+        "Reaped %s sessions, reclaimed %s bytes (vacuumed: %s)",
+        report.get("expired_sessions", 0), report.get("reclaimed_bytes", 0), report.get("vacuumed", False),
+    )
+
+
+if __name__ == "__main__":
+    main()
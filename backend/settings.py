@@ -1,11 +1,18 @@
 import hashlib
 import os
 import re
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
 
 
 BASE_DIR = Path(__file__).resolve().parent
+SESSIONS_DIR = "sessions"
 
 
 def env_bool(name: str, default: bool = False) -> bool:
@@ -37,11 +44,57 @@ def normalize_session_id(session_id: Optional[str]) -> str:
     return hashlib.sha1(raw_session.encode("utf-8")).hexdigest()[:24]
 
 
-def collection_name_for_session(base_name: str, session_id: Optional[str]) -> str:
+def _safe_collection_base(base_name: str) -> str:
     safe_base = re.sub(r"[^a-zA-Z0-9_-]+", "_", base_name).strip("_-") or "doc_chatbot"
-    safe_base = safe_base[:30]
-    return f"{safe_base}_{normalize_session_id(session_id)}"
+    return safe_base[:30]
+
+
+def collection_name_for_session(base_name: str, session_id: Optional[str]) -> str:
+    return f"{_safe_collection_base(base_name)}_{normalize_session_id(session_id)}"
+
+
+def shared_collection_name(base_name: str) -> str:
+    """Collection holding uploaded documents once for every session that uploads them."""
+    return f"{_safe_collection_base(base_name)}_shared"
 
 
 def documents_dir_for_session(base_dir: Path, session_id: Optional[str]) -> Path:
-    return base_dir / "sessions" / normalize_session_id(session_id)
+    return base_dir / SESSIONS_DIR / normalize_session_id(session_id)
+
+
+def bundled_files(base_dir: Path) -> Iterator[Path]:
+    """
+    Files under ``base_dir``, leaving out per-session uploads in ``sessions/``
+    and dot-directories such as the ``.incoming`` upload staging area.
+    """
+    for path in base_dir.glob("**/*"):
+        parts = path.relative_to(base_dir).parts
+        if (len(parts) > 1 and parts[0] == SESSIONS_DIR) or any(part.startswith(".") for part in parts[:-1]):
+            continue
+        if path.is_file():
+            yield path
+
+
+@contextmanager
+def file_lock(lock_path: Path, shared: bool = False, blocking: bool = True) -> Iterator[bool]:
+    """
+    Hold an ``flock`` on ``lock_path`` so worker processes serialize access to a shared file.
+
+    Yields whether the lock is held: with ``blocking=False`` it is ``False``
+    when another process already holds it.
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("a") as handle:
+        try:
+            fcntl.flock(handle, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from settings import resolve_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+CachedResponse = Tuple[str, List[Dict], List[float]]
+T = TypeVar("T")
+
+
+def state_backend() -> str:
+    """Backend for response cache and upload job state: ``memory`` or ``sqlite``."""
+    return os.getenv("STATE_BACKEND", "memory").strip().lower()
+
+
+def state_db_path() -> Path:
+    return resolve_path("STATE_DB_PATH", "state/state.sqlite3")
+
+
+class SQLiteStore:
+    """
+    Shared SQLite database in WAL mode.
+
+    Every gunicorn worker on the host opens the same file, so cached answers
+    and upload job state are visible across workers and survive restarts.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = Path(path) if path else state_db_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def transaction(self, work: Callable[[sqlite3.Connection], T]) -> T:
+        """Run ``work`` inside one write transaction shared with other processes."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self.conn)
+                self.conn.execute("COMMIT")
+                return result
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def executemany(self, statements: List[Tuple[str, tuple]]):
+        def run(conn: sqlite3.Connection):
+            for sql, params in statements:
+                conn.execute(sql, params)
+
+        self.transaction(run)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class SQLiteResponseCache:
+    """
+    Process-shared response cache with TTL, LRU eviction and a byte budget.
+
+    Entry count and total size live in a one-row ``response_cache_totals``
+    table kept current by triggers, and victims are read from the front of
+    the ``last_access`` index, so a ``put`` only touches the rows it evicts.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SQLiteStore] = None,
+        capacity: int = 1000,
+        ttl: int = 3600,
+        max_bytes: Optional[int] = None,
+    ):
+        self.store = store or SQLiteStore()
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.store.transaction(self._create_schema)
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                collection TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS response_cache_lru ON response_cache (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS response_cache_collection ON response_cache (collection)")
+        conn.execute("CREATE INDEX IF NOT EXISTS response_cache_expiry ON response_cache (expires_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                entries INTEGER NOT NULL,
+                bytes INTEGER NOT NULL
+            )
+            """
+        )
+        # Seeded once from the existing rows; the triggers keep it current afterwards.
+        conn.execute(
+            "INSERT OR IGNORE INTO response_cache_totals (id, entries, bytes) "
+            "SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS response_cache_inserted AFTER INSERT ON response_cache BEGIN
+                UPDATE response_cache_totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 1;
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS response_cache_deleted AFTER DELETE ON response_cache BEGIN
+                UPDATE response_cache_totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 1;
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS response_cache_resized AFTER UPDATE OF size ON response_cache BEGIN
+                UPDATE response_cache_totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 1;
+            END
+            """
+        )
+
+    async def get(self, question: str) -> Optional[CachedResponse]:
+        return await asyncio.to_thread(self._get, question)
+
+    async def put(self, question: str, response: CachedResponse):
+        await asyncio.to_thread(self._put, question, response)
+
+    def _get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        rows = self.store.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,))
+        if not rows:
+            return None
+
+        value, expires_at = rows[0]
+        if expires_at < now:
+            self.store.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+
+        self.store.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        answer, metadata, scores = json.loads(value)
+        return answer, metadata, scores
+
+    def _put(self, key: str, response: CachedResponse):
+        now = time.time()
+        value = json.dumps(list(response))
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        collection = key.split(":", 1)[0]
+
+        def run(conn: sqlite3.Connection):
+            # An upsert rather than INSERT OR REPLACE: REPLACE deletes do not fire triggers.
+            conn.execute(
+                "INSERT INTO response_cache (key, collection, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET collection = excluded.collection, value = excluded.value, "
+                "size = excluded.size, expires_at = excluded.expires_at, last_access = excluded.last_access",
+                (key, collection, value, size, now + self.ttl, now),
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            self._evict(conn)
+
+        self.store.transaction(run)
+
+    def _evict(self, conn: sqlite3.Connection):
+        count, total = conn.execute("SELECT entries, bytes FROM response_cache_totals WHERE id = 1").fetchone()
+        if count <= self.capacity and total <= self.max_bytes:
+            return
+
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM response_cache ORDER BY last_access"):
+            if count <= self.capacity and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM response_cache WHERE key = ?", victims)
+
+    def clear(self, collection_name: Optional[str] = None):
+        if collection_name is None:
+            self.store.execute("DELETE FROM response_cache")
+        else:
+            self.store.execute("DELETE FROM response_cache WHERE collection = ?", (collection_name,))
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict:
+        count, total = self.store.execute("SELECT entries, bytes FROM response_cache_totals WHERE id = 1")[0]
+        return {
+            "backend": "sqlite",
+            "entries": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_shared_store: Optional[SQLiteStore] = None
+
+
+def shared_store() -> SQLiteStore:
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = SQLiteStore()
+        logger.info("Using shared state database at %s", _shared_store.path)
+    return _shared_store
+
@@ -0,0 +1,56 @@
+"""
+The chunk store decides which shared-collection documents each session sees
+and which ones may be deleted. Chroma is replaced by a recorder of the
+``where`` filters ``sweep`` deletes with. Run with ``python -m pytest backend/tests``.
+"""
+import pytest
+
+from chunk_store import ChunkStore, DocumentBusy
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, where):
+        self.deleted.append(where["document"])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(tmp_path / "chunks.sqlite3", max_bytes=0)
+
+
+def ingest(store: ChunkStore, sha256: str, view: str, filename: str):
+    if store.begin(sha256, "500:50") is None:
+        store.publish(sha256, "500:50", pages=1, chunks=4, size=100)
+    return store.link(view, filename, sha256, "500:50")
+
+
+def test_sessions_see_only_documents_they_linked(store):
+    ingest(store, "a" * 64, "alice", "handbook.txt")
+    ingest(store, "a" * 64, "bob", "copy.txt")
+
+    key = ChunkStore.key("a" * 64, "500:50")
+    assert store.view("alice") == {key: ("handbook.txt", 4)}
+    assert store.view("bob") == {key: ("copy.txt", 4)}
+    assert store.view("carol") == {}
+    assert store.stats()["documents"] == 1
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_sweep_deletes_documents_no_session_links(store):
+    collection = RecordingCollection()
+    ingest(store, "a" * 64, "alice", "handbook.txt")
+    ingest(store, "a" * 64, "bob", "handbook.txt")
+    replaced = ingest(store, "b" * 64, "alice", "handbook.txt")
+
+    assert replaced == ChunkStore.key("a" * 64, "500:50")
+    assert store.sweep(collection) == 0
+
+    store.drop_view("bob")
+    assert store.sweep(collection) == 1
+    assert collection.deleted == [replaced]
+    with pytest.raises(DocumentBusy):
+        store.link("carol", "handbook.txt", "a" * 64, "500:50")
+    assert store.stats()["documents"] == 1
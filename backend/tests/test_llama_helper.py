@@ -0,0 +1,204 @@
+"""
+Retry behaviour of the Groq client against an in-process stub of the
+OpenAI-compatible ``/chat/completions`` endpoint.
+
+Each stub response is scripted: an error status with ``Retry-After``, a
+stream whose headers arrive late, or a stream that breaks after its first
+token. Run with ``python -m pytest backend/tests``.
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from llama_helper import LlamaHelper, create_llm_backend
+
+
+def frame(content: str) -> str:
+    return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]}) + "\n\n"
+
+
+def status(code: int, headers: dict = None, body: str = ""):
+    async def respond(writer: asyncio.StreamWriter):
+        lines = [f"HTTP/1.1 {code} Stub", f"Content-Length: {len(body)}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n" + body).encode())
+        await writer.drain()
+    return respond
+
+
+def stream(frames: list, delay: float = 0.0, finish: bool = True):
+    """A chunked event stream; ``delay`` holds back the headers, ``finish=False`` drops the connection early."""
+    async def respond(writer: asyncio.StreamWriter):
+        await asyncio.sleep(delay)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+        for data in frames + (["data: [DONE]\n\n"] if finish else []):
+            encoded = data.encode()
+            writer.write(b"%x\r\n%s\r\n" % (len(encoded), encoded))
+            await writer.drain()
+        if finish:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+    return respond
+
+
+class StubServer:
+    """Serves the scripted responses in order, one per request, and records each request body."""
+
+    def __init__(self, responses: list):
+        self.responses = list(responses)
+        self.requests = []
+        self.server = None
+
+    async def __aenter__(self) -> "StubServer":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.decode().split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":", 1)[1])
+            self.requests.append(json.loads(await reader.readexactly(length)))
+            await self.responses.pop(0)(writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+@pytest.fixture
+def groq_env(monkeypatch):
+    monkeypatch.setenv("GROQ_HTTP2", "false")
+    monkeypatch.setenv("GROQ_MAX_RETRIES", "3")
+    monkeypatch.setenv("GROQ_BACKOFF_BASE", "0.01")
+    monkeypatch.setenv("GROQ_BACKOFF_MAX", "0.05")
+    monkeypatch.setenv("GROQ_RETRY_AFTER_MAX", "5")
+    monkeypatch.setenv("GROQ_FIRST_BYTE_TIMEOUT", "0.3")
+
+
+async def collect(responses: list, stream_reply: bool = True):
+    """Run one generation against a stub; return the stub, the yielded chunks, the error and the helper."""
+    async with StubServer(responses) as stub:
+        helper = LlamaHelper(api_key="test-key", api_base=stub.url, model="stub")
+        chunks, error = [], None
+        try:
+            async for chunk in helper.generate_response("context", "question", stream=stream_reply):
+                chunks.append(chunk)
+        except RuntimeError as exc:
+            error = exc
+        finally:
+            await helper.aclose()
+    return stub, chunks, error, helper
+
+
+def test_retry_delay_backs_off_with_jitter_and_honours_retry_after(groq_env, monkeypatch):
+    helper = LlamaHelper(api_key="test-key", api_base="http://127.0.0.1:9")
+    monkeypatch.setattr("llama_helper.random.uniform", lambda low, high: high)
+
+    assert helper._retry_delay(0, None) == pytest.approx(0.01)
+    assert helper._retry_delay(2, None) == pytest.approx(0.04)
+    # Capped by GROQ_BACKOFF_MAX.
+    assert helper._retry_delay(2, None) <= 0.05
+    # Never shorter than Retry-After, and no retry when it exceeds the cap.
+    assert helper._retry_delay(0, 1.5) == pytest.approx(1.5)
+    assert helper._retry_delay(0, 6.0) is None
+    # Out of attempts.
+    assert helper._retry_delay(3, None) is None
+    asyncio.run(helper.aclose())
+
+
+def test_429_is_retried_after_retry_after(groq_env):
+    started = time.perf_counter()
+    stub, chunks, error, helper = asyncio.run(collect([
+        status(429, {"Retry-After": "0.3"}),
+        stream([frame("Hello"), frame(" world")]),
+    ]))
+
+    assert error is None
+    assert "".join(chunks) == "Hello world"
+    assert len(stub.requests) == 2
+    assert helper.retries == 1
+    assert time.perf_counter() - started >= 0.3
+
+
+def test_5xx_is_retried_for_non_streaming_requests(groq_env):
+    body = json.dumps({"choices": [{"message": {"content": "done"}}], "usage": {"total_tokens": 3}})
+    stub, chunks, error, helper = asyncio.run(collect([
+        status(503),
+        status(502),
+        status(200, {"Content-Type": "application/json"}, body),
+    ], stream_reply=False))
+
+    assert error is None
+    assert chunks == ["done"]
+    assert len(stub.requests) == 3
+    assert helper.retries == 2
+
+
+def test_retry_after_above_the_cap_fails_without_waiting(groq_env):
+    started = time.perf_counter()
+    stub, chunks, error, helper = asyncio.run(collect([status(429, {"Retry-After": "120"})]))
+
+    assert isinstance(error, RuntimeError)
+    assert chunks == []
+    assert len(stub.requests) == 1
+    assert helper.retries == 0
+    assert time.perf_counter() - started < 2
+
+
+def test_slow_first_byte_times_out_and_is_retried(groq_env):
+    started = time.perf_counter()
+    stub, chunks, error, helper = asyncio.run(collect([
+        stream([frame("late")], delay=2.0),
+        stream([frame("on time")]),
+    ]))
+
+    assert error is None
+    assert chunks == ["on time"]
+    assert len(stub.requests) == 2
+    assert helper.retries == 1
+    # Abandoned after GROQ_FIRST_BYTE_TIMEOUT rather than waiting for the slow reply.
+    assert time.perf_counter() - started < 1.5
+
+
+def test_stream_is_not_retried_after_the_first_token(groq_env):
+    stub, chunks, error, helper = asyncio.run(collect([
+        stream([frame("Partial")], finish=False),
+        stream([frame("Partial answer repeated")]),
+    ]))
+
+    assert isinstance(error, RuntimeError)
+    assert chunks == ["Partial"]
+    assert len(stub.requests) == 1
+    assert helper.retries == 0
+
+
+def test_openai_backend_never_sends_the_groq_key(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "groq-secret")
+    monkeypatch.setenv("LLM_BACKEND", "openai")
+    monkeypatch.setenv("LLM_API_BASE", "http://127.0.0.1:9/v1")
+    monkeypatch.delenv("LLM_API_KEY", raising=False)
+    helper = create_llm_backend()
+    assert "Authorization" not in helper.client.headers
+
+    monkeypatch.setenv("LLM_API_KEY", "openai-key")
+    keyed = create_llm_backend()
+    assert keyed.client.headers["Authorization"] == "Bearer openai-key"
+    asyncio.run(helper.aclose())
+    asyncio.run(keyed.aclose())
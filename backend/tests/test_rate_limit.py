@@ -0,0 +1,91 @@
+"""
+Requests the LLM rate limiter turns away must reach the client as a 503 with
+``Retry-After``, whether the answer was generated for the request alone
+(history or ``use_cache=False``) or shared by coalesced identical questions.
+
+The pipeline is a bare ``RAGPipeline`` whose ``_generate_answer`` is replaced
+by a stub, so neither Chroma nor an LLM is needed. Run with
+``python -m pytest backend/tests``.
+"""
+import asyncio
+import importlib
+import json
+
+import pytest
+
+from rag_pipeline import RAGPipeline, ResponseCache
+from rate_limiter import RateLimitExceeded
+
+
+class IdleReaper:
+    def touch(self, collection_name: str):
+        pass
+
+
+def stub_pipeline(generate) -> RAGPipeline:
+    pipeline = RAGPipeline.__new__(RAGPipeline)
+    pipeline.base_collection_name = "test"
+    pipeline.session_reaper = IdleReaper()
+    pipeline.response_cache = ResponseCache()
+    pipeline.semantic_cache = None
+    pipeline.in_flight = {}
+    pipeline._generate_answer = generate
+    return pipeline
+
+
+def rejecting(calls: list):
+    async def generate(*args, **kwargs):
+        calls.append(args)
+        # Let every coalesced request join the flight before it fails.
+        await asyncio.sleep(0.05)
+        raise RateLimitExceeded("LLM request queue is full", retry_after=2.5)
+        yield  # pragma: no cover - makes this an async generator
+
+    return generate
+
+
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "state.sqlite3"))
+    main = importlib.import_module("main")
+    monkeypatch.setattr(main, "RAG_PROFILE", "render")
+    return main
+
+
+def test_every_coalesced_request_sees_the_rate_limit_error():
+    calls = []
+    pipeline = stub_pipeline(rejecting(calls))
+
+    async def ask():
+        try:
+            async for _ in pipeline.answer_question_stream("What is the policy?", session_id="alice"):
+                pass
+        except RateLimitExceeded as exc:
+            return exc
+        return None
+
+    async def run():
+        return await asyncio.gather(*(ask() for _ in range(3)))
+
+    errors = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(error, RateLimitExceeded) for error in errors)
+    assert all(error.retry_after == 2.5 for error in errors)
+    assert pipeline.in_flight == {}
+
+
+@pytest.mark.parametrize(
+    "history",
+    [None, [{"role": "user", "content": "Earlier question"}]],
+    ids=["coalesced", "history"],
+)
+def test_rate_limited_question_gets_503_with_retry_after(main_module, monkeypatch, history):
+    monkeypatch.setattr(main_module, "rag_pipeline", stub_pipeline(rejecting([])))
+
+    async def run():
+        return await main_module.answer_response("What is the policy?", history=history, session_id="alice")
+
+    response = asyncio.run(run())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert json.loads(response.body) == {"error": "LLM request queue is full"}
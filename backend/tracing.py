@@ -0,0 +1,257 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+
+from metrics import CACHE_LOOKUPS, STAGE_SECONDS
+from rate_limiter import TokenBucket
+from settings import env_bool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Threads started by asyncio.to_thread run in the loop's default executor.
+WORKER_THREAD_PREFIX = "asyncio_"
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    "request_trace", default=None
+)
+
+
+class RequestTrace:
+    """Stage timings of one /ask request, filled in from the pipeline's stage histograms."""
+
+    def __init__(self, question: str):
+        self.question = question
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.first_chunk: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.cache: Dict[str, str] = {}
+        self.outcome = "ok"
+        self.profile: Optional[Dict] = None
+
+    def add_stage(self, stage: str, seconds: float):
+        # A stage can run more than once per request (e.g. lexical fetches); keep the total.
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def mark_first_chunk(self):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+
+    @property
+    def total(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self) -> Dict:
+        trace = {
+            "total_ms": round(self.total * 1000, 2),
+            "first_chunk_ms": round((self.first_chunk - self.started) * 1000, 2) if self.first_chunk else None,
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            "cache": self.cache,
+            "outcome": self.outcome,
+        }
+        if self.profile is not None:
+            trace["profile"] = self.profile
+        return trace
+
+
+def _record_stage(seconds: float, labels: Dict[str, str]):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(labels.get("stage", ""), seconds)
+
+
+def _record_cache(_, labels: Dict[str, str]):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.cache[labels.get("cache", "")] = labels.get("result", "")
+
+
+STAGE_SECONDS.listeners.append(_record_stage)
+CACHE_LOOKUPS.listeners.append(_record_cache)
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the stacks of the to_thread worker threads every ``interval`` seconds.
+
+    Stacks are collapsed to ``file:function;...`` strings, root first, and
+    counted. The workers are shared by every request, so a profile shows what
+    the pool was busy with while the slow request ran, not only its own work.
+    """
+
+    def __init__(self, interval: float, max_seconds: float, prefix: str = WORKER_THREAD_PREFIX):
+        super().__init__(name="slow-query-sampler", daemon=True)
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.prefix = prefix
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        started = time.perf_counter()
+        deadline = started + self.max_seconds
+        while not self._stop_event.is_set() and time.perf_counter() < deadline:
+            self._sample()
+            self._stop_event.wait(self.interval)
+        self.elapsed = time.perf_counter() - started
+
+    def stop(self, timeout: float = 1.0):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        self.samples += 1
+        for ident, frame in sys._current_frames().items():
+            if not names.get(ident, "").startswith(self.prefix):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def report(self, top: int) -> Dict:
+        # Idle workers all sit in the executor's queue wait; leave them out.
+        busy = [(stack, count) for stack, count in self.stacks.most_common()
+                if not stack.endswith("thread.py:_worker")]
+        return {
+            "samples": self.samples,
+            "duration_ms": round(self.elapsed * 1000, 1),
+            "interval_ms": round(self.interval * 1000, 1),
+            "stacks": [{"stack": stack, "count": count} for stack, count in busy[:top]],
+        }
+
+
+class SlowQueryMonitor:
+    """
+    Times every /ask request and logs those slower than ``threshold`` seconds
+    together with their stage timings.
+
+    A request still running after ``profile_after`` seconds starts a stack
+    sampler over the to_thread workers. Profiles are rate limited by a token
+    bucket (``profiles_per_minute``) and only one runs at a time, so a burst
+    of slow requests costs at most one sampling thread.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 5.0,
+        profile_after: Optional[float] = None,
+        profiles_per_minute: float = 1.0,
+        profile_interval: float = 0.01,
+        profile_max_seconds: float = 30.0,
+        profile_top: int = 10,
+        keep: int = 50,
+    ):
+        self.threshold = threshold
+        self.profile_after = threshold if profile_after is None else profile_after
+        self.profile_budget = TokenBucket(max(profiles_per_minute, 1.0), profiles_per_minute / 60)
+        self.profiles_enabled = profiles_per_minute > 0
+        self.profile_interval = profile_interval
+        self.profile_max_seconds = profile_max_seconds
+        self.profile_top = profile_top
+        self.recent: Deque[Dict] = deque(maxlen=keep)
+        self.slow_queries = 0
+        self.profiles = 0
+        self.profiles_skipped = 0
+        self._sampler: Optional[StackSampler] = None
+        self._profiled: Optional[RequestTrace] = None
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+
+    @classmethod
+    def from_env(cls) -> "SlowQueryMonitor":
+        threshold = float(os.getenv("SLOW_QUERY_SECONDS", "5"))
+        profile_after = os.getenv("SLOW_QUERY_PROFILE_SECONDS")
+        return cls(
+            threshold=threshold,
+            profile_after=float(profile_after) if profile_after else None,
+            profiles_per_minute=float(os.getenv("SLOW_QUERY_PROFILES_PER_MINUTE", "1")),
+            profile_interval=float(os.getenv("SLOW_QUERY_PROFILE_INTERVAL_MS", "10")) / 1000,
+            profile_max_seconds=float(os.getenv("SLOW_QUERY_PROFILE_MAX_SECONDS", "30")),
+        )
+
+    def begin(self, question: str) -> RequestTrace:
+        """Start tracing the current request; pipeline stages recorded from here land in the trace."""
+        trace = RequestTrace(question)
+        _current_trace.set(trace)
+        if self.profiles_enabled:
+            loop = asyncio.get_running_loop()
+            self._timers[id(trace)] = loop.call_later(self.profile_after, self._start_profile, trace)
+        return trace
+
+    def finish(self, trace: RequestTrace, outcome: str = "ok"):
+        if trace.finished is not None:
+            return
+        trace.finished = time.perf_counter()
+        trace.outcome = outcome
+        timer = self._timers.pop(id(trace), None)
+        if timer is not None:
+            timer.cancel()
+        if self._profiled is trace:
+            sampler, self._sampler, self._profiled = self._sampler, None, None
+            sampler.stop()
+            trace.profile = sampler.report(self.profile_top)
+
+        if trace.total >= self.threshold:
+            self.slow_queries += 1
+            # Questions can hold personal data; log a fingerprint to correlate repeats, not the text.
+            entry = {
+                "question_sha256": hashlib.sha256(trace.question.encode("utf-8")).hexdigest()[:16],
+                "question_chars": len(trace.question),
+                "at": time.time(),
+                **trace.as_dict(),
+            }
+            self.recent.append(entry)
+            logger.warning("Slow query (%.2fs): %s", trace.total, json.dumps(entry))
+
+    def stats(self) -> Dict:
+        return {
+            "threshold_seconds": self.threshold,
+            "profile_after_seconds": self.profile_after,
+            "slow_queries": self.slow_queries,
+            "profiles": self.profiles,
+            "profiles_skipped": self.profiles_skipped,
+            "recent": list(self.recent),
+        }
+
+    def _start_profile(self, trace: RequestTrace):
+        self._timers.pop(id(trace), None)
+        if trace.finished is not None:
+            return
+        if self._sampler is not None and not self._sampler.is_alive():
+            # Its request never reached finish(); the sampler hit max_seconds and stopped.
+            self._sampler, self._profiled = None, None
+        self.profile_budget.refill(time.monotonic())
+        if self._sampler is not None or self.profile_budget.wait_time(1):
+            self.profiles_skipped += 1
+            return
+        self.profile_budget.take(1)
+        self.profiles += 1
+        self._sampler = StackSampler(self.profile_interval, self.profile_max_seconds)
+        self._profiled = trace
+        self._sampler.start()
+
+
+def trace_requested(header: Optional[str], param: Optional[bool]) -> bool:
+    """A client opts in with ``?trace=true`` or an ``X-Trace: 1`` header."""
+    if param:
+        return True
+    return bool(header) and header.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def tracing_enabled() -> bool:
+    return env_bool("REQUEST_TRACE_ENABLED", True)
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Set
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Boundaries and part headers on top of the file itself.
+MULTIPART_OVERHEAD = 16 * 1024
+MAX_FIELD_BYTES = 4096
+
+
+def max_upload_bytes() -> int:
+    return int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+def upload_chunk_bytes() -> int:
+    return int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+
+class UploadError(Exception):
+    """A rejected upload; ``status_code`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class ReceivedUpload:
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+class StreamingUpload:
+    """
+    Multipart parser that writes the file part to ``part_path`` as the body
+    arrives, hashing it on the way.
+
+    Starlette's form parser spools the whole body to a temporary file before
+    the endpoint runs; here the bytes go to disk once, in blocks of
+    ``chunk_bytes``, and a file over ``max_bytes`` or with a disallowed
+    extension is rejected as soon as that is known.
+    """
+
+    def __init__(
+        self,
+        content_type: str,
+        part_path: Path,
+        max_bytes: int,
+        allowed_extensions: Set[str],
+        chunk_bytes: int,
+        file_field: str = "file",
+    ):
+        media_type, params = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Expected a multipart/form-data upload")
+        self.part_path = part_path
+        self.max_bytes = max_bytes
+        self.allowed_extensions = allowed_extensions
+        self.chunk_bytes = chunk_bytes
+        self.file_field = file_field
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.filename: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+        self._handle: Optional[BinaryIO] = None
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._error: Optional[UploadError] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._part_name: Optional[str] = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+        self.parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    async def receive(self, stream: AsyncIterator[bytes]) -> ReceivedUpload:
+        try:
+            try:
+                async for chunk in stream:
+                    self.parser.write(chunk)
+                    if self._error is not None:
+                        raise self._error
+                    if self._pending_bytes >= self.chunk_bytes:
+                        await self._flush()
+                self.parser.finalize()
+            except MultipartParseError as exc:
+                raise UploadError(f"Malformed multipart upload: {exc}") from exc
+            if self._error is not None:
+                raise self._error
+            if self.filename is None:
+                raise UploadError(f"Missing `{self.file_field}` file field")
+            await self._flush()
+            await asyncio.to_thread(self._close)
+        except BaseException:
+            await asyncio.to_thread(self._discard)
+            raise
+        return ReceivedUpload(self.filename, self.part_path, self.size, self.digest.hexdigest(), self.fields)
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        block = b"".join(self._pending)
+        self._pending.clear()
+        self._pending_bytes = 0
+        # hashlib and file writes release the GIL for large blocks.
+        await asyncio.to_thread(self._write, block)
+
+    def _write(self, block: bytes):
+        if self._handle is None:
+            self._handle = self.part_path.open("wb")
+        self.digest.update(block)
+        self._handle.write(block)
+
+    def _close(self):
+        if self._handle is None:
+            # An empty file still gets a (zero-byte) part on disk.
+            self._handle = self.part_path.open("wb")
+        self._handle.close()
+
+    def _discard(self):
+        if self._handle is not None:
+            self._handle.close()
+        self.part_path.unlink(missing_ok=True)
+
+    def _fail(self, error: UploadError):
+        if self._error is None:
+            self._error = error
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part_name = None
+        self._part_is_file = False
+        self._field_value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in options or self._part_name != self.file_field:
+            return
+        if self.filename is not None:
+            self._fail(UploadError("Upload exactly one file per request"))
+            return
+        self.filename = Path(options[b"filename"].decode("utf-8", "replace")).name
+        self._part_is_file = True
+        if not self.filename:
+            self._fail(UploadError("Uploaded file must have a filename"))
+        elif Path(self.filename).suffix.lower() not in self.allowed_extensions:
+            allowed = ", ".join(sorted(self.allowed_extensions))
+            self._fail(UploadError(f"File type not allowed. Allowed types: {allowed}"))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._error is not None:
+            return
+        if not self._part_is_file:
+            self._field_value += data[start:end]
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                self._fail(UploadError(f"Form field `{self._part_name}` is too large"))
+            return
+        self.size += end - start
+        if self.size > self.max_bytes:
+            self._fail(UploadError(f"File exceeds the {self.max_bytes} byte upload limit", status_code=413))
+            return
+        self._pending.append(data[start:end])
+        self._pending_bytes += end - start
+
+    def _on_part_end(self):
+        if not self._part_is_file and self._part_name:
+            self.fields[self._part_name] = self._field_value.decode("utf-8", "replace")
+
+
+def check_content_length(headers, max_bytes: int):
+    """Refuse a body that announces itself as too large before reading any of it."""
+    declared = headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + MULTIPART_OVERHEAD:
+        raise UploadError(f"File exceeds the {max_bytes} byte upload limit", status_code=413)
+
+
+def sweep_incoming(incoming_dir: Path, older_than: float = 3600) -> int:
+    """Delete partial uploads left behind by a crashed worker."""
+    removed = 0
+    cutoff = time.time() - older_than
+    for part in incoming_dir.glob("*.part"):
+        try:
+            if part.stat().st_mtime < cutoff:
+                part.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info("Removed %s abandoned partial uploads from %s", removed, incoming_dir)
+    return removed
@@ -121,6 +121,12 @@ function App() {
         onDownloadProgress: (progressEvent) => {
           const text = progressEvent.event.target.responseText;
           const lines = text.split('\n');
+          // The backend streams answer deltas, so rebuild the full answer
+          // from every chunk received so far on each progress event.
+          let content = '';
+          let metadata = [];
+          let scores = [];
+          let received = false;
           
           for (const line of lines) {
             if (line.startsWith('data: ')) {
@@ -141,27 +147,36 @@ function App() {
                   return;
                 }
 
-                setMessages(prev => {
-                  const newMessages = [...prev];
-                  const lastMessage = newMessages[newMessages.length - 1];
-                  
-                  if (lastMessage.role === 'assistant') {
-                    // Check if this chunk is already in the content to avoid duplication
-                    if (!lastMessage.content.includes(parsedData.chunk)) {
-                      lastMessage.content = parsedData.chunk;  // Replace instead of append
-                      lastMessage.metadata = parsedData.metadata;
-                      lastMessage.scores = parsedData.scores;
-                      lastMessage.isStreaming = true;
-                    }
-                  }
-                  
-                  return newMessages;
-                });
+                if (typeof parsedData.chunk === 'string') {
+                  content += parsedData.chunk;
+                  metadata = parsedData.metadata || metadata;
+                  scores = parsedData.scores || scores;
+                  received = true;
+                }
               } catch (error) {
                 console.error('Failed to parse SSE data:', error);
               }
             }
           }
+
+          if (received) {
+            setMessages(prev => {
+              const newMessages = [...prev];
+              const lastMessage = newMessages[newMessages.length - 1];
+
+              if (lastMessage.role === 'assistant') {
+                newMessages[newMessages.length - 1] = {
+                  ...lastMessage,
+                  content,
+                  metadata,
+                  scores,
+                  isStreaming: true
+                };
+              }
+
+              return newMessages;
+            });
+          }
         }
       });
     } catch (error) {